@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Command benchmark for the cell CLI, against the local (in-memory) backend.
+
+Every subcommand is run against synthetic cells of several sizes, each run in
+a fresh interpreter. The first run of a command starts with an empty
+inventory cache (cold), the following ones reuse it (warm). For each command
+it records the wall time of `cell.main()` (interpreter start and the seeding
+of the synthetic cells excluded) and the number of AWS API calls it made.
+
+ssh, tmux, mux, i2cssh, dcos and pkill are replaced by no-op scripts, so no
+connection is opened and no running proxy gets killed.
+
+Usage:
+  benchmarks/commands.py [--sizes <n,n,..>] [--runs <n>] [--only <command>]
+                         [--save <baseline>] [--baseline <baseline>]
+                         [--tolerance <ratio>] [--verbose]
+
+  --save writes the measurements as a JSON baseline
+  --baseline compares against a previously saved baseline and exits with 1
+    if any command made more API calls, or got slower than
+    baseline * (1 + tolerance)
+  --verbose prints the API calls of each command, per operation
+"""
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# {cell} is the synthetic cell, {size} its number of instances
+COMMANDS = [
+    ["list"],
+    ["list", "--all-regions"],
+    ["list", "{cell}"],
+    ["list", "{cell}", "--output", "ndjson"],
+    ["build", "{cell}"],
+    ["seed", "{cell}"],
+    ["update", "{cell}", "--wait"],
+    ["scale", "{cell}", "stateless-body", "{size}"],
+    ["scale", "{cell}", "stateless-body={size}", "membrane=3", "--wait"],
+    ["ssh", "{cell}", "nucleus", "1"],
+    ["cmd", "{cell}", "nucleus", "1", "uptime"],
+    ["cmd", "{cell}", "all", "*", "uptime"],
+    ["log", "{cell}", "nucleus", "1"],
+    ["i2cssh", "{cell}"],
+    ["mux", "{cell}"],
+    ["proxy", "{cell}"],
+    ["dcos", "{cell}", "package", "list"],
+    ["disconnect", "{cell}"],
+    ["create", "{cell}new", "--wait"],
+    ["delete", "{cell}", "--wait"],
+]
+
+# replaced by no-op scripts
+TOOLS = ["ssh", "tmux", "mux", "i2cssh", "dcos", "pkill"]
+
+# runs a command and reports its time and API calls
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {dir!r})
+import cell
+start = time.time()
+try:
+    cell.main(["cell"] + sys.argv[1:] + ["--backend", "local"])
+    code = 0
+except SystemExit as e:
+    code = e.code if isinstance(e.code, int) else int(e.code is not None)
+elapsed = time.time() - start
+calls = {{}}
+for account in getattr(sys.modules.get("backend"), "ACCOUNTS", {{}}).values():
+    elapsed -= account.seed_seconds
+    for operation, count in account.calls.items():
+        calls[operation] = calls.get(operation, 0) + count
+sys.stderr.write("\\n" + json.dumps(
+    {{"elapsed": elapsed, "exit": code, "calls": calls}}))
+"""
+
+
+def run_probe(args, env, stdin=""):
+    """
+    :return: {"elapsed": .., "exit": .., "calls": {operation: count},
+        "output": <stdout>}, with the stderr as "error" when the probe failed
+    """
+    cmd = [sys.executable, "-c", PROBE.format(dir=DIR)] + args
+    proc = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate(stdin.encode("utf-8"))
+    if not isinstance(out, str):
+        out, err = out.decode("utf-8"), err.decode("utf-8")
+    lines = err.strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        result = {"elapsed": 0, "exit": proc.returncode, "calls": {},
+                  "error": err}
+    result["output"] = out
+    return result
+
+
+def setup_home(home, whitelist):
+    os.makedirs(os.path.join(home, ".cellos"))
+    # cell mux writes its tmuxinator project there
+    os.makedirs(os.path.join(home, ".tmuxinator"))
+    with open(os.path.join(home, ".cellos", "config"), "w") as f:
+        f.write("[default]\nregion=us-west-1\n")
+    with open(whitelist, "w") as f:
+        json.dump({"networks": [
+            {"net_address": "10.0.0.0", "net_mask": 8},
+        ]}, f)
+    bin_dir = os.path.join(home, "bin")
+    os.makedirs(bin_dir)
+    for tool in TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(path, 0o755)
+    return bin_dir
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--sizes", default="5,200,2000")
+    parser.add_option("--runs", type="int", default=3)
+    parser.add_option("--only", dest="only")
+    parser.add_option("--save", dest="save")
+    parser.add_option("--baseline", dest="baseline")
+    parser.add_option("--tolerance", type="float", default=0.25)
+    parser.add_option("--verbose", action="store_true", default=False)
+    (options, _) = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(",")]
+    cells = dict((size, "bench{}".format(size)) for size in sizes)
+
+    # isolated home, so the benchmark doesn't touch the user's ~/.cellos
+    home = tempfile.mkdtemp(prefix="cell-bench-")
+    whitelist = os.path.join(home, "net-whitelist.json")
+    bin_dir = setup_home(home, whitelist)
+    env = dict(os.environ,
+               HOME=home,
+               PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+               NET_WHITELIST_URL=whitelist,
+               LOCAL_CELLS=",".join("{}:{}".format(cells[size], size)
+                                    for size in sizes),
+               AWS_DEFAULT_REGION="us-west-1")
+    # each cell gets its own bucket
+    env.pop("CELL_BUCKET", None)
+
+    results = {}
+    print("{:<6} {:<52} {:>4} {:>10} {:>10} {:>6} {:>6}".format(
+        "size", "command", "exit", "cold ms", "warm ms", "cold", "warm"))
+    try:
+        for size in sizes:
+            cell = cells[size]
+            for template in COMMANDS:
+                if options.only and template[0] != options.only:
+                    continue
+                args = [arg.format(cell=cell, size=size) for arg in template]
+                name = "{} {}".format(size, " ".join(template))
+                stdin = cell + "\n" if args[0] == "delete" else ""
+                if len(args) > 1 and not args[1].startswith("-"):
+                    cache = os.path.join(home, ".cellos", "generated",
+                                         args[1], "inventory.json")
+                    if os.path.exists(cache):
+                        os.remove(cache)
+                runs = [run_probe(args, env, stdin)
+                        for _ in range(options.runs)]
+                cold, warm = runs[0], runs[1:] or runs
+                warm_ms = sorted(r["elapsed"] for r in warm)[len(warm) // 2] * 1000
+                cold_calls = sum(cold["calls"].values())
+                warm_calls = max(sum(r["calls"].values()) for r in warm)
+                results[name] = {
+                    "exit": cold["exit"],
+                    "cold_ms": cold["elapsed"] * 1000,
+                    "warm_ms": warm_ms,
+                    "cold_calls": cold_calls,
+                    "warm_calls": warm_calls,
+                }
+                print("{:<6} {:<52} {:>4} {:>10.1f} {:>10.1f} {:>6} {:>6}".format(
+                    size, " ".join(template), cold["exit"],
+                    cold["elapsed"] * 1000, warm_ms, cold_calls, warm_calls))
+                if options.verbose:
+                    for operation, count in sorted(cold["calls"].items()):
+                        print("    {:>6} {}".format(count, operation))
+                    if "error" in cold:
+                        print(cold["error"])
+    finally:
+        shutil.rmtree(home)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name in sorted(results):
+            if name not in baseline:
+                continue
+            before, after = baseline[name], results[name]
+            for key in ["cold_calls", "warm_calls"]:
+                if after[key] > before[key]:
+                    regressions.append((name, key, before[key], after[key]))
+            if after["warm_ms"] > before["warm_ms"] * (1 + options.tolerance):
+                regressions.append(
+                    (name, "warm_ms", before["warm_ms"], after["warm_ms"]))
+        for name, key, before, after in regressions:
+            print("REGRESSION {} {}: {:.1f} -> {:.1f}".format(
+                name, key, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Cold start benchmark for the cell CLI.
+
+For each subcommand it starts a fresh interpreter, runs `cell.main()` up to the
+point where the command would be dispatched (no AWS calls are made) and
+records the wall time. It also reports which heavy modules got imported on the
+way, as those should only be loaded by the commands that need them.
+
+Usage:
+  benchmarks/startup.py [--runs <n>] [--save <baseline>] [--baseline <baseline>]
+                        [--tolerance <ratio>] [--importtime]
+
+  --save writes the measured medians as a JSON baseline
+  --baseline compares against a previously saved baseline and exits with 1
+    if any subcommand got slower than baseline * (1 + tolerance)
+  --importtime (Python >= 3.7) dumps the slowest imports of each subcommand
+"""
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+SUBCOMMANDS = [
+    ["--version"],
+    ["--help"],
+    ["list"],
+    ["list", "bench"],
+    ["ssh", "bench", "nucleus", "1"],
+    ["cmd", "bench", "nucleus", "1", "uptime"],
+    ["log", "bench"],
+    ["mux", "bench"],
+    ["proxy", "bench"],
+    ["scale", "bench", "nucleus", "3"],
+    ["dcos", "bench", "package", "list"],
+]
+
+# modules that should not be loaded before the subcommand runs
+HEAVY_MODULES = ["boto3", "botocore", "dcos", "awscli", "pystache", "toml",
+                 "curses", "requests"]
+
+# runs the cli up to the command dispatch
+PROBE = """
+import json, sys
+sys.path.insert(0, {dir!r})
+import cell
+cell.Cell.run = lambda self, **kwargs: None
+try:
+    cell.main(["cell"] + sys.argv[1:])
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([m for m in {heavy!r} if m in sys.modules]))
+"""
+
+
+def run_probe(args, env, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", PROBE.format(dir=DIR, heavy=HEAVY_MODULES)] + args
+    start = time.time()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    elapsed = time.time() - start
+    if not isinstance(err, str):
+        err = err.decode("utf-8")
+    lines = err.strip().splitlines()
+    loaded = json.loads(lines[-1]) if lines else []
+    return elapsed, loaded, lines[:-1]
+
+
+def slowest_imports(lines, top=10):
+    # import time: self [us] | cumulative | imported package
+    entries = []
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        entries.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--runs", type="int", default=5)
+    parser.add_option("--save", dest="save")
+    parser.add_option("--baseline", dest="baseline")
+    parser.add_option("--tolerance", type="float", default=0.25)
+    parser.add_option("--importtime", action="store_true", default=False)
+    (options, _) = parser.parse_args()
+
+    # isolated home, so the benchmark doesn't touch the user's ~/.cellos
+    home = tempfile.mkdtemp(prefix="cell-bench-")
+    os.makedirs(os.path.join(home, ".cellos"))
+    with open(os.path.join(home, ".cellos", "config"), "w") as f:
+        f.write("[default]\nregion=us-west-1\n")
+    env = dict(os.environ, HOME=home)
+
+    results = {}
+    try:
+        for args in SUBCOMMANDS:
+            name = " ".join(args)
+            timings = []
+            loaded = []
+            for _ in range(options.runs):
+                elapsed, loaded, _ = run_probe(args, env)
+                timings.append(elapsed)
+            median = sorted(timings)[len(timings) // 2]
+            results[name] = median
+            print("{:<40} {:>8.1f} ms  {}".format(
+                name, median * 1000, ",".join(loaded)))
+            if options.importtime and sys.version_info >= (3, 7):
+                _, _, lines = run_probe(args, env, importtime=True)
+                for self_us, module in slowest_imports(lines):
+                    print("    {:>8.1f} ms {}".format(self_us / 1000.0, module))
+    finally:
+        shutil.rmtree(home)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = [
+            (name, baseline[name], results[name])
+            for name in sorted(results)
+            if name in baseline
+            and results[name] > baseline[name] * (1 + options.tolerance)
+        ]
+        for name, before, after in regressions:
+            print("REGRESSION {}: {:.1f} ms -> {:.1f} ms".format(
+                name, before * 1000, after * 1000))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
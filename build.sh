@@ -20,6 +20,9 @@ pip -V
 
 pip install -r requirements.txt
 
+# startup and command regression tests, against the local backend
+python -m unittest discover -s tests
+
 rm -rf build
 mkdir build
 
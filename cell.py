@@ -10,20 +10,23 @@
  ╚═════╝╚══════╝╚══════╝╚═════╝         ╚═════╝  ╚══════╝     ╚═╝═╝ ╚══════╝
 
 Usage:
-  cell create <cell-name> [--cidr <cidr>] [--backend <backend>] [--cell_config <config>]
-  cell list [<cell-name>] [--backend <backend>] [--cell_config <config>]
-  cell update <cell-name> [--backend <backend>] [--cell_config <config>]
-  cell seed <cell-name> [--backend <backend>] [--cell_config <config>]
-  cell delete <cell-name> [--backend <backend>] [--cell_config <config>]
-  cell scale <cell-name> <role> <capacity> [--backend <backend>] [--cell_config <config>]
-  cell log <cell-name> [<role> <index>] [--backend <backend>] [--cell_config <config>]
-  cell dcos <cell-name> [--backend <backend>] [--cell_config <config>]
-  cell ssh <cell-name> <role> <index> [--backend <backend>] [--cell_config <config>]
-  cell i2cssh <cell-name> [<role>] [--backend <backend>] [--cell_config <config>]
-  cell mux <cell-name> [<role>] [--backend <backend>] [--cell_config <config>]
-  cell proxy <cell-name> [--backend <backend>] [--cell_config <config>]
-  cell cmd <cell-name> <role> <index> <command> [--backend <backend>] [--cell_config <config>]
+  cell create <cell-name> [--cidr <cidr>] [--wait] [--wait-timeout <seconds>] [--backend <backend>] [--cell_config <config>] [--trace]
+  cell list [<cell-name>] [--output <format>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--refresh] [--trace]
+  cell list --all-regions [--output <format>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--refresh] [--trace]
+  cell update <cell-name> [--wait] [--wait-timeout <seconds>] [--backend <backend>] [--cell_config <config>] [--trace]
+  cell seed <cell-name> [--backend <backend>] [--cell_config <config>] [--trace]
+  cell delete <cell-name> [--wait] [--wait-timeout <seconds>] [--backend <backend>] [--cell_config <config>] [--trace]
+  cell scale <cell-name> <scaling>... [--wait] [--wait-timeout <seconds>] [--yes] [--output <format>] [--backend <backend>] [--cell_config <config>] [--trace]
+  cell log <cell-name> [<role> <index>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
+  cell dcos <cell-name> [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
+  cell ssh <cell-name> <role> <index> [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
+  cell i2cssh <cell-name> [<role>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
+  cell mux <cell-name> [<role>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
+  cell proxy <cell-name> [--supervise] [--tunnels <n>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
+  cell disconnect <cell-name> [--backend <backend>] [--cell_config <config>]
+  cell cmd <cell-name> <role> <index> <command> [--parallel <n>] [--host-timeout <seconds>] [--output <format>] [--backend <backend>] [--cell_config <config>] [--no-cache] [--trace]
   cell build <cell-name> [--cidr <cidr>] [--template-url <substack-template-url>] [--backend <backend>] [--cell_config <config>]
+  cell agent [--stop] [--backend <backend>] [--cell_config <config>]
   cell (-h | --help)
   cell --version
 
@@ -33,6 +36,34 @@ Options:
   --template-url <substack-template-url> The path of the substack template to burn in the stack [default: set path to template].
   --backend <backend> The Cell backend implementation to use
   --cell_config <config> The configuration section to read values from
+  --no-cache             Ignore the local inventory cache and refresh it
+  --refresh              Drop the cached inventory of the cell (or the cell
+                         listing), and the one of the agent, before listing
+  --all-regions          List the cells of all the regions (or of AWS_REGIONS)
+  --parallel <n>         Maximum number of nodes `cmd` runs on at once [default: 10]
+  --host-timeout <seconds> Per node `cmd` timeout, in seconds
+  --wait                 Stream the stack events until the operation completes.
+                         Exits with 0 on success, 1 on failure or rollback
+                         and 2 on timeout. For `scale`, waits until the new
+                         instances are in service, healthy behind their load
+                         balancers and provisioned
+  --wait-timeout <seconds> Maximum time `--wait` waits for, in seconds
+  --yes                  Scale the nucleus or stateful-body down without
+                         asking for confirmation
+  --trace                Record the AWS API calls to <tmp>/trace.jsonl and
+                         print a summary by operation
+  --output <format>      table, or json, ndjson and tsv for scripts. Rows are
+                         written as they come, messages go to stderr
+                         [default: table]
+  --stop                 Stop the running `cell agent`
+  --supervise            Keep `proxy` in the foreground and spread the SOCKS
+                         port over several health checked ssh tunnels, which
+                         are reconnected when they fail or their node goes away
+  --tunnels <n>          Number of `proxy --supervise` tunnels, each to a
+                         different stateless-body node [default: 2]
+
+`scale` takes <role>=<capacity> pairs (e.g. stateless-body=10 membrane=3),
+applied concurrently, or a single <role> <capacity> pair.
 
 Environment variables:
 
@@ -41,6 +72,22 @@ Environment variables:
   SSH_USER - instances ssh login user (defaults to centos)
   SSH_TIMEOUT - ssh timeout in seconds (defaults to 5)
   SSH_OPTIONS - extra ssh options
+  SSH_CONTROL_PERSIST - how long idle ssh master connections are kept open
+    (defaults to 10m, "no" disables connection sharing)
+  PROXY_CHECK_SECONDS - interval of the `proxy --supervise` health checks
+    (defaults to 10)
+  CACHE_EXPIRY_SECONDS - local inventory and config cache TTL (defaults to 180)
+  HTTP_TIMEOUT - timeout of remote config downloads, in seconds (defaults to 5)
+  AWS_REGIONS - comma separated regions listed by `list --all-regions`
+    (defaults to all the regions enabled for the account)
+  STACK_CATALOG_TTL - seconds the cell stack listing of `list` is reused
+    (defaults to 30)
+  CELL_AGENT_SOCKET - Unix socket of `cell agent` (defaults to
+    ~/.cellos/agent.sock)
+  AGENT_REFRESH_SECONDS - how often `cell agent` refreshes the stack and
+    inventory of the cells in use (defaults to 60)
+  AGENT_IDLE_SECONDS - after how long without queries `cell agent` stops
+    refreshing a cell (defaults to 1800)
 
 All AWS CLI environment variables (e.g. AWS_DEFAULT_REGION, AWS_ACCESS_KEY_ID,
 AWS_SECRET_ACCESS_KEY, etc.) and configs apply.
@@ -54,9 +101,16 @@ Github git.corp.adobe.com/metal-cell/cell-os
 Slack https://adobe.slack.com/messages/metal-cell/
 """
 
+# NOTE: keep the module level imports light, as they are paid for by every
+# command (including `cell --version`). Heavy dependencies (dcos, awscli,
+# pystache, toml, curses, requests) are imported where they are used.
+# See benchmarks/startup.py
 import ConfigParser
-import curses
+import collections
 import datetime
+import errno
+import gzip
+import hashlib
 import logging
 import logging.config
 import decorator
@@ -64,21 +118,18 @@ import imp
 import inspect
 import json
 import os
-import requests
 import sh
+import shlex
 import shutil
+import signal
+import stat
 import sys
+import tarfile
 import textwrap
+import threading
 import time
 import traceback
 
-import colorama
-import dcos.package
-import pystache
-
-from pystache.context import KeyNotFoundError
-from pystache.renderer import Renderer
-from pystache.defaults import DECODE_ERRORS
 from termcolor import colored
 if os.name == 'posix' and sys.version_info[0] < 3:
     import subprocess32 as subprocess
@@ -86,15 +137,29 @@ else:
     import subprocess
 
 from docopt import docopt
-import toml
 import yaml
 
+log = logging.getLogger('cell-cli')
+
 def arity(obj, method):
     return getattr(obj.__class__, method).func_code.co_argcount - 1
 
-mkdir_p = sh.mkdir.bake("-p")
-tar_zcf = sh.tar.bake("zcf")
-tar_zxf = sh.tar.bake("zxf")
+# fixed mtime of the seed archive entries, for reproducible builds
+SEED_MTIME = 1451606400
+
+def seed_file_mode(mode, is_dir=False):
+    """
+    Normalizes permissions to 0755 / 0644, so the seed archive doesn't
+    depend on the umask of the checkout
+    """
+    return 0755 if is_dir or stat.S_ISDIR(mode) or mode & 0100 else 0644
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
 
 def deep_merge(a, b):
     """
@@ -122,20 +187,99 @@ def flatten(l):
     [[a]] -> [a]
     [[a, b, c], d, [[e]]] -> [a, b, c, d, e]
     """
-    def _flat(l, r):
-        if type(l) is not list:
-            r.append(l)
-        else:
-            for i in l:
-                r = r + flatten(i)
-        return r
-    return _flat(l, [])
+    return list(iter_flatten(l))
+
 
+def iter_flatten(l):
+    """
+    Lazy version of flatten, it also accepts generators (e.g. the instance
+    rows streamed by the backend)
+    """
+    if type(l) is not list and not inspect.isgenerator(l):
+        yield l
+    else:
+        for i in l:
+            for j in iter_flatten(i):
+                yield j
+
+
+def http_cache_path(url):
+    return os.path.join(os.path.expanduser("~/.cellos/http-cache"),
+                        hashlib.sha256(url.encode("utf-8")).hexdigest())
 
-def readify(path):
+
+def fetch_url(url, max_age=0, binary=False):
+    """
+    GETs a URL through a conditional-GET cache (~/.cellos/http-cache).
+    Bodies are stored with their ETag / Last-Modified headers and revalidated
+    with If-None-Match / If-Modified-Since. The cached copy is used as is for
+    `max_age` seconds, and whenever the request fails or times out
+    (HTTP_TIMEOUT, 5s by default).
+    :param binary: return the body as bytes instead of text
+    :return: the body, None when neither the URL nor the cache answers
+    """
+    path = http_cache_path(url)
+    cached, meta = None, {}
+    try:
+        with open(path + ".json", 'r') as f:
+            meta = json.load(f)
+        with open(path, 'rb') as f:
+            cached = f.read()
+        if not binary:
+            cached = cached.decode('utf-8')
+    except (IOError, ValueError):
+        pass
+    if cached is not None and time.time() - meta.get("time", 0) < max_age:
+        return cached
+
+    headers = {}
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    import requests
+    try:
+        r = requests.get(url, headers=headers,
+                         timeout=float(os.getenv('HTTP_TIMEOUT', 5)))
+    except Exception as e:
+        if cached is not None:
+            sys.stderr.write("WARNING: using the cached copy of {} ({})\n"
+                             .format(url, e))
+            return cached
+        sys.stderr.write("Error while getting {}: \n\t{}\n".format(url, e))
+        return None
+    if r.status_code == 304 and cached is not None:
+        body = cached
+    elif r.status_code != 200:
+        sys.stderr.write("ERROR: downloading config file from {} ({})\n"
+                         .format(url, r.status_code))
+        return cached if cached is not None else r.text
+    else:
+        body = r.content if binary else r.text
+        meta = {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+    meta["time"] = time.time()
+    mkdir_p(os.path.dirname(path))
+    if body is not cached:
+        with open(path + ".tmp", 'wb') as f:
+            f.write(body if binary else body.encode('utf-8'))
+        os.rename(path + ".tmp", path)
+    with open(path + ".json.tmp", 'w') as f:
+        json.dump(meta, f)
+    os.rename(path + ".json.tmp", path + ".json")
+    return body
+
+
+def readify(path, max_age=0):
     """
 
     :param path:
+    :param max_age: seconds a cached copy of a URL is used without
+        revalidating it (see fetch_url)
     :return: the content of the file or URL identified at the given path
     """
     if path is None:
@@ -147,23 +291,66 @@ def readify(path):
             out = fd.read()
     elif isinstance(path, basestring) \
             and (path.startswith("http://") or path.startswith("https://")):
-        try:
-            r = requests.get(path)
-            if r.status_code != 200:
-                sys.stderr.write("ERROR: downloading config file from {} ({})"
-                                 .format(path, r.status_code))
-            out = r.text
-        except Exception as e:
-            sys.stderr.write("Error while getting {}: \n\t{}".format(path, e))
-            out = None
+        out = fetch_url(path, max_age=max_age)
     else:
         # (clehene) why would we set the output to the input?
         out = path
     return out
 
-from awscli.formatter import TableFormatter
-from awscli.table import MultiTable, Styler
-from awscli.compat import six
+def remap_dcos_config(src):
+    """
+    Parses a DCOS configuration specification (config.json) and outputs a
+    tree with the templated configuration pieces
+    Example: https://github.com/mesosphere/universe/blob/version-2.x/repo/packages/K/kafka/3/config.json
+    """
+    dest = {}
+    for k, v in src.get("properties", {}).iteritems():
+        if v.get("type") == "object":
+            tmp = remap_dcos_config(v)
+            if len(tmp) > 0:
+                dest[k] = tmp
+        elif v.get("type") == "string" and "default" in v:
+            dest[k] = v["default"]
+            dest[k] = dest[k].replace("master.mesos:2181", "{{zk}}")
+            dest[k] = dest[k].replace("master.mesos:5050", "{{mesos}}")
+            dest[k] = dest[k].replace("master.mesos:8080", "{{marathon}}")
+            dest[k] = dest[k].replace(".marathon.mesos",
+                                      ".gw.{{cell}}.metal-cell.adobe.io")
+    return dest
+
+def index_universe(archive):
+    """
+    Indexes a DCOS universe zip: for each package it keeps the latest
+    revision and its remapped options template (see remap_dcos_config)
+    :param archive: the zip content
+    :return: {package: {"revision": <revision>, "options": <template>}}
+    """
+    import zipfile
+    import StringIO
+    revisions = {}
+    with zipfile.ZipFile(StringIO.StringIO(archive)) as universe:
+        for name in universe.namelist():
+            # .../repo/packages/<L>/<package>/<revision>/package.json
+            parts = name.split("/")
+            if len(parts) < 6 or parts[-1] != "package.json" \
+                    or parts[-6:-4] != ["repo", "packages"] \
+                    or not parts[-2].isdigit():
+                continue
+            package = json.loads(universe.read(name)).get("name", parts[-3])
+            revision = int(parts[-2])
+            if revision > revisions.get(package, (-1, None))[0]:
+                revisions[package] = (revision, name[:-len("package.json")])
+        index = {}
+        for package, (revision, prefix) in revisions.iteritems():
+            try:
+                config = json.loads(universe.read(prefix + "config.json"))
+            except KeyError:
+                config = {}
+            index[package] = {
+                "revision": str(revision),
+                "options": remap_dcos_config(config),
+            }
+    return index
 
 def tabulate(operation, data):
     """
@@ -173,18 +360,147 @@ def tabulate(operation, data):
     """
     if data is None:
         return ""
+    from awscli.formatter import TableFormatter
+    from awscli.table import MultiTable, Styler
+    from awscli.compat import six
     table = MultiTable(initial_section=False,
                        column_separator='|', styler=Styler(),
                        auto_reformat=False)
 
+    # "off" keeps TableFormatter from wrapping stdout with colorama on every
+    # call, the table is replaced with the uncolored one anyway
     formatter = TableFormatter(type('dummy', (object,),
-                                    {"color": "on", "query": None}))
+                                    {"color": "off", "query": None}))
     formatter.table = table
     stream = six.StringIO()
     formatter(operation, data, stream=stream)
     return stream.getvalue()
 
 
+# rows per table section written by print_table
+TABLE_CHUNK_ROWS = 500
+
+def print_table(operation, rows, chunk=TABLE_CHUNK_ROWS):
+    """
+    Writes rows to stdout as they are produced, in table sections of up to
+    `chunk` rows, instead of rendering the whole table at once
+    :param operation: the title of the table
+    :param rows: iterable of rows
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == chunk:
+            sys.stdout.write(tabulate(operation, batch))
+            sys.stdout.flush()
+            batch = []
+    print tabulate(operation, batch)
+
+
+def print_tables(rows, titles, chunk=TABLE_CHUNK_ROWS):
+    """
+    Like print_table, for a stream of (title, row) pairs that belong to
+    several tables. A table section is written as soon as `chunk` of its
+    rows have arrived, the rest of each table in `titles` order at the end.
+    Rows of other titles are left out.
+    :param rows: iterable of (title, row) pairs
+    :param titles: the titles of the tables
+    """
+    batches = collections.OrderedDict((title, []) for title in titles)
+    for title, row in rows:
+        batch = batches.get(title)
+        if batch is None:
+            continue
+        batch.append(row)
+        if len(batch) == chunk:
+            sys.stdout.write(tabulate(title, batch))
+            sys.stdout.flush()
+            del batch[:]
+    for title, batch in batches.items():
+        print tabulate(title, batch)
+
+
+OUTPUT_FORMATS = ["table", "json", "ndjson", "tsv"]
+
+# columns of the DEFAULT_INSTANCE_FORMAT rows of the backend
+INSTANCE_COLUMNS = ["public_ip", "private_ip", "instance_id", "image_id", "state"]
+# columns of the cell stack rows of `list`
+STACK_COLUMNS = ["name", "region", "status", "version", "created"]
+# roles of the instance tables of `list <cell-name>`
+LIST_ROLES = ["nucleus", "stateless-body", "stateful-body", "membrane",
+              "bastion"]
+
+
+class RowWriter(object):
+    """
+    Writes the sections (named lists of rows) of a command output to stdout
+    as their rows are produced:
+    table - awscli tables (see print_table)
+    json - a single {section: [{column: value, ..}, ..], ..} document
+    ndjson - a {"section": section, column: value, ..} object per line
+    tsv - a <section> <value> .. line per row, tab separated
+    Only the table format loads the awscli formatter.
+    """
+    def __init__(self, format="table", stream=None):
+        if format not in OUTPUT_FORMATS:
+            raise Exception("Unknown output format {}, expecting one of {}"
+                            .format(format, ", ".join(OUTPUT_FORMATS)))
+        self.format = format
+        self.stream = stream if stream is not None else sys.stdout
+        self.lock = threading.Lock()
+        # json: the section being written and whether it has records yet
+        self.section = None
+        self.empty = True
+
+    @property
+    def human(self):
+        return self.format == "table"
+
+    def rows(self, section, columns, rows, title=None):
+        """
+        :param section: name of the section
+        :param columns: names of the row values
+        :param rows: iterable of rows (lists of values)
+        :param title: table title, defaults to the section name
+        """
+        if self.human:
+            print_table(title or section, rows)
+            return
+        for row in rows:
+            self.row(section, columns, row)
+
+    def row(self, section, columns, row):
+        with self.lock:
+            if self.format == "tsv":
+                self.stream.write("\t".join(
+                    [section] + ["" if value is None else
+                                 " ".join(str(value).split("\t")).replace("\n", " ")
+                                 for value in row]) + "\n")
+            elif self.format == "ndjson":
+                record = collections.OrderedDict([("section", section)])
+                record.update(zip(columns, row))
+                self.stream.write(json.dumps(record, default=str) + "\n")
+            else:
+                if section != self.section:
+                    self.stream.write("{" if self.section is None else "\n],")
+                    self.stream.write(json.dumps(section) + ":[\n")
+                    self.section = section
+                    self.empty = True
+                self.stream.write(("" if self.empty else ",\n") + json.dumps(
+                    collections.OrderedDict(zip(columns, row)), default=str))
+                self.empty = False
+            self.stream.flush()
+
+    def close(self):
+        """
+        Terminates the json document
+        """
+        if self.format == "json":
+            with self.lock:
+                self.stream.write("{}\n" if self.section is None else "\n]}\n")
+                self.stream.flush()
+
+
 def first(*args):
     for item in args:
         if item is not None:
@@ -226,6 +542,604 @@ class Struct(object):
 
 ROLES = ["nucleus", "stateless-body", "stateful-body", "membrane"]
 
+# backend lookups answered by `cell agent` (see AgentBackend), everything
+# else derives from them (instances, bastion, proxy, version, list_one)
+AGENT_METHODS = ["stack_snapshot", "iter_inventory", "nat_egress_ip",
+                 "load_balancers", "list_all", "invalidate_cache"]
+# seconds the CLI waits for an agent answer before going to the backend
+AGENT_TIMEOUT = 30
+# commands that change the cell, they don't trust the cached cell stack
+MUTATING_COMMANDS = ["create", "update", "delete", "scale", "seed"]
+# consecutive failed polls `--wait` retries before giving up
+WAIT_MAX_ERRORS = 5
+# environment variables the agent and the CLI must agree on
+AGENT_ENV = ["CELL_BUCKET", "CACHE_EXPIRY_SECONDS", "STACK_CATALOG_TTL",
+             "LOCAL_CELLS", "REPOSITORY"]
+
+
+def byteify(value):
+    """
+    Turns the unicode strings of decoded JSON back into str
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [byteify(item) for item in value]
+    if isinstance(value, dict):
+        return dict((byteify(k), byteify(v)) for k, v in value.items())
+    return value
+
+
+def agent_dumps(message):
+    """
+    Encodes an agent request or response as a JSON line. Datetimes (stack
+    creation times, instance launch times) are sent as
+    {"$datetime": <ISO 8601>}, see agent_loads
+    """
+    def encode(value):
+        if isinstance(value, datetime.datetime):
+            return {"$datetime": value.isoformat()}
+        raise TypeError("{!r} is not JSON serializable".format(value))
+    return json.dumps(message, default=encode) + "\n"
+
+
+def agent_loads(line):
+    """
+    Decodes an agent_dumps line, with its datetimes
+    """
+    def decode(value):
+        if value.keys() == ["$datetime"]:
+            import dateutil.parser
+            return dateutil.parser.parse(value["$datetime"])
+        return value
+    return byteify(json.loads(line, object_hook=decode))
+
+
+def agent_fingerprint(version):
+    """
+    Identifies the CLI version, the AWS environment and the config files the
+    backends are built from: ~/.cellos/config, whose sections --cell_config
+    selects, and deploy/config/cell.yaml. The CLI only uses an agent started
+    with the same fingerprint
+    """
+    digest = hashlib.sha256(version + "\0" + DIR + "\0")
+    for name in sorted(os.environ):
+        if name.startswith("AWS_") or name in AGENT_ENV:
+            digest.update("{}={}\0".format(name, os.environ[name]))
+    for config in [os.path.expanduser('~/.cellos/config'),
+                   os.path.join(DIR, "deploy", "config", "cell.yaml")]:
+        if os.path.exists(config):
+            with open(config, 'rb') as f:
+                digest.update(f.read())
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+class AgentClient(object):
+    """
+    Connection to a running `cell agent`, one JSON request / response per
+    line. Raises IOError (socket.error) or ValueError when the agent can't
+    be reached or doesn't accept the CLI fingerprint
+    """
+    def __init__(self, path, fingerprint=None, timeout=AGENT_TIMEOUT):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self._socket = sock
+        self._file = sock.makefile("rb")
+        if self.fingerprint is not None:
+            self._send({"op": "hello", "fingerprint": self.fingerprint})
+
+    def _send(self, request):
+        self._socket.sendall(agent_dumps(request))
+        line = self._file.readline()
+        if not line:
+            raise IOError("agent closed the connection")
+        response = agent_loads(line)
+        if "error" in response and request["op"] != "call":
+            raise IOError(response["error"])
+        return response
+
+    def request(self, **request):
+        """
+        :return: the response, {"result": ..} or {"error": ..}
+        """
+        # the lookups of `list` run concurrently and share the connection
+        with self._lock:
+            if self._socket is None:
+                self._connect()
+            return self._send(request)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class AgentBackend(object):
+    """
+    Mixed into the backend class when a `cell agent` is running, so the
+    lookups of AGENT_METHODS are answered from its warm sessions and
+    background refreshed snapshots. When the agent can't answer, the lookup
+    goes to the backend, and so does everything else.
+    """
+    agent = None
+    agent_key = None
+
+    def _agent_call(self, method, *args, **kwargs):
+        """
+        :return: (True, result) when answered by the agent, (False, None)
+            when the backend has to be called directly
+        """
+        if self.agent is None:
+            return False, None
+        try:
+            response = self.agent.request(op="call", key=self.agent_key,
+                                          method=method, args=args,
+                                          kwargs=kwargs)
+        except (IOError, ValueError) as e:
+            log.debug("cell agent unavailable ({}), using {} directly"
+                      .format(e, self.name))
+            self.agent.close()
+            self.agent = None
+            return False, None
+        if "error" in response:
+            log.debug("cell agent {} failed: {}".format(method, response["error"]))
+            return False, None
+        return True, response["result"]
+
+    def stack_snapshot(self, refresh=False):
+        with self._snapshot_lock:
+            if self._snapshot is None and not refresh:
+                found, snapshot = self._agent_call("stack_snapshot")
+                if found:
+                    self._snapshot = snapshot or {}
+        return super(AgentBackend, self).stack_snapshot(refresh=refresh)
+
+    def iter_inventory(self, *args, **kwargs):
+        found, rows = self._agent_call("iter_inventory", *args, **kwargs)
+        if not found:
+            rows = super(AgentBackend, self).iter_inventory(*args, **kwargs)
+        for role, row in rows:
+            yield role, row
+
+    def nat_egress_ip(self):
+        found, ip = self._agent_call("nat_egress_ip")
+        return ip if found else super(AgentBackend, self).nat_egress_ip()
+
+    def load_balancers(self):
+        found, elbs = self._agent_call("load_balancers")
+        return elbs if found else super(AgentBackend, self).load_balancers()
+
+    def list_all(self):
+        found, stacks = self._agent_call("list_all")
+        return stacks if found else super(AgentBackend, self).list_all()
+
+    def invalidate_cache(self):
+        super(AgentBackend, self).invalidate_cache()
+        self._agent_call("invalidate_cache")
+
+
+def agent_arguments(backend, config, cell):
+    """
+    The arguments of the Cell the agent builds a backend from
+    """
+    return {
+        "agent": True,
+        "--backend": backend,
+        "--cell_config": config,
+        "<cell-name>": cell,
+        "<cidr>": None,
+        "--template-url": None,
+        "--no-cache": False,
+        "--trace": False,
+    }
+
+
+class Agent(object):
+    """
+    `cell agent` keeps a warm backend (session, clients, stack snapshot)
+    per cell and answers the AgentBackend lookups of the CLI over a Unix
+    socket. The stack snapshot and inventory of the cells queried in the
+    last `idle_seconds` are refreshed every `refresh_seconds`.
+    """
+    def __init__(self, path, version, refresh_seconds, idle_seconds):
+        self.path = path
+        self.version = version
+        self.fingerprint = agent_fingerprint(version)
+        self.refresh_seconds = refresh_seconds
+        self.idle_seconds = idle_seconds
+        # (backend, cell_config, cell) -> [backend, last query time]
+        self.backends = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.server = None
+
+    def backend(self, key):
+        with self.lock:
+            if key not in self.backends:
+                cell = Cell(agent_arguments(*key), self.version)
+                self.backends[key] = [cell.backend, time.time()]
+                log.info("cell agent: new {} backend for {}".format(
+                    cell.backend_type, key[2]))
+            entry = self.backends[key]
+            entry[1] = time.time()
+            return entry[0]
+
+    def handle(self, request, session):
+        """
+        :param session: the state of the connection, lookups are only
+            answered once it said hello with the agent fingerprint
+        """
+        op = request.get("op")
+        if op == "hello":
+            if request.get("fingerprint") != self.fingerprint:
+                session["hello"] = False
+                return {"error": "agent started with a different environment"}
+            session["hello"] = True
+            return {"result": os.getpid()}
+        elif op == "ping":
+            return {"result": os.getpid()}
+        elif op == "stop":
+            # the server is shut down once the response is sent
+            self.stopping.set()
+            return {"result": os.getpid()}
+        elif op == "call" and not session.get("hello"):
+            return {"error": "call before a matching hello"}
+        elif op == "call" and request.get("method") in AGENT_METHODS:
+            backend = self.backend(tuple(request["key"]))
+            result = getattr(backend, request["method"])(
+                *request.get("args", []), **request.get("kwargs", {}))
+            if inspect.isgenerator(result):
+                result = list(result)
+            return {"result": result}
+        return {"error": "unsupported request {}".format(op)}
+
+    def refresh(self):
+        while not self.stopping.wait(self.refresh_seconds):
+            now = time.time()
+            with self.lock:
+                for key, (_, used) in self.backends.items():
+                    if now - used > self.idle_seconds:
+                        log.info("cell agent: dropping idle {}".format(key[2]))
+                        del self.backends[key]
+                active = [(key, backend)
+                          for key, (backend, _) in self.backends.items()
+                          if key[2] is not None]
+            for key, backend in active:
+                try:
+                    backend.refresh()
+                except Exception as e:
+                    log.warning("cell agent: failed to refresh {}: {}"
+                                .format(key[2], e))
+
+    def serve(self):
+        import SocketServer
+        agent = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                session = {}
+                for line in iter(self.rfile.readline, ""):
+                    try:
+                        response = agent_dumps(
+                            agent.handle(agent_loads(line), session))
+                    except Exception as e:
+                        response = agent_dumps(
+                            {"error": "{}: {}".format(type(e).__name__, e)})
+                    self.wfile.write(response)
+                    if agent.stopping.is_set():
+                        # shutdown() waits for serve_forever(), which runs
+                        # this handler
+                        threading.Thread(target=agent.server.shutdown).start()
+                        break
+
+        class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        # the socket is only accessible by the user
+        umask = os.umask(0o177)
+        try:
+            self.server = Server(self.path, Handler)
+        finally:
+            os.umask(umask)
+        refresher = threading.Thread(target=self.refresh)
+        refresher.daemon = True
+        refresher.start()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        print "cell agent {} listening on {}".format(os.getpid(), self.path)
+        sys.stdout.flush()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopping.set()
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+# consecutive failed health checks after which a proxy tunnel is reconnected
+PROXY_MAX_FAILURES = 2
+RELAY_BUFFER = 64 * 1024
+
+
+def free_port():
+    import socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def recv_exactly(sock, size):
+    data = ""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def socks_probe(port, host, target_port=22, timeout=5):
+    """
+    Connects to host:target_port through the SOCKS5 proxy listening on the
+    local `port` and checks that a ssh server answers, so the whole path
+    (local listener, ssh session, remote node) gets tested
+    :return: True when the ssh banner came back
+    """
+    import socket
+    import struct
+    sock = None
+    try:
+        sock = socket.create_connection(("127.0.0.1", port), timeout)
+        sock.sendall("\x05\x01\x00")
+        if recv_exactly(sock, 2) != "\x05\x00":
+            return False
+        sock.sendall("\x05\x01\x00\x01" + socket.inet_aton(host) +
+                     struct.pack(">H", target_port))
+        reply = recv_exactly(sock, 10)
+        if len(reply) < 2 or reply[1] != "\x00":
+            return False
+        return recv_exactly(sock, 4) == "SSH-"
+    except (socket.error, IOError):
+        return False
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+def relay(client, upstream):
+    """
+    Pipes two sockets into each other until both sides are done, half
+    closes are passed on
+    """
+    import select
+    import socket
+    peers = {client: upstream, upstream: client}
+    try:
+        while peers:
+            readable, _, _ = select.select(list(peers), [], [])
+            for src in readable:
+                data = src.recv(RELAY_BUFFER)
+                if data:
+                    peers[src].sendall(data)
+                    continue
+                try:
+                    peers[src].shutdown(socket.SHUT_WR)
+                except socket.error:
+                    pass
+                del peers[src]
+    except socket.error:
+        pass
+    finally:
+        client.close()
+        upstream.close()
+
+
+class ProxyTunnel(object):
+    """
+    A `ssh -N -D` dynamic forward to a cell node, on a local port
+    """
+    def __init__(self, node, port, cmd, log_file):
+        self.node = node
+        self.port = port
+        self.failures = 0
+        self.healthy = False
+        self.connections = 0
+        # own process group, so stopping it also stops the ProxyCommand
+        self.proc = subprocess.Popen(cmd,
+                                     stdin=open(os.devnull, 'r'),
+                                     stdout=log_file,
+                                     stderr=subprocess.STDOUT,
+                                     preexec_fn=os.setsid)
+
+    @property
+    def running(self):
+        return self.proc.poll() is None
+
+    def stop(self):
+        self.healthy = False
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        self.proc.wait()
+
+
+class ProxyPool(object):
+    """
+    `cell proxy --supervise`: one local SOCKS port whose connections are
+    spread over `size` ssh dynamic forwards to different nodes (the tunnel
+    with the fewest open connections gets the next one).
+    Every `check_seconds` the tunnels are health checked (socks_probe) and
+    compared with the inventory; tunnels that exited, failed
+    PROXY_MAX_FAILURES checks in a row or whose node left the inventory are
+    replaced, preferably by a node that didn't fail recently.
+    """
+    def __init__(self, port, size, nodes, command, log_path,
+                 check_seconds=10, timeout=5):
+        """
+        :param nodes: function(refresh) returning the IPs of the candidate
+            nodes, refresh=True bypasses the inventory cache
+        :param command: function(node, port) returning the ssh argv of the
+            tunnel to the node, on the local port
+        """
+        self.port = int(port)
+        self.size = size
+        self.nodes = nodes
+        self.command = command
+        self.log_path = log_path
+        self.check_seconds = check_seconds
+        self.timeout = timeout
+        self.tunnels = []
+        # node -> time of its last failure
+        self.failed = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.log_file = None
+
+    def report(self, message):
+        print "{} {}".format(time.strftime("%H:%M:%S"), message)
+        sys.stdout.flush()
+
+    def connect(self, client):
+        import socket
+        with self.lock:
+            tunnels = sorted([t for t in self.tunnels if t.healthy],
+                             key=lambda t: t.connections)
+        for tunnel in tunnels:
+            try:
+                upstream = socket.create_connection(
+                    ("127.0.0.1", tunnel.port), self.timeout)
+            except socket.error:
+                tunnel.healthy = False
+                continue
+            upstream.settimeout(None)
+            with self.lock:
+                tunnel.connections += 1
+            try:
+                relay(client, upstream)
+            finally:
+                with self.lock:
+                    tunnel.connections -= 1
+            return
+        client.close()
+
+    def start_tunnel(self, node):
+        port = free_port()
+        tunnel = ProxyTunnel(node, port, self.command(node, port), self.log_file)
+        # wait for the first successful probe, so the tunnel is usable
+        # as soon as it is added
+        deadline = time.time() + 2 * self.timeout
+        while tunnel.running and time.time() < deadline:
+            if socks_probe(port, node, timeout=self.timeout):
+                tunnel.healthy = True
+                break
+            time.sleep(0.5)
+        if not tunnel.healthy:
+            tunnel.stop()
+            self.failed[node] = time.time()
+            self.report("tunnel to {} failed, see {}".format(node, self.log_path))
+            return None
+        self.report("tunnel to {} up on localhost:{}".format(node, port))
+        return tunnel
+
+    def remove(self, tunnel, reason):
+        with self.lock:
+            self.tunnels.remove(tunnel)
+        tunnel.stop()
+        self.report("tunnel to {} {}".format(tunnel.node, reason))
+
+    def check(self, refresh=False):
+        for tunnel in list(self.tunnels):
+            if not tunnel.running:
+                tunnel.failures = PROXY_MAX_FAILURES
+            elif socks_probe(tunnel.port, tunnel.node, timeout=self.timeout):
+                tunnel.failures = 0
+                tunnel.healthy = True
+                continue
+            else:
+                tunnel.failures += 1
+            if tunnel.failures >= PROXY_MAX_FAILURES:
+                self.failed[tunnel.node] = time.time()
+                self.remove(tunnel, "down, reconnecting")
+                # the node may have been replaced
+                refresh = True
+            else:
+                tunnel.healthy = False
+
+        try:
+            nodes = self.nodes(refresh)
+        except Exception as e:
+            self.report("inventory lookup failed: {}".format(e))
+            return
+        for tunnel in list(self.tunnels):
+            if tunnel.node not in nodes:
+                self.remove(tunnel, "closed, the node left the inventory")
+
+        in_use = set(tunnel.node for tunnel in self.tunnels)
+        candidates = sorted([node for node in nodes if node not in in_use],
+                            key=lambda node: self.failed.get(node, 0))
+        for node in candidates:
+            if len(self.tunnels) >= self.size:
+                break
+            # a node that can't be reached is replaced by the next one
+            tunnel = self.start_tunnel(node)
+            if tunnel is not None:
+                with self.lock:
+                    self.tunnels.append(tunnel)
+
+    def serve(self):
+        import SocketServer
+        pool = self
+
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                pool.connect(self.request)
+
+        class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.log_file = open(self.log_path, "ab")
+        self.server = Server(("127.0.0.1", self.port), Handler)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            self.check()
+            if not self.tunnels:
+                raise RuntimeError("no proxy tunnel could be opened")
+            listener = threading.Thread(target=self.server.serve_forever)
+            listener.daemon = True
+            listener.start()
+            self.report("proxy running on localhost:{} over {} tunnel(s)"
+                        .format(self.port, len(self.tunnels)))
+            while True:
+                time.sleep(self.check_seconds)
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            for tunnel in list(self.tunnels):
+                tunnel.stop()
+            self.log_file.close()
+
 
 class Cell(object):
     def get_backend(self):
@@ -238,6 +1152,7 @@ class Cell(object):
     def __init__(self, arguments, version):
         self.version = version
         self.arguments = arguments
+        self.output = RowWriter(first(self.arguments.get("--output"), "table"))
         config_sections = [self.backend_type, "default"]
 
         if self.arguments["--cell_config"]:
@@ -253,13 +1168,41 @@ class Cell(object):
             "cell_dir": DIR,
             "template_url": self.arguments['--template-url'],
             "cidr": self.arguments['<cidr>'],
-            "repository": self.repository
+            "repository": self.repository,
+            "catalog_dir": TMPDIR,
+            "use_cache": not self.arguments.get("--no-cache"),
         }
         if self.cell is not None:
             config_args["key_file"] = self.key_file
             config_args["tmp_dir"] = self.tmp("")
-
+            config_args["cache_expiry_seconds"] = self.cache_expiry_seconds
+        if self.arguments.get("--trace"):
+            config_args["trace_file"] = self.tmp("trace.jsonl") \
+                if self.cell is not None \
+                else os.path.join(TMPDIR, "trace.jsonl")
+            config_args["command"] = " ".join(
+                [self.command] + ([self.cell] if self.cell else []))
+
+        agent = self.agent_client()
+        if agent is not None:
+            self.backend_cls = type(self.backend_cls.__name__,
+                                    (AgentBackend, self.backend_cls), {})
         self.backend = self.backend_cls(self.config, Struct(**config_args))
+        if agent is not None:
+            self.backend.agent = agent
+            self.backend.agent_key = [self.backend_type,
+                                      self.arguments["--cell_config"], self.cell]
+
+    def agent_client(self):
+        """
+        :return: AgentClient of the running `cell agent`, None when there is
+            none, or when the command must not go through it
+        """
+        if self.command == "agent" or self.arguments.get("--no-cache") \
+                or self.arguments.get("--trace") \
+                or not os.path.exists(self.agent_socket):
+            return None
+        return AgentClient(self.agent_socket, agent_fingerprint(self.version))
 
     @property
     def backend_type(self):
@@ -333,6 +1276,46 @@ class Cell(object):
             '5'
         )
 
+    @property
+    def ssh_control_persist(self):
+        return first(
+            os.getenv('SSH_CONTROL_PERSIST'),
+            self.config.ssh_control_persist,
+            '10m'
+        )
+
+    @property
+    def agent_socket(self):
+        return first(
+            os.getenv('CELL_AGENT_SOCKET'),
+            self.config.agent_socket,
+            os.path.expanduser('~/.cellos/agent.sock')
+        )
+
+    @property
+    def agent_refresh_seconds(self):
+        return float(first(
+            os.getenv('AGENT_REFRESH_SECONDS'),
+            self.config.agent_refresh_seconds,
+            60
+        ))
+
+    @property
+    def agent_idle_seconds(self):
+        return float(first(
+            os.getenv('AGENT_IDLE_SECONDS'),
+            self.config.agent_idle_seconds,
+            60 * 30
+        ))
+
+    @property
+    def proxy_check_seconds(self):
+        return float(first(
+            os.getenv('PROXY_CHECK_SECONDS'),
+            self.config.proxy_check_seconds,
+            10
+        ))
+
     def tmp(self, path):
         path = os.path.join(TMPDIR, self.cell, path)
         mkdir_p(os.path.dirname(path))
@@ -348,11 +1331,11 @@ class Cell(object):
 
     @property
     def cache_expiry_seconds(self):
-        return first(
+        return float(first(
             os.getenv('CACHE_EXPIRY_SECONDS'),
             self.config.cache_expiry_seconds,
             60 * 3
-        )
+        ))
 
     @decorator.decorator
     def check_cell_exists(f, *args, **kwargs):
@@ -360,7 +1343,9 @@ class Cell(object):
         # if the cell parameter is defined, check it
         if self.cell != None:
             try:
-                exists = self.backend.cell_exists()
+                # the cached stack may be gone, or recreated, by now
+                exists = self.backend.cell_exists(
+                    refresh=self.command in MUTATING_COMMANDS)
             except Exception:
                 exists = False
             if not exists:
@@ -368,12 +1353,74 @@ class Cell(object):
                                 .format(self.cell))
         return f(*args, **kwargs)
 
+    def invalidate_cache(self):
+        """
+        Drops the cached cell inventory along with the generated files that
+        are derived from it, so the next command goes back to the backend
+        """
+        self.backend.invalidate_cache()
+        if self.cell is None:
+            # only the cell listing
+            return
+        for path in [self.tmp("config.yaml"), self.tmp("ssh_config")]:
+            if os.path.exists(path):
+                os.remove(path)
+
     def run(self, **kwargs):
         method = getattr(self, 'run_%s' % self.command)
-        if inspect.getargspec(method).keywords is not None:
-            method(**kwargs)
+        try:
+            if inspect.getargspec(method).keywords is not None:
+                return method(**kwargs)
+            else:
+                return method()
+        finally:
+            self.output.close()
+            if getattr(self.backend, "tracer", None) is not None:
+                self.print_trace_summary()
+
+    def say(self, message):
+        """
+        Prints a message meant for humans, on stderr with the machine
+        readable --output formats, so stdout stays parseable
+        """
+        if self.output.human:
+            print message
         else:
-            method()
+            sys.stderr.write("{}\n".format(message))
+
+    def confirm(self, question):
+        """
+        Asks a yes / no question. With the machine readable --output formats
+        the prompt goes to stderr, and the question is only asked on a
+        terminal (the command is refused otherwise, see --yes)
+        :return: True when answered y or yes
+        """
+        self.say(question)
+        try:
+            if self.output.human:
+                answer = raw_input(">")
+            elif sys.stdin.isatty():
+                sys.stderr.write(">")
+                answer = sys.stdin.readline()
+            else:
+                self.say("stdin is not a terminal, pass --yes to confirm")
+                return False
+        except EOFError:
+            return False
+        return answer.strip().lower() in ['y', 'yes']
+
+    def print_trace_summary(self):
+        tracer = self.backend.tracer
+        rows = [[name, calls, retries, "{:.1f}".format(total), "{:.1f}".format(slowest)]
+                for (name, calls, retries, total, slowest) in tracer.summary()]
+        rows.append(["total", len(tracer.records),
+                     sum(record["retries"] for record in tracer.records),
+                     "{:.1f}".format(sum(record["latency_ms"] for record in tracer.records)),
+                     ""])
+        # on stderr, to keep the command output parseable
+        sys.stderr.write(tabulate(
+            "AWS API calls (operation, calls, retries, total ms, max ms)", rows))
+        sys.stderr.write("trace written to {}\n".format(tracer.path))
 
     def build_seed_config(self):
         def parse_nets_json(json_text):
@@ -383,7 +1430,7 @@ class Cell(object):
             ]
 
         json_text = first(
-            readify(self.net_whitelist_url),
+            readify(self.net_whitelist_url, max_age=self.cache_expiry_seconds),
             readify(DIR + "/deploy/config/net-whitelist.json")
         )
         entries = parse_nets_json(json_text)
@@ -394,20 +1441,84 @@ class Cell(object):
             """))
 
         with open(self.tmp("net-whitelist.json"), "wb+") as f:
-            f.write(json.dumps(entries, indent=4))
-        shutil.copyfile(
-            self.tmp("net-whitelist.json"),
-            self.tmp("seed/config/net-whitelist.json")
-        )
+            f.write(json.dumps(entries, indent=4, sort_keys=True))
+
+    def seed_files(self):
+        """
+        :return: sorted list of (archive name, local path) of the seed contents
+        """
+        files = [("seed/config", None),
+                 ("seed/config/net-whitelist.json", self.tmp("net-whitelist.json"))]
+        for (src, dest) in [(DIR + "/deploy/seed", "seed"),
+                            (DIR + "/deploy/machine/bin", "seed/bin")]:
+            for root, dirs, names in os.walk(src):
+                rel = os.path.relpath(root, src)
+                prefix = dest if rel == "." else os.path.join(dest, rel)
+                files.append((prefix, root))
+                files.extend([(os.path.join(prefix, name),
+                               os.path.join(root, name)) for name in names])
+        return sorted(files)
+
+    def seed_digest(self, files):
+        """
+        Hashes the seed contents (names, modes and file contents)
+        """
+        digest = hashlib.sha256()
+        for (name, path) in files:
+            digest.update(name + "\0")
+            if path is None:
+                continue
+            digest.update("{:o}\0".format(seed_file_mode(os.lstat(path).st_mode)))
+            if os.path.islink(path):
+                digest.update(os.readlink(path))
+            elif os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+            digest.update("\0")
+        return digest.hexdigest()
 
     def build_seed(self):
-        shutil.rmtree(self.tmp("seed"), ignore_errors=True)
-        shutil.copytree(DIR + "/deploy/seed", self.tmp("seed"))
-        shutil.copytree(DIR + "/deploy/machine/bin", self.tmp("seed/bin"))
+        """
+        Builds seed.tar.gz. The archive is reproducible (sorted entries,
+        fixed mtimes and owners), and is only rebuilt when the hash of its
+        contents differs from the previous build's (seed.sha256)
+        """
         self.build_seed_config()
-        with sh.pushd(self.tmp("")):
-            tar_zcf(["seed.tar.gz", "seed"])
-        shutil.rmtree(self.tmp("seed"))
+        files = self.seed_files()
+        digest = self.seed_digest(files)
+        archive = self.tmp("seed.tar.gz")
+        digest_file = self.tmp("seed.sha256")
+        if os.path.exists(archive) and readify(digest_file) == digest:
+            print "Seed unchanged ({}), skipping build".format(digest[:12])
+            return
+
+        def normalize(info):
+            info.mtime = SEED_MTIME
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            info.mode = seed_file_mode(info.mode, info.isdir())
+            return info
+
+        with open(archive + ".tmp", "wb") as out:
+            gz = gzip.GzipFile(filename="", mode="wb", fileobj=out,
+                               mtime=SEED_MTIME)
+            tar = tarfile.open(fileobj=gz, mode="w", format=tarfile.GNU_FORMAT)
+            for (name, path) in files:
+                if path is None:
+                    info = tarfile.TarInfo(name)
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(normalize(info))
+                elif os.path.isfile(path) and not os.path.islink(path):
+                    with open(path, 'rb') as f:
+                        tar.addfile(normalize(tar.gettarinfo(path, name)), f)
+                else:
+                    tar.addfile(normalize(tar.gettarinfo(path, name)))
+            tar.close()
+            gz.close()
+        os.rename(archive + ".tmp", archive)
+        with open(digest_file, "wb+") as f:
+            f.write(digest)
+        print "BUILT {} ({})".format(archive, digest[:12])
 
     def seed(self):
         self.build_seed()
@@ -430,9 +1541,53 @@ class Cell(object):
         self.seed()
         self.backend.seed()
 
+    def wait_for_stack(self, tailer):
+        """
+        Streams the stack events until the stack (and with it all its nested
+        stacks) reaches a final status
+        :return: exit code: 0 on success, 1 on failure or rollback, 2 on timeout
+        """
+        timeout = self.arguments["--wait-timeout"]
+        deadline = time.time() + float(timeout) if timeout else None
+        errors = 0
+        while True:
+            try:
+                for event in tailer.poll():
+                    print "  ".join(self.backend.format_infra_event(event))
+                sys.stdout.flush()
+                errors = 0
+            except Exception as e:
+                errors += 1
+                if not self.backend.transient_error(e) or \
+                        errors >= WAIT_MAX_ERRORS:
+                    print(colored("Polling stack events of {} failed: {}"
+                                  .format(self.full_cell, e), 'red'))
+                    return 1
+                # transient API errors, retry on the next poll
+                log.debug("polling stack events failed: {}".format(e))
+            if tailer.done:
+                break
+            wait = tailer.interval
+            if deadline is not None:
+                if time.time() >= deadline:
+                    print(colored("Timed out after {}s waiting for {}".format(
+                        timeout, self.full_cell), 'red'))
+                    return 2
+                wait = min(wait, deadline - time.time())
+            time.sleep(wait)
+        if tailer.succeeded:
+            print(colored("{} {}".format(self.full_cell, tailer.status), 'green'))
+            return 0
+        print(colored("{} {}".format(self.full_cell, tailer.status), 'red'))
+        return 1
+
     def run_create(self):
         self.seed()
+        self.invalidate_cache()
         self.backend.create()
+        if self.arguments["--wait"]:
+            return self.wait_for_stack(
+                self.backend.stack_waiter(skip_existing=False))
         print """
         To watch your cell infrastructure provisioning log you can
             ./cell log {cell}
@@ -446,15 +1601,24 @@ class Cell(object):
 
     @check_cell_exists
     def run_update(self):
+        self.invalidate_cache()
+        tailer = self.backend.stack_waiter() if self.arguments["--wait"] else None
         self.backend.update()
+        if tailer is not None:
+            return self.wait_for_stack(tailer)
 
     def run_delete(self):
         print "WARNING: THIS WILL DELETE ALL RESOURCES ASSOCIATED TO {}".format(self.cell)
         print "Please enter the cell name for confirmation: "
         confirmation = raw_input(">")
         if self.cell == confirmation:
+            self.invalidate_cache()
+            self.close_ssh_masters()
+            tailer = self.backend.stack_waiter() if self.arguments["--wait"] else None
             self.backend.delete()
             self.delete_temp_dir()
+            if tailer is not None:
+                return self.wait_for_stack(tailer)
         else:
             print "Aborted deleting cell"
 
@@ -466,35 +1630,69 @@ class Cell(object):
 
     @check_cell_exists
     def run_list(self):
-        if self.cell is None:
+        output = self.output
+        if self.arguments.get("--refresh"):
+            # unlike --no-cache, also drops what the agent has cached
+            self.invalidate_cache()
+        if self.arguments.get("--all-regions"):
+            stacks = []
+            errors = []
+            for region, result, error in self.backend.list_all_regions():
+                if error is not None:
+                    errors.append((region, error))
+                else:
+                    stacks.extend(result)
+            output.rows("stacks", STACK_COLUMNS,
+                        sorted(stacks, key=lambda stack: (stack[1], stack[0])),
+                        title="list")
+            for region, error in sorted(errors):
+                self.say(colored("{}: {}".format(region, error), 'red'))
+        elif self.cell is None:
             stacks = self.backend.list_all()
-            print tabulate("list", stacks)
+            output.rows("stacks", STACK_COLUMNS, stacks, title="list")
         else:
             tmp = self.backend.list_one(self.cell)
-            print tabulate("nucleus", tmp.instances.nucleus)
-            print tabulate("stateless-body", tmp.instances.stateless)
-            print tabulate("stateful-body", tmp.instances.stateful)
-            print tabulate("membrane", tmp.instances.membrane)
-            print tabulate("bastion", tmp.instances.membrane)
-
-            status_page={"status_page": tmp.statuspage}
-            print tabulate("Cell Infra Provisioning Status Page", status_page)
-            print tabulate("Egress IP", [self.backend.nat_egress_ip()]),
-            print tabulate("Load Balancers", tmp.load_balancers)
-
-            print tabulate("Local configuration files", [
+            # render each section as soon as its lookup completes, the
+            # instances one once all the pages are read
+            for name, result, error in tmp.lookups:
+                if error is not None:
+                    self.say(colored("{}: {}".format(name, error), 'red'))
+                elif name == "instances":
+                    if output.human:
+                        print_tables(result, LIST_ROLES)
+                    else:
+                        output.rows("instances", ["role"] + INSTANCE_COLUMNS,
+                                    ([role] + row for role, row in result
+                                     if role in LIST_ROLES))
+                elif name == "egress_ip":
+                    if output.human:
+                        print tabulate("Egress IP", [result]),
+                    else:
+                        output.rows("egress_ip", ["ip"], [[result]])
+                elif name == "load_balancers":
+                    output.rows("load_balancers", ["name", "dns_name"], result,
+                                title="Load Balancers")
+                sys.stdout.flush()
+
+            if output.human:
+                status_page={"status_page": tmp.statuspage}
+                print tabulate("Cell Infra Provisioning Status Page", status_page)
+            else:
+                output.rows("status_page", ["url"], [[tmp.statuspage]])
+
+            output.rows("local_files", ["name", "path"], [
                 ["SSH key", self.tmp("{}.pem".format(self.full_cell))],
                 ["SSH config", self.tmp("ssh_config")],
                 ["YAML config", self.tmp("config.yaml")],
                 ["DCOS config", self.tmp("dcos.toml")],
                 ["DCOS cache", self.tmp("dcos_tmp")],
-            ])
-            print tabulate("Core Services", [
+            ], title="Local configuration files")
+            output.rows("core_services", ["service", "url"], [
                 ["zookeeper", tmp.gateway.zookeeper],
                 ["mesos", tmp.gateway.mesos],
                 ["marathon", tmp.gateway.marathon],
                 ["hdfs", tmp.gateway.hdfs],
-            ])
+            ], title="Core Services")
 
     def is_fresh_file(self, path):
         """ Checks if a file has been touched in the last X seconds """
@@ -510,11 +1708,12 @@ class Cell(object):
             - marathon
         """
         generic_config = self.tmp("config.yaml")
-        if self.is_fresh_file(generic_config):
+        if self.is_fresh_file(generic_config) \
+                and not self.arguments.get("--no-cache"):
             return
         # create cell variables
-        tmp = flatten(self.backend.instances("nucleus", format="PrivateIpAddress"))
-        zk = ",".join([ip + ":2181" for ip in tmp])
+        zk = ",".join(ip + ":2181" for ip in iter_flatten(
+            self.backend.iter_instances("nucleus", format="PrivateIpAddress")))
 
         generic_config = self.tmp("config.yaml")
         # FIXME: needs to be dynamic
@@ -537,9 +1736,13 @@ backend: {backend}
     def ensure_ssh_config(self):
         """
         Creates a ssh configuration file used for proxying
+        Connections to the bastion and to the inner hosts are shared through
+        ControlMaster sockets (see ssh_control_dir) so repeated commands
+        reuse already authenticated connections.
         """
         ssh_config = self.tmp("ssh_config")
-        if self.is_fresh_file(ssh_config):
+        if self.is_fresh_file(ssh_config) \
+                and not self.arguments.get("--no-cache"):
             return
         if self.backend.bastion() is not None:
             bastion = self.backend.bastion()
@@ -550,17 +1753,31 @@ backend: {backend}
         else:
             raise RuntimeError("proxy not available yet")
 
-        with open(ssh_config, "wb+") as f:
-            f.write("""\
+        control = ""
+        if self.ssh_control_persist != "no":
+            control = """\
+ControlMaster auto
+ControlPath {control_path}
+ControlPersist {persist}
+""".format(
+                # unix socket paths are limited to ~104 bytes, %C is a
+                # fixed length hash of the user, host and port
+                control_path=os.path.join(self.ssh_control_dir(), "%C"),
+                persist=self.ssh_control_persist
+            )
+        content = """\
 IdentitiesOnly yes
 ConnectTimeout {timeout}
 IdentityFile {key}
 StrictHostKeyChecking no
 UserKnownHostsFile /dev/null
 User {user}
+{control}
+Host {bastion}
+  ProxyCommand none
 
 Host {ip_wildcard}
-  ProxyCommand ssh -i {key} {user}@{bastion} -W %h:%p
+  ProxyCommand ssh -F {ssh_config} -W %h:%p {bastion}
 
             """.format(
                 timeout=self.ssh_timeout,
@@ -568,47 +1785,149 @@ Host {ip_wildcard}
                 proxy=proxy,
                 bastion=bastion,
                 key=self.tmp(self.key_file),
+                control=control,
+                ssh_config=ssh_config,
                 # FIXME (clehene) ip_wildccard should be based on subnet
                 ip_wildcard="10.*",
                 # FIXME (clehene) user should come from config
                 user="centos"
-            ))
+            )
+        # the bastion (or the connection settings) changed, the open master
+        # connections are stale
+        if os.path.exists(ssh_config) and readify(ssh_config) != content:
+            self.close_ssh_masters()
+        with open(ssh_config, "wb+") as f:
+            f.write(content)
             f.flush()
 
+    def ssh_control_dir(self):
+        """
+        Directory of the shared ssh connection sockets of the cell, kept
+        short (~/.cellos/cm/<cell>) so the socket paths fit the limit
+        """
+        path = os.path.join(os.path.expanduser("~/.cellos/cm"), self.cell)
+        mkdir_p(path)
+        return path
+
+    def ssh_master_sockets(self):
+        control_dir = self.ssh_control_dir()
+        return [os.path.join(control_dir, name)
+                for name in sorted(os.listdir(control_dir))]
+
+    def close_ssh_masters(self):
+        """
+        Closes the shared ssh (ControlMaster) connections to the cell nodes
+        """
+        with open(os.devnull, 'w') as devnull:
+            for socket in self.ssh_master_sockets():
+                subprocess.call(["ssh", "-S", socket, "-O", "exit", "cell"],
+                                stdout=devnull,
+                                stderr=subprocess.STDOUT)
+                # master is already gone, but left its socket behind
+                if os.path.exists(socket):
+                    os.remove(socket)
+                self.say("CLOSED {}".format(socket))
+
     def ensure_config(self):
         self.ensure_cell_config()
         self.ensure_dcos_config()
         self.ensure_ssh_config()
 
-    def ensure_dcos_config(self):
-        """
-        Creates a DCOS cli configuration file
-        """
+    @property
+    def universe_version(self):
         with open(os.path.join(DIR, 'cell-os-base.yaml'), 'r') as bundle_stream:
             version_bundle = yaml.load(bundle_stream)
-            universe_version =  version_bundle['cell-os-universe::version']
+        return version_bundle['cell-os-universe::version']
 
+    @property
+    def cell_universe_url(self):
         repo_url = self.repository.replace('s3://', 'https://s3.amazonaws.com/')
-        cell_universe_url = '{0}/cell-os/cell-os-universe-{1}.zip'\
-            .format(repo_url, universe_version)
+        return '{0}/cell-os/cell-os-universe-{1}.zip'\
+            .format(repo_url, self.universe_version)
+
+    def universe_index(self, package=None):
+        """
+        Loads the package index of the cell-os universe
+        (~/.cellos/universe/<version>-<url hash>.json), building it from the
+        universe zip the first time a bundle version is used.
+        SNAPSHOT universes are revalidated every cache_expiry_seconds and
+        reindexed when the zip changed.
+        :param package: the package looked up. An index that doesn't have it
+            is returned as is, without revalidating the universe zip
+        :return: {package: {"revision": <revision>, "options": <template>}},
+            empty when the universe can't be downloaded
+        """
+        universe_version = self.universe_version
+        url = self.cell_universe_url
+        path = os.path.join(
+            os.path.dirname(TMPDIR), "universe", "{}-{}.json".format(
+                universe_version, hashlib.sha256(url).hexdigest()[:12]))
+        index = None
+        try:
+            with open(path, 'r') as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            pass
+        if index is not None and (
+                (package is not None and package not in index["packages"]) or
+                not universe_version.endswith("SNAPSHOT") or
+                time.time() - os.stat(path).st_mtime < self.cache_expiry_seconds):
+            return index["packages"]
+
+        archive = fetch_url(url, max_age=self.cache_expiry_seconds, binary=True)
+        try:
+            digest = hashlib.sha256(archive).hexdigest()
+            if index is None or index.get("sha256") != digest:
+                log.debug("indexing {}".format(url))
+                index = {
+                    "version": universe_version,
+                    "url": url,
+                    "sha256": digest,
+                    "packages": index_universe(archive),
+                }
+        except Exception as e:
+            sys.stderr.write("WARNING: can't index {} ({})\n".format(url, e))
+            return index["packages"] if index is not None else {}
+        mkdir_p(os.path.dirname(path))
+        with open(path + ".tmp", 'w') as f:
+            json.dump(index, f)
+        os.rename(path + ".tmp", path)
+        return index["packages"]
+
+    def dcos_sources(self):
+        """
+        :return: the package sources of dcos.toml, in the order dcos-cli
+            resolves packages from them
+        """
+        import toml
+        with open(self.tmp('dcos.toml'), 'r') as dcos_config_stream:
+            return toml.loads(dcos_config_stream.read())['package']['sources']
+
+    def ensure_dcos_config(self):
+        """
+        Creates a DCOS cli configuration file, rewritten only when its content
+        changes
+        """
+        import toml
+        cell_universe_url = self.cell_universe_url
         dcos_config_file = self.tmp('dcos.toml')
 
+        current = None
         try:
             with open(dcos_config_file, 'r') as dcos_config_stream:
-                dcos_config = toml.loads(dcos_config_stream.read())
-                sources = dcos_config['package']['sources']
+                current = dcos_config_stream.read()
+            sources = toml.loads(current)['package']['sources']
         except Exception:
             sources = [cell_universe_url]
-            print('generating {config_file} with default sources {default_src}'
-              .format(config_file=dcos_config_file, default_src=sources))
+            self.say('generating {config_file} with default sources {default_src}'
+                     .format(config_file=dcos_config_file, default_src=sources))
 
         # Override cell-os-universe source with the bundle version
         for index, repo in enumerate(sources):
             if 'cell-os/cell-os-universe' in repo:
                 sources[index] = cell_universe_url
                 break
-        with open(dcos_config_file, "wb+") as f:
-            f.write("""\
+        content = """\
     [core]
     mesos_master_url = "{mesos}"
     reporting = false
@@ -620,15 +1939,18 @@ Host {ip_wildcard}
     sources = [{sources}]
     cache = "{tmp}/dcos_tmp"
                 """.format(
-                    mesos=self.backend.gateway("mesos"),
-                    marathon=self.backend.gateway("marathon"),
-                    version=self.version,
-                    tmp=self.tmp(""),
-                    dns=self.backend.dns_name,
-                    sources=",".join('"{0}"'.format(x) for x in sources)
-                )
-            )
-            f.flush()
+            mesos=self.backend.gateway("mesos"),
+            marathon=self.backend.gateway("marathon"),
+            version=self.version,
+            tmp=self.tmp(""),
+            dns=self.backend.dns_name,
+            sources=",".join('"{0}"'.format(x) for x in sources)
+        )
+        if content == current:
+            return
+        with open(dcos_config_file + ".tmp", "wb+") as f:
+            f.write(content)
+        os.rename(dcos_config_file + ".tmp", dcos_config_file)
 
     def prepare_dcos_package_install(self, _args):
         args = list(_args)
@@ -654,36 +1976,29 @@ Host {ip_wildcard}
         # this file is rendered into
         # ~/.cellos/generated/<cell-name>/<package>_dcos_options.json
 
+        from pystache.context import KeyNotFoundError
+        from pystache.renderer import Renderer
+        from pystache.defaults import DECODE_ERRORS
+
         # DCOS can describe a package configuration schema, with default values
         # Take it and recreate an actual configuration out of it
-        pkg = dcos.package.resolve_package(package)
-        if pkg is None:
-            raise ValueError('package "{}" not found. Check spelling or update '
-                             'package sources.'.format(package))
-        pkg_config = pkg.config_json(pkg.latest_package_revision())
-
-        def config_remapper(src):
-            """
-            Parses a DCOS configuration specification (config.json) and outputs a
-            tree with the templated configuration pieces
-            Example: https://github.com/mesosphere/universe/blob/version-2.x/repo/packages/K/kafka/3/config.json
-            """
-            dest = {}
-            for k, v in src["properties"].iteritems():
-                if v["type"] == "object":
-                    tmp = config_remapper(v)
-                    if len(tmp) > 0:
-                        dest[k] = tmp
-                elif v["type"] == "string" and "default" in v:
-                    dest[k] = v["default"]
-                    dest[k] = dest[k].replace("master.mesos:2181", "{{zk}}")
-                    dest[k] = dest[k].replace("master.mesos:5050", "{{mesos}}")
-                    dest[k] = dest[k].replace("master.mesos:8080", "{{marathon}}")
-                    dest[k] = dest[k].replace(".marathon.mesos",
-                                            ".gw.{{cell}}.metal-cell.adobe.io")
-            return dest
-
-        template = config_remapper(pkg_config)
+        # cell-os-universe packages come precomputed from the universe index,
+        # the others are resolved through the DCOS package sources. The index
+        # only stands for the first source, the one dcos-cli installs from
+        entry = None
+        if self.dcos_sources()[:1] == [self.cell_universe_url]:
+            entry = self.universe_index(package).get(package)
+        if entry is not None:
+            template = entry["options"]
+        else:
+            import dcos.package
+            pkg = dcos.package.resolve_package(package)
+            if pkg is None:
+                raise ValueError('package "{}" not found. Check spelling or '
+                                 'update package sources.'.format(package))
+            template = remap_dcos_config(
+                pkg.config_json(pkg.latest_package_revision()))
+
         cell_config_yaml = yaml.load(readify(self.tmp("config.yaml")))
         renderer = Renderer(missing_tags=DECODE_ERRORS)
         try:
@@ -740,30 +2055,135 @@ Host {ip_wildcard}
             shell=True
         )
 
+    def scaling_targets(self):
+        """
+        Parses the `scale` arguments: <role>=<capacity> pairs, or a single
+        <role> <capacity> pair
+        :return: OrderedDict of role -> capacity
+        """
+        args = self.arguments['<scaling>']
+        if len(args) == 2 and not any("=" in arg for arg in args):
+            args = ["=".join(args)]
+        targets = collections.OrderedDict()
+        for arg in args:
+            role, _, capacity = arg.partition("=")
+            if not role or not capacity.isdigit():
+                raise Exception("Expecting <role>=<capacity>, got {}".format(arg))
+            targets[role] = int(capacity)
+        return targets
+
     @check_cell_exists
     def run_scale(self):
-        capacity = int(self.arguments['<capacity>'])
-        (group, current_capacity) = self.backend.get_role_capacity(
-            self.arguments['<role>']
-        )
-        if self.arguments['<role>'] in ['nucleus', 'stateful-body'] \
-                and capacity < current_capacity:
-            print textwrap.dedent("""\
-                WARNING: THIS WILL SCALE DOWN THE {} GROUP FROM {} TO {} !
-                Please check your current capacity / data usage to avoid data loss!
-            """).format(self.arguments["<role>"], current_capacity, capacity)
-            print "Are you sure ? (y/N)"
-            confirmation = raw_input(">")
-            if confirmation.lower() not in ['y', 'yes']:
-                print "Aborting scale down operation"
-                raise Exception("Expecting 'y' or 'yes'")
-        print "Scaling {}.{} ({}) to {}".format(
-            self.cell,
-            self.arguments["<role>"],
-            group,
-            capacity
-        )
-        self.backend.scale(self.arguments["<role>"], group, capacity)
+        targets = self.scaling_targets()
+        current = self.backend.get_role_capacities(list(targets))
+        for role, capacity in targets.items():
+            (group, current_capacity) = current[role]
+            if role in ['nucleus', 'stateful-body'] \
+                    and capacity < current_capacity \
+                    and not self.arguments["--yes"]:
+                self.say(textwrap.dedent("""\
+                    WARNING: THIS WILL SCALE DOWN THE {} GROUP FROM {} TO {} !
+                    Please check your current capacity / data usage to avoid data loss!
+                """).format(role, current_capacity, capacity))
+                if not self.confirm("Are you sure ? (y/N)"):
+                    self.say("Aborting scale down operation")
+                    return 1
+        waiters = []
+        if self.arguments["--wait"]:
+            waiters = [
+                self.backend.scale_waiter(role, current[role][0], capacity)
+                for role, capacity in targets.items()
+            ]
+        for role, capacity in targets.items():
+            self.say("Scaling {}.{} ({}) to {}".format(
+                self.cell,
+                role,
+                current[role][0],
+                capacity
+            ))
+        errors = self.backend.scale_all([
+            (role, current[role][0], capacity)
+            for role, capacity in targets.items()
+        ])
+        self.invalidate_cache()
+        for role, error in sorted(errors.items()):
+            self.say(colored("{}: {}".format(role, error), 'red'))
+        waiters = [waiter for waiter in waiters if waiter.role not in errors]
+        code = self.wait_for_scaling(waiters) if waiters else 0
+        return 1 if errors else code
+
+    def wait_for_scaling(self, waiters):
+        """
+        Polls the scaling groups until each runs its new capacity with all
+        its new instances ready (see ScaleWaiter), printing the scaling
+        activities and the time to ready of each new instance
+        :return: exit code: 0 on success, 1 if instances failed to provision,
+            2 on timeout
+        """
+        timeout = self.arguments["--wait-timeout"]
+        deadline = time.time() + float(timeout) if timeout else None
+        code = 0
+        # consecutive failed polls of each waiter
+        errors = collections.defaultdict(int)
+        while True:
+            for waiter in waiters:
+                if waiter.done:
+                    continue
+                try:
+                    for event in waiter.poll():
+                        if self.output.human:
+                            print "  ".join(event)
+                        else:
+                            self.output.row("events", ["role", "subject", "message"], event)
+                    errors[waiter.role] = 0
+                except Exception as e:
+                    errors[waiter.role] += 1
+                    if not self.backend.transient_error(e) or \
+                            errors[waiter.role] >= WAIT_MAX_ERRORS:
+                        self.say(colored("Polling {} failed: {}".format(
+                            waiter.group, e), 'red'))
+                        code = 1
+                        break
+                    # transient API errors, retry on the next poll
+                    log.debug("polling {} failed: {}".format(waiter.group, e))
+            sys.stdout.flush()
+            pending = [waiter for waiter in waiters if not waiter.done]
+            if code != 0 or len(pending) == 0:
+                break
+            wait = min(waiter.interval for waiter in pending)
+            if deadline is not None:
+                if time.time() >= deadline:
+                    self.say(colored("Timed out after {}s waiting for {}".format(
+                        timeout, ", ".join(w.role for w in pending)), 'red'))
+                    code = 2
+                    break
+                wait = min(wait, deadline - time.time())
+            time.sleep(wait)
+        if self.output.human:
+            rows = [
+                [waiter.role, instance_id, "{:.1f}s".format(seconds)]
+                for waiter in waiters
+                for instance_id, seconds in waiter.ready.items()
+            ] + [
+                [waiter.role, instance_id, reason]
+                for waiter in waiters
+                for instance_id, reason in waiter.failed.items()
+            ]
+            if len(rows) > 0:
+                print_table("Time to ready", rows)
+        else:
+            self.output.rows("ready", ["role", "instance_id", "seconds", "failure"], [
+                [waiter.role, instance_id, round(seconds, 3), None]
+                for waiter in waiters
+                for instance_id, seconds in waiter.ready.items()
+            ] + [
+                [waiter.role, instance_id, None, reason]
+                for waiter in waiters
+                for instance_id, reason in waiter.failed.items()
+            ])
+        if code == 0 and any(waiter.failed for waiter in waiters):
+            code = 1
+        return code
 
     def ssh_cmd(self, ip, ssh_executable="ssh", extra_opts="", command=""):
         ssh_options = first(
@@ -814,32 +2234,166 @@ Host {ip_wildcard}
 
     @check_cell_exists
     def run_cmd(self):
-        self.run_ssh(command=self.arguments['<command>'])
+        """
+        Runs a command on a node (<role> <index>), or fans it out over a
+        whole role (<role> '*') or the whole cell ('all' '*').
+        With a machine readable --output, a single node goes through the
+        fan out as well, so its output is written as rows
+        """
+        role = self.arguments['<role>']
+        index = self.arguments['<index>']
+        if role != 'all' and index != '*' and self.output.human:
+            self.run_ssh(command=self.arguments['<command>'])
+            return
+        self.ensure_config()
+        roles = ROLES[:] if role == 'all' else [role]
+        inventory = self.backend.inventory(format=self.get_ssh_ip_type())
+        hosts = []
+        for role_name in roles:
+            ips = flatten(inventory.get(role_name, []))
+            if index != '*':
+                ips = ips[int(index) - 1:int(index)]
+            hosts.extend([(role_name, ip) for ip in ips])
+        if len(hosts) == 0:
+            self.say("no nodes found for {} {}. Is the cell fully up?".format(
+                role, index))
+            return 1
+
+        output = self.output
+        results = self.ssh_fan_out(
+            hosts,
+            self.arguments['<command>'],
+            parallel=int(self.arguments['--parallel']),
+            timeout=self.arguments['--host-timeout'],
+            output=None if output.human else
+            lambda role, ip, line: output.row(
+                "output", ["ip", "role", "line"], [ip, role, line.rstrip("\n")])
+        )
+        if output.human:
+            print_table("Summary", (
+                [ip, role, "timeout" if timed_out else exit_code,
+                 "{:.1f}s".format(duration)]
+                for (role, ip, exit_code, duration, timed_out) in results
+            ))
+        else:
+            output.rows("summary", ["ip", "role", "exit_code", "seconds", "timed_out"], (
+                [ip, role, exit_code, round(duration, 3), timed_out]
+                for (role, ip, exit_code, duration, timed_out) in results
+            ))
+        failed = len([r for r in results if r[2] != 0])
+        self.say("{} of {} nodes failed".format(failed, len(results)))
+        return 1 if failed > 0 else 0
+
+    def ssh_fan_out(self, hosts, command, parallel=10, timeout=None,
+                    output=None):
+        """
+        Runs a command over ssh on many hosts at once, streaming their output
+        prefixed with "<host>|"
+        :param hosts: list of (role, ip) tuples
+        :param parallel: maximum number of concurrent ssh sessions
+        :param timeout: per host timeout in seconds, the ssh session is
+            killed when it expires
+        :param output: function(role, ip, line) the output lines are passed
+            to instead of being printed
+        :return: list of (role, ip, exit code, duration, timed out) tuples,
+            in the hosts order
+        """
+        from multiprocessing.pool import ThreadPool
+        output_lock = threading.Lock()
+        width = max(len(ip) for (_, ip) in hosts)
+        procs = []
+        interrupted = threading.Event()
+
+        def killpg(proc):
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        def run(host):
+            (role, ip) = host
+            start = time.time()
+            if interrupted.is_set():
+                return role, ip, None, 0, False
+            # reuses open master connections, but doesn't leave one behind
+            # per node (only the bastion one, through the ProxyCommand)
+            cmd = shlex.split(self.ssh_cmd(
+                ip, extra_opts="-o BatchMode=yes -o ControlMaster=no"))
+            # own process group, so a timeout also kills the ProxyCommand
+            proc = subprocess.Popen(cmd + [command],
+                                    stdin=open(os.devnull, 'r'),
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    preexec_fn=os.setsid)
+            procs.append(proc)
+            timed_out = []
+
+            def kill():
+                timed_out.append(True)
+                killpg(proc)
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(float(timeout), kill)
+                timer.start()
+            try:
+                for line in iter(proc.stdout.readline, b''):
+                    with output_lock:
+                        if output is not None:
+                            output(role, ip, line)
+                            continue
+                        sys.stdout.write("{}| {}".format(ip.ljust(width), line))
+                        sys.stdout.flush()
+                exit_code = proc.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            return role, ip, exit_code, time.time() - start, len(timed_out) > 0
+
+        pool = ThreadPool(max(1, min(parallel, len(hosts))))
+        try:
+            # map_async + get(timeout) keeps the wait interruptible (Ctrl-C)
+            return pool.map_async(run, hosts).get(sys.maxint)
+        except BaseException:
+            # the ssh sessions are in their own process groups, they don't
+            # get the terminal's SIGINT
+            interrupted.set()
+            for proc in procs:
+                killpg(proc)
+            raise
+        finally:
+            pool.close()
 
     def run_log(self):
         if not self.arguments["<role>"]:
-            refresh_interval = 2
+            tailer = self.backend.infra_log_tailer()
+            lines = collections.deque(maxlen=1000)
 
             def draw(stdscr):
                 while True:
                     try:
+                        for event in tailer.poll():
+                            lines.append("  ".join(
+                                self.backend.format_infra_event(event)))
+                        (height, width) = stdscr.getmaxyx()
                         stdscr.clear()
-                        stdscr.addstr("Refreshing every {}s: {}\n"
-                                .format(refresh_interval, datetime.datetime.now()))
-                        status = tabulate("Stack Events", self.backend.get_infra_log())
-                        for line in status.split("\n"):
+                        stdscr.addstr("Polling every {}s: {}\n"
+                                .format(tailer.interval, datetime.datetime.now()))
+                        # the most recent events that fit on the screen
+                        for line in list(lines)[-(height - 2):]:
                             try:
-                                stdscr.addstr("%s\n" % line)
+                                stdscr.addstr("%s\n" % line[:width - 1])
                             except:
                                 # when no space available on screen, break
                                 break
                         stdscr.refresh()
-                        time.sleep(refresh_interval)
+                        time.sleep(tailer.interval)
                     except KeyboardInterrupt:
                         break
                     except Exception as e:
-                        # any curses error should trigger a refresh
+                        # any curses or API error should trigger a refresh
+                        time.sleep(tailer.interval)
                         continue
+            import curses
             curses.wrapper(draw)
         else:
             self.run_ssh("tail -f -n 20 /var/log/cloud-init-output.log")
@@ -853,20 +2407,16 @@ Host {ip_wildcard}
         roles = ROLES[:]
         if self.arguments["<role>"]:
             roles = [self.arguments["<role>"]]
-        instances = []
-        for role in roles:
-            instances_for_role = self.backend.instances(
-                role=role,format=self.get_ssh_ip_type())
-            if instances_for_role is not None:
-                instances.extend(instances_for_role)
-        instances = flatten(instances)
-        machines = ",".join([d for d in instances])
+        inventory = self.backend.inventory(format=self.get_ssh_ip_type())
+        machines = ",".join(iter_flatten(
+            [inventory.get(role, []) for role in roles]))
         if self.key_file:
             sh.i2cssh("-d", "row", "-l", self.ssh_user, "-m", machines,
                     "-XF={}".format(self.tmp('ssh_config')))
 
     @check_cell_exists
     def run_mux(self):
+        import pystache
         self.ensure_config()
         if not sh.which('tmux'):
             print("You need tmux for this subcommand (brew install tmux).")
@@ -900,9 +2450,11 @@ windows:
             'roles': [],
         }
 
+        inventory = self.backend.inventory(format=self.get_ssh_ip_type())
         for role in sorted(roles):
+            instances = inventory.get(role, [])
             print("ROLE: {}".format(role))
-            print(self.backend.instances(role=role, format=self.get_ssh_ip_type()))
+            print(instances)
             cfg['roles'].append({
                 'name': role,
                 'instances': [
@@ -910,7 +2462,7 @@ windows:
                         'ip_addr': instance[0],
                         'ssh_cmd': self.ssh_cmd(instance[0]),
                     }
-                    for instance in self.backend.instances(role=role, format=self.get_ssh_ip_type())
+                    for instance in instances
                 ]
             })
 
@@ -924,6 +2476,9 @@ windows:
     @check_cell_exists
     def run_proxy(self):
         self.ensure_config()
+        self.stop_proxy_pool()
+        if self.arguments["--supervise"]:
+            return self.run_proxy_pool()
         try:
             subprocess.call("pkill -9 -f \"ssh.*proxy-cell\"", shell=True)
         except Exception:
@@ -931,8 +2486,11 @@ windows:
 
         logfile = self.tmp("proxy.log")
         proxy = self.backend.proxy()
+        # the tunnel gets its own connection, instead of being attached to
+        # (and dying with) a shared master connection
         cmd = self.ssh_cmd(proxy,
-                           extra_opts="-f -N -D{}".format(self.proxy_port),
+                           extra_opts="-f -N -D{} -o ControlPath=none"
+                           .format(self.proxy_port),
                            command="&>{}".format(logfile))
         print cmd
         try:
@@ -943,6 +2501,88 @@ windows:
             print "Failed to create proxy. See log at {}".format(logfile)
             print err.output
 
+    def run_proxy_pool(self):
+        def nodes(refresh):
+            if refresh:
+                self.backend.invalidate_cache()
+            return self.backend.proxies()
+
+        def command(node, port):
+            # rewritten when it expires, e.g. after a bastion replacement
+            self.ensure_ssh_config()
+            return shlex.split(self.ssh_cmd(
+                node,
+                extra_opts="-N -D 127.0.0.1:{port} -o ControlPath=none "
+                           "-o BatchMode=yes -o ExitOnForwardFailure=yes "
+                           "-o ServerAliveInterval={interval} "
+                           "-o ServerAliveCountMax=3"
+                .format(port=port, interval=int(self.proxy_check_seconds))))
+
+        pid_file = self.tmp("proxy.pid")
+        with open(pid_file, "wb+") as f:
+            f.write(str(os.getpid()))
+        try:
+            ProxyPool(self.proxy_port, int(self.arguments["--tunnels"]),
+                      nodes, command, self.tmp("proxy.log"),
+                      check_seconds=self.proxy_check_seconds,
+                      timeout=float(self.ssh_timeout)).serve()
+        finally:
+            if os.path.exists(pid_file) and readify(pid_file) == str(os.getpid()):
+                os.remove(pid_file)
+
+    def stop_proxy_pool(self):
+        """
+        Stops the `proxy --supervise` process of the cell, if one is running
+        """
+        pid_file = self.tmp("proxy.pid")
+        if not os.path.exists(pid_file):
+            return
+        pid = readify(pid_file).strip()
+        os.remove(pid_file)
+        # the pid file may be stale, don't kill an unrelated process
+        try:
+            command = subprocess.check_output(["ps", "-o", "command=", "-p", pid])
+        except (subprocess.CalledProcessError, OSError):
+            return
+        if "proxy" not in command:
+            return
+        try:
+            os.kill(int(pid), signal.SIGTERM)
+        except OSError:
+            return
+        # wait for it to release the proxy port
+        for _ in range(50):
+            try:
+                os.kill(int(pid), 0)
+            except OSError:
+                break
+            time.sleep(0.1)
+        print "STOPPED proxy {}".format(pid)
+
+    def run_disconnect(self):
+        self.stop_proxy_pool()
+        self.close_ssh_masters()
+
+    def run_agent(self):
+        client = AgentClient(self.agent_socket, timeout=5)
+        try:
+            pid = client.request(op="stop" if self.arguments["--stop"] else "ping")["result"]
+        except (IOError, ValueError):
+            pid = None
+        finally:
+            client.close()
+        if self.arguments["--stop"]:
+            if pid is None:
+                print "No cell agent running on {}".format(self.agent_socket)
+                return 1
+            print "Stopped cell agent {}".format(pid)
+            return 0
+        if pid is not None:
+            print "cell agent {} already running on {}".format(pid, self.agent_socket)
+            return 1
+        Agent(self.agent_socket, self.version,
+              self.agent_refresh_seconds, self.agent_idle_seconds).serve()
+
 def docopt_sub_args_hack(all_args, version):
     # docopt hack to allow arbitrary arguments to docopt
     # necessary to call dcos subcommand
@@ -955,6 +2595,8 @@ def docopt_sub_args_hack(all_args, version):
             if arg == "--backend" or arg == "--cell_config":
                 args_to_pass.append(dcos_args.pop(idx))
                 args_to_pass.append(dcos_args.pop(idx))
+            elif arg in ["--no-cache", "--trace"]:
+                args_to_pass.append(dcos_args.pop(idx))
             else:
                 idx = idx + 1
         cell_args = docopt(__doc__, argv=args_to_pass, version=version)
@@ -980,7 +2622,7 @@ def setup_dirs():
     mkdir_p(TMPDIR)
 
 def setup_logging():
-    global DIR, TMPDIR, log
+    global DIR, TMPDIR
     # Logs are in ~/.cellos/generated. Only load logs after this is created
     with open(os.path.join(DIR, 'config', 'logging.yaml'), 'r') as config:
         log_dict = yaml.load(config)
@@ -990,30 +2632,37 @@ def setup_logging():
             os.path.basename(log_path)
         )
         logging.config.dictConfig(log_dict)
-    log = logging.getLogger('cell-cli')
 
 def get_version():
-    return readify(DIR + '/VERSION').strip()
+    with open(os.path.join(DIR, 'VERSION'), 'r') as f:
+        return f.read().strip()
 
 def main(all_args):
+    import colorama
     colorama.init()
     setup_dirs()
-    setup_logging()
     version = get_version()
+    # --help / --version exit here, before logging is configured
     cell_args, dcos_args = docopt_sub_args_hack(all_args, version)
+    setup_logging()
 
+    # stdout only carries the rows of a machine readable --output
+    human = first(cell_args.get("--output"), "table") == "table"
+    errors = sys.stdout if human else sys.stderr
     if cell_args["<cell-name>"] and len(cell_args["<cell-name>"]) >= 22:
-        print(colored("<cell-name> argument must be < 22 chars long.\n"
-                      "It is used to build other resource names (e.g. ELB name "
-                      "is 32 chars max)", 'red'))
+        errors.write(colored("<cell-name> argument must be < 22 chars long.\n"
+                             "It is used to build other resource names (e.g. ELB name "
+                             "is 32 chars max)", 'red') + "\n")
         sys.exit(1)
     cell = Cell(cell_args, version)
     try:
-        cell.run(dcos=dcos_args)
+        exit_code = cell.run(dcos=dcos_args)
     except Exception as e:
-        traceback.print_exc(file=sys.stdout)
-        print(colored("{}: {}".format(cell.command, e), 'red'))
+        traceback.print_exc(file=errors)
+        errors.write(colored("{}: {}".format(cell.command, e), 'red') + "\n")
         sys.exit(1)
+    if isinstance(exit_code, int):
+        sys.exit(exit_code)
 
 def entrypoint():
     main(sys.argv)
@@ -1,7 +1,15 @@
+import collections
+import copy
+import functools
+import hashlib
+import imp
+import json
 import os
+import Queue
 import re
-import sh
 import sys
+import threading
+import time
 import traceback
 
 import yaml
@@ -11,10 +19,10 @@ if os.name == 'posix' and sys.version_info[0] < 3:
 else:
     pass
 
-import boto3
-import boto3.session
 import jmespath
 
+from multiprocessing.pool import ThreadPool
+
 
 def first(*args):
     for item in args:
@@ -23,16 +31,544 @@ def first(*args):
     return None
 
 
+DEFAULT_INSTANCE_FORMAT = \
+    "PublicIpAddress, PrivateIpAddress, InstanceId, ImageId, State.Name"
+
+# instance attributes kept in the inventory; the `format` expressions passed to
+# instances() / inventory() are evaluated against these records
+INSTANCE_RECORD = "{" \
+    "PublicIpAddress: PublicIpAddress, " \
+    "PrivateIpAddress: PrivateIpAddress, " \
+    "InstanceId: InstanceId, " \
+    "ImageId: ImageId, " \
+    "InstanceType: InstanceType, " \
+    "State: {Name: State.Name}, " \
+    "Tags: Tags" \
+    "}"
+
+
+MB = 1024 * 1024
+
+# cells with more instances than this aren't kept in the inventory cache, so
+# streaming them doesn't hold every record in memory
+INVENTORY_CACHE_MAX_INSTANCES = 10000
+
+# final statuses of a successful stack operation; any other status not
+# ending in _IN_PROGRESS means the operation failed or rolled back
+STACK_SUCCESS_STATUSES = ["CREATE_COMPLETE", "UPDATE_COMPLETE", "DELETE_COMPLETE"]
+
+# max keys per DeleteObjects call
+S3_DELETE_BATCH = 1000
+
+# error codes of API calls worth retrying, throttling and server side
+# failures
+TRANSIENT_ERROR_CODES = [
+    "Throttling", "ThrottlingException", "RequestLimitExceeded",
+    "SlowDown", "ServiceUnavailable", "InternalError", "InternalFailure",
+    "RequestTimeout", "500", "503",
+]
+
+# final statuses of an auto scaling activity
+SCALING_ACTIVITY_DONE = ["Successful", "Failed", "Cancelled"]
+
+# statuses of the stacks `cell list` shows, every one but DELETE_COMPLETE
+LISTED_STACK_STATUSES = [
+    "CREATE_IN_PROGRESS", "CREATE_FAILED", "CREATE_COMPLETE",
+    "ROLLBACK_IN_PROGRESS", "ROLLBACK_FAILED", "ROLLBACK_COMPLETE",
+    "DELETE_IN_PROGRESS", "DELETE_FAILED",
+    "UPDATE_IN_PROGRESS", "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS",
+    "UPDATE_COMPLETE", "UPDATE_ROLLBACK_IN_PROGRESS", "UPDATE_ROLLBACK_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS", "UPDATE_ROLLBACK_COMPLETE",
+    "REVIEW_IN_PROGRESS",
+]
+
+# the cell templates (and their nested stacks) are described as
+# "cell-os-base - <url>"
+CELL_TEMPLATE_DESCRIPTION = "cell-os"
+
+NESTED_STACK = re.compile(r".*(MembraneStack|NucleusStack|StatefulBodyStack|"
+                          r"StatelessBodyStack|BastionStack).*")
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MB), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+# template generator modules (deploy/aws/*.py) loaded in-process
+_template_generators = {}
+
+
+def load_template_generator(path):
+    if path not in _template_generators:
+        name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+        _template_generators[path] = imp.load_source(name, path)
+    return _template_generators[path]
+
+
+def write_template(generator, kwargs, out, digest):
+    template = generator.build_template(**kwargs)
+    with open(out, "wb+") as f:
+        f.write(template.to_json(indent=2) + "\n")
+    with open(out + ".sha256", "wb+") as f:
+        f.write(digest)
+
+
+def read_digest(out):
+    """
+    :return: the digest written by write_template next to `out`, None when
+        there is none
+    """
+    try:
+        with open(out + ".sha256", 'r') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
 class KeyException(Exception):
     pass
 
 
+class LookupTimeout(Exception):
+    pass
+
+
+class DeleteException(Exception):
+    pass
+
+
+def parallel(calls, timeout=None, max_workers=8):
+    """
+    Runs independent calls concurrently on a bounded thread pool
+    :param calls: dict of name -> function with no arguments
+    :param timeout: seconds each call is allowed to take before it is reported
+        as timed out (measured from the moment all calls are submitted)
+    :return: generator of (name, result, error) tuples, in completion order
+    """
+    results = Queue.Queue()
+
+    def run(name, call):
+        try:
+            results.put((name, call(), None))
+        except Exception as e:
+            results.put((name, None, e))
+
+    pool = ThreadPool(max(1, min(max_workers, len(calls))))
+    try:
+        for name, call in calls.items():
+            pool.apply_async(run, (name, call))
+        deadline = time.time() + timeout if timeout else None
+        pending = set(calls.keys())
+        while pending:
+            try:
+                if deadline is None:
+                    # a timeout is needed to keep the wait interruptible
+                    name, result, error = results.get(timeout=3600)
+                else:
+                    name, result, error = results.get(
+                        timeout=max(0, deadline - time.time()))
+            except Queue.Empty:
+                if deadline is None:
+                    # no deadline, the calls are just slow
+                    continue
+                for name in sorted(pending):
+                    yield name, None, LookupTimeout(
+                        "{} timed out after {}s".format(name, timeout))
+                return
+            pending.discard(name)
+            yield name, result, error
+    finally:
+        # not terminate(), which waits ~100ms on the pool handler threads.
+        # The workers are daemon threads, calls that timed out are left to
+        # finish in the background
+        pool.close()
+
+
+class InventoryCache(object):
+    """
+    JSON file backed cache for cell inventory data (instances, stacks, ELBs,
+    VPC id, NAT IP). Entries expire after `ttl` seconds.
+    Empty results are not cached, as they usually mean the cell is still
+    provisioning.
+    """
+    def __init__(self, path, ttl, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled and path is not None
+        self.lock = threading.Lock()
+        # (file identity, parsed entries) of the last load, so long lived
+        # processes (`cell agent`) only parse the file again when it changes
+        self._loaded = None
+
+    def _identity(self):
+        st = os.stat(self.path)
+        return st.st_ino, st.st_mtime, st.st_size
+
+    def _load(self):
+        try:
+            identity = self._identity()
+            loaded = self._loaded
+            if loaded is not None and loaded[0] == identity:
+                return loaded[1]
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            self._loaded = (identity, entries)
+            return entries
+        except (OSError, IOError, ValueError):
+            return {}
+
+    def _store(self, entries):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb+") as f:
+            f.write(json.dumps(entries, default=str))
+        os.rename(tmp_path, self.path)
+        self._loaded = (self._identity(), entries)
+
+    def get(self, key, loader):
+        """
+        :param key: cache entry key
+        :param loader: function called to (re)load the value when missing
+        :return: the cached value, or the loaded one
+        """
+        value = self.lookup(key)
+        if value is None:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def lookup(self, key):
+        """
+        :return: a copy of the cached value, None when missing or expired
+        """
+        if self.enabled:
+            entry = self._load().get(key)
+            if entry is not None and time.time() - entry["time"] < self.ttl:
+                # the parsed entries are shared by the threads and callers
+                # of this process
+                return copy.deepcopy(entry["value"])
+        return None
+
+    def put(self, key, value):
+        if self.path is not None and value:
+            with self.lock:
+                # a new dict, lookups may be reading the loaded one
+                entries = dict(self._load())
+                entries[key] = {"time": time.time(),
+                                "value": copy.deepcopy(value)}
+                self._store(entries)
+
+    def discard(self, key):
+        """
+        Drops a single entry
+        """
+        if self.path is not None:
+            with self.lock:
+                entries = dict(self._load())
+                if entries.pop(key, None) is not None:
+                    self._store(entries)
+
+    def invalidate(self):
+        self._loaded = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ApiTracer(object):
+    """
+    Records the AWS API calls of a boto3 session (service, operation,
+    latency, retries, HTTP status and payload sizes), through the botocore
+    events. Each call is appended to a JSON lines file as it completes.
+    """
+    def __init__(self, path, command=None):
+        self.path = path
+        self.command = command
+        self.records = []
+        self.lock = threading.Lock()
+
+    def attach(self, session):
+        events = session._session
+        events.register("before-parameter-build", self._start)
+        events.register("before-call", self._request)
+        events.register("needs-retry", self._attempt)
+        events.register("after-call", self._end)
+
+    # the context dict is specific to each call, and is passed to all events
+    def _start(self, context, **kwargs):
+        context["trace_start"] = time.time()
+        context["trace_attempts"] = 1
+
+    def _request(self, params, context, **kwargs):
+        body = params.get("body")
+        context["trace_request_bytes"] = \
+            len(body) if isinstance(body, (str, bytes)) else None
+
+    def _attempt(self, attempts, request_dict, **kwargs):
+        context = request_dict.get("context")
+        if context is not None:
+            context["trace_attempts"] = attempts
+
+    def _end(self, http_response, model, context, **kwargs):
+        if "trace_start" not in context:
+            return
+        length = http_response.headers.get("content-length")
+        record = {
+            "time": context["trace_start"],
+            "pid": os.getpid(),
+            "command": self.command,
+            "service": model.service_model.endpoint_prefix,
+            "operation": model.name,
+            "latency_ms": round((time.time() - context["trace_start"]) * 1000, 3),
+            "retries": context["trace_attempts"] - 1,
+            "status": http_response.status_code,
+            "request_bytes": context.get("trace_request_bytes"),
+            "response_bytes": int(length) if length is not None else None,
+            "thread": threading.current_thread().name,
+        }
+        with self.lock:
+            self.records.append(record)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def summary(self):
+        """
+        :return: [operation, calls, retries, total ms, max ms] rows, the
+            most time consuming operations first
+        """
+        operations = {}
+        for record in self.records:
+            name = "{}.{}".format(record["service"], record["operation"])
+            row = operations.setdefault(name, [name, 0, 0, 0.0, 0.0])
+            row[1] += 1
+            row[2] += record["retries"]
+            row[3] += record["latency_ms"]
+            row[4] = max(row[4], record["latency_ms"])
+        return sorted(operations.values(), key=lambda row: -row[3])
+
+
+class StackEventTailer(object):
+    """
+    Follows the CloudFormation events of a stack and of its nested stacks.
+    Each poll only fetches the events newer than the last seen EventId of
+    each stack, and the polling interval backs off while nothing changes.
+    """
+    def __init__(self, client, stack, min_interval=2, max_interval=30,
+                 timeout=None):
+        self.client = client
+        self.stack = stack
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.timeout = timeout
+        # stack name / id -> last seen EventId
+        self.last_seen = {stack: None}
+        self.discovered = False
+        # latest status of the followed (root) stack
+        self.status = None
+
+    def _nested_stacks(self, stack):
+        paginator = self.client.get_paginator("list_stack_resources")
+        return [
+            resource["PhysicalResourceId"]
+            for page in paginator.paginate(StackName=stack)
+            for resource in page["StackResourceSummaries"]
+            if resource["ResourceType"] == "AWS::CloudFormation::Stack"
+            and resource.get("PhysicalResourceId")
+        ]
+
+    def _new_events(self, stack):
+        """
+        :return: the events of the stack since the last poll, newest first.
+            The first poll of a stack only returns its latest page of events.
+        """
+        last_seen = self.last_seen.get(stack)
+        events = []
+        paginator = self.client.get_paginator("describe_stack_events")
+        for page in paginator.paginate(StackName=stack):
+            for event in page["StackEvents"]:
+                if event["EventId"] == last_seen:
+                    return events
+                events.append(event)
+            if last_seen is None:
+                break
+        return events
+
+    def poll(self):
+        """
+        :return: new events of all the tracked stacks, oldest first. Raises
+            the error of a stack whose events couldn't be fetched, the next
+            poll fetches the events of all the stacks again
+        """
+        if not self.discovered:
+            for nested in self._nested_stacks(self.stack):
+                self.last_seen.setdefault(nested, None)
+            self.discovered = True
+        results = list(parallel(
+            dict((stack, functools.partial(self._new_events, stack))
+                 for stack in self.last_seen.keys()),
+            timeout=self.timeout))
+        for _, _, error in results:
+            if error is not None:
+                raise error
+        events = []
+        for stack, result, _ in results:
+            if len(result) > 0:
+                self.last_seen[stack] = result[0]["EventId"]
+            events.extend(result)
+        # sub-stacks created since the last poll
+        for event in events:
+            if event["ResourceType"] == "AWS::CloudFormation::Stack" \
+                    and event.get("PhysicalResourceId") \
+                    and event["PhysicalResourceId"] != event["StackId"]:
+                self.last_seen.setdefault(event["PhysicalResourceId"], None)
+        if len(events) > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        events = sorted(events, key=lambda e: e["Timestamp"])
+        for event in events:
+            if event.get("PhysicalResourceId") == event["StackId"] \
+                    and self.stack in [event["StackId"], event["StackName"]]:
+                self.status = event["ResourceStatus"]
+        return events
+
+    def skip_existing(self):
+        """
+        Marks the events so far as seen, so the next polls only return the
+        events of the stack operation that follows
+        """
+        self.poll()
+        self.status = None
+        self.interval = self.min_interval
+
+    @property
+    def done(self):
+        """
+        True once the stack reached a final status. CloudFormation only
+        completes a stack after all its nested stacks did.
+        """
+        return self.status is not None \
+            and not self.status.endswith("_IN_PROGRESS")
+
+    @property
+    def succeeded(self):
+        return self.status in STACK_SUCCESS_STATUSES
+
+
+class ScaleWaiter(object):
+    """
+    Follows the scaling of a role auto scaling group until it runs the new
+    capacity and each new instance is ready: InService in the group,
+    InService behind the group load balancers (Mesos, Marathon, Gateway, ..)
+    and done provisioning (`<role> end` in its status file).
+    Instances and scaling activities from before the scaling are left out.
+    """
+    def __init__(self, backend, role, group, capacity, interval=10):
+        self.backend = backend
+        self.role = role
+        self.group = group
+        self.capacity = capacity
+        self.interval = interval
+        self.start = time.time()
+        self.known = set(instance["InstanceId"]
+                         for instance in self._describe_group()["Instances"])
+        self.seen_activities = set(activity["ActivityId"]
+                                   for activity in self._activities())
+        # instance id -> seconds from the scaling to ready
+        self.ready = collections.OrderedDict()
+        # instance id -> reason
+        self.failed = collections.OrderedDict()
+        self.done = False
+
+    def _describe_group(self):
+        return self.backend.asg.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.group]
+        )["AutoScalingGroups"][0]
+
+    def _activities(self):
+        return self.backend.asg.describe_scaling_activities(
+            AutoScalingGroupName=self.group
+        )["Activities"]
+
+    def _healthy(self, group, instance_ids):
+        healthy = set(instance_ids)
+        for load_balancer in group.get("LoadBalancerNames", []):
+            healthy &= set(
+                state["InstanceId"]
+                for state in self.backend.elb.describe_instance_health(
+                    LoadBalancerName=load_balancer)["InstanceStates"]
+                if state["State"] == "InService"
+            )
+        return healthy
+
+    def poll(self):
+        """
+        :return: [role, subject, message] rows for the scaling activities
+            that completed and the instances that got ready or failed since
+            the previous poll
+        """
+        events = []
+        # activities come newest first
+        for activity in reversed(self._activities()):
+            if activity["ActivityId"] in self.seen_activities \
+                    or activity["StatusCode"] not in SCALING_ACTIVITY_DONE:
+                continue
+            self.seen_activities.add(activity["ActivityId"])
+            events.append([self.role, activity["StatusCode"],
+                           activity["Description"]])
+
+        group = self._describe_group()
+        instances = group["Instances"]
+        launched = [
+            instance["InstanceId"] for instance in instances
+            if instance["LifecycleState"] == "InService"
+            and instance["InstanceId"] not in self.known
+            and instance["InstanceId"] not in self.ready
+            and instance["InstanceId"] not in self.failed
+        ]
+        # done provisioning, ready once healthy behind the load balancers
+        provisioned = []
+        for instance_id in launched:
+            status = self.backend.provisioning_status(instance_id)
+            if status is None:
+                continue
+            # failures are final, whether the load balancers see the
+            # instance healthy or not
+            failed = [line[0] for line in status if line[1:2] == ["failed"]]
+            if len(failed) > 0:
+                self.failed[instance_id] = "{} failed".format(failed[-1])
+                events.append([self.role, instance_id,
+                               self.failed[instance_id]])
+            elif [self.role, "end"] in [line[:2] for line in status]:
+                provisioned.append(instance_id)
+        if len(provisioned) > 0:
+            healthy = self._healthy(group, provisioned)
+            for instance_id in [i for i in provisioned if i in healthy]:
+                self.ready[instance_id] = time.time() - self.start
+                events.append([self.role, instance_id, "ready in {:.1f}s"
+                               .format(self.ready[instance_id])])
+
+        self.done = len(instances) == self.capacity and all(
+            instance["LifecycleState"] == "InService" and (
+                instance["InstanceId"] in self.known
+                or instance["InstanceId"] in self.ready
+                or instance["InstanceId"] in self.failed)
+            for instance in instances
+        )
+        return events
+
+
 class AwsBackend(object):
     name = "aws"
 
-    def __init__(self, config, base):
+    def __init__(self, config, base, region=None):
         self.config = config
         self.base = base
+        # overrides the configured region
+        self._region = region
         session_args = {
             "region_name": self.region,
             "aws_access_key_id": self.aws_access_key_id,
@@ -40,13 +576,18 @@ class AwsBackend(object):
         }
         if self.aws_session_token is not None:
             session_args["aws_session_token"] = self.aws_session_token
-
-        self.session = boto3.session.Session(**session_args)
-        self.cfn = self.session.resource('cloudformation')
-        self.s3 = self.session.resource('s3')
-        self.ec2 = self.session.client('ec2')
-        self.elb = self.session.client('elb')
-        self.asg = self.session.client('autoscaling')
+        self.session_args = session_args
+        # boto3 is imported and its session / clients are created on first
+        # use, so commands served from the local cache don't pay for them
+        self._session = None
+        self._clients = {}
+        self._session_lock = threading.RLock()
+        # cell stack metadata, fetched at most once per invocation
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+        trace_file = getattr(self.base, "trace_file", None)
+        self.tracer = ApiTracer(trace_file, getattr(self.base, "command", None)) \
+            if trace_file else None
 
         pkg_dir = os.path.dirname(os.path.abspath(__file__))
         with open(os.path.join(pkg_dir, '../config/cell.yaml'), 'r') as stream:
@@ -54,10 +595,80 @@ class AwsBackend(object):
             ip_allocation = cell['nat_egress_ip']
             self.eip_allocation = ip_allocation if ip_allocation else ''
 
+        tmp_dir = getattr(self.base, "tmp_dir", None)
+        self.cache = InventoryCache(
+            os.path.join(tmp_dir, "inventory.json") if tmp_dir else None,
+            getattr(self.base, "cache_expiry_seconds", 0),
+            enabled=getattr(self.base, "use_cache", False)
+        )
+        # the account wide stack listing, one entry per region
+        catalog_dir = getattr(self.base, "catalog_dir", None)
+        self.catalog_cache = InventoryCache(
+            os.path.join(catalog_dir, "stacks.json") if catalog_dir else None,
+            self.stack_catalog_ttl,
+            enabled=getattr(self.base, "use_cache", False)
+        )
+
+    def _new_session(self):
+        import boto3.session
+        return boto3.session.Session(**self.session_args)
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._new_session()
+                if self.tracer is not None:
+                    self.tracer.attach(self._session)
+            return self._session
+
+    def _client(self, kind, name):
+        # boto3 sessions are not thread safe, clients are
+        with self._session_lock:
+            if (kind, name) not in self._clients:
+                factory = getattr(self.session, kind)
+                self._clients[(kind, name)] = factory(name)
+            return self._clients[(kind, name)]
+
+    @property
+    def cfn(self):
+        return self._client('resource', 'cloudformation')
+
+    @property
+    def s3(self):
+        return self._client('resource', 's3')
+
+    @property
+    def ec2(self):
+        return self._client('client', 'ec2')
+
+    @property
+    def elb(self):
+        return self._client('client', 'elb')
+
+    @property
+    def asg(self):
+        return self._client('client', 'autoscaling')
+
     @property
     def region(self):
+        return first(self._region, self.default_region)
+
+    @property
+    def default_region(self):
         return first(os.getenv('AWS_DEFAULT_REGION'), self.config.region, 'us-west-1')
 
+    @property
+    def regions(self):
+        """
+        :return: regions listed by `cell list --all-regions`, None for all
+            the regions enabled for the account
+        """
+        regions = first(os.getenv('AWS_REGIONS'), self.config.regions)
+        if regions:
+            return [region.strip() for region in regions.split(",") if region.strip()]
+        return None
+
     @property
     def aws_access_key_id(self):
         return first(os.getenv('AWS_ACCESS_KEY_ID'), self.config.aws_access_key_id)
@@ -70,6 +681,22 @@ class AwsBackend(object):
     def aws_session_token(self):
         return first(os.getenv('AWS_SESSION_TOKEN'), self.config.aws_session_token)
 
+    @property
+    def stack_catalog_ttl(self):
+        return float(first(
+            os.getenv('STACK_CATALOG_TTL'),
+            self.config.aws_stack_catalog_ttl,
+            30
+        ))
+
+    @property
+    def lookup_timeout(self):
+        return float(first(
+            os.getenv('AWS_LOOKUP_TIMEOUT'),
+            self.config.aws_lookup_timeout,
+            30
+        ))
+
     @property
     def existing_bucket(self):
         return first(
@@ -106,32 +733,99 @@ class AwsBackend(object):
     def stack(self):
         return self.base.cell
 
-    def cell_exists(self):
+    def cell_exists(self, refresh=False):
+        """
+        :param refresh: check the stack itself rather than the cached
+            snapshot, for the commands that change the cell
+        """
         try:
             # if the cell parameter is defined, check it
             if self.base.cell is not None:
-                tmp = self.session.client('cloudformation').describe_stacks(
-                    StackName=self.base.cell
-                )
-                return tmp is not None
+                return self.stack_snapshot(refresh=refresh) is not None
         except Exception:
             return False
 
+    def stack_snapshot(self, refresh=False):
+        """
+        The cell stack metadata (id, status, version tag, outputs, VPC id),
+        fetched with a single targeted describe_stacks call and shared by
+        cell_exists(), version() and the VPC lookups of the invocation.
+        Existing stacks are also kept in the inventory cache.
+        :param refresh: describe the stack again, updating the cached snapshot
+        :return: dict, or None when the stack doesn't exist
+        """
+        with self._snapshot_lock:
+            if refresh:
+                self._snapshot = self.__describe_stack()
+                if self._snapshot:
+                    self.cache.put("stack", self._snapshot)
+                else:
+                    self.cache.discard("stack")
+            elif self._snapshot is None:
+                self._snapshot = self.cache.get("stack", self.__describe_stack)
+            return self._snapshot or None
+
+    def __describe_stack(self):
+        from botocore.exceptions import ClientError
+        try:
+            stack = self.cfn.meta.client.describe_stacks(
+                StackName=self.stack
+            )["Stacks"][0]
+        except ClientError as e:
+            if "does not exist" in str(e):
+                return {}
+            raise
+        tags = dict((tag["Key"], tag["Value"]) for tag in stack.get("Tags", []))
+        outputs = dict((output["OutputKey"], output["OutputValue"])
+                       for output in stack.get("Outputs", []))
+        return {
+            "StackId": stack["StackId"],
+            "StackName": stack["StackName"],
+            "StackStatus": stack["StackStatus"],
+            "CreationTime": str(stack["CreationTime"]),
+            "version": tags.get("version"),
+            "Outputs": outputs,
+            "VpcId": outputs.get("VpcIdOutput"),
+        }
+
     def build_stack_files(self):
+        """
+        Generates the stack and sub-stack templates, in-process and
+        concurrently. A template is only regenerated when the hash of its
+        inputs (generator arguments, cell.yaml and generator source) differs
+        from the one recorded next to it (<template>.json.sha256)
+        """
         dir = self.base.cell_dir
-        sh.mkdir("-p", dir + "/deploy/aws/build/config")
-
-        args = [dir + "/deploy/aws/elastic-cell.py"]
+        with open(self.base.tmp_dir + "/net-whitelist.json", 'r') as f:
+            stack_args = {"net_whitelist": json.loads(f.read())}
         if self.base.template_url:
-            args += ["--template-url", self.base.template_url]
+            stack_args["template_url"] = self.base.template_url
         if self.base.cidr:
-            args += ["--cidr", self.base.cidr]
-        args += ["--net-whitelist", self.base.tmp_dir + "/net-whitelist.json"]
-        print "Building stack ..."
-        sh.python(args, _out=self.base.tmp_dir + "/elastic-cell.json")
-        print "Building sub-stack ..."
-        sh.python([dir + "/deploy/aws/elastic-cell-scaling-group.py"],
-                  _out=self.base.tmp_dir + "/elastic-cell-scaling-group.json")
+            stack_args["cidr"] = self.base.cidr
+        builds = [
+            ("stack", "elastic-cell", stack_args),
+            ("sub-stack", "elastic-cell-scaling-group", {}),
+        ]
+        calls = {}
+        for (description, name, kwargs) in builds:
+            generator = os.path.join(dir, "deploy/aws", name + ".py")
+            out = os.path.join(self.base.tmp_dir, name + ".json")
+            digest = hashlib.sha256(json.dumps(kwargs, sort_keys=True))
+            for path in [generator, os.path.join(dir, "deploy/config/cell.yaml")]:
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+            digest = digest.hexdigest()
+            if os.path.exists(out) and read_digest(out) == digest:
+                print "Using cached {} {}".format(description, out)
+                continue
+            print "Building {} ...".format(description)
+            # loaded up front, imports are not meant to run concurrently
+            module = load_template_generator(generator)
+            calls[name] = functools.partial(
+                write_template, module, kwargs, out, digest)
+        for (name, _, error) in parallel(calls):
+            if error is not None:
+                raise error
 
     def build(self):
         self.build_stack_files()
@@ -164,30 +858,109 @@ class AwsBackend(object):
         cors.put(CORSConfiguration=config)
 
     def seed(self):
-
-        self.upload(self.base.tmp_dir + "/seed.tar.gz", "/shared/cell-os/")
         dir = self.base.cell_dir
-        self.upload(
-            "{}/cell-os-base.yaml".format(dir),
-            "/shared/cell-os/cell-os-base-{}.yaml".format(self.base.version)
-        )
-        self.upload(dir + "/deploy/aws/resources/status.html",
-                    "/shared/status/",
-                    extra_args={"ContentType": "text/html"})
-        self.upload(dir + "/deploy/machine/user-data",
-                    "/shared/cell-os/")
+        self.upload_all([
+            (self.base.tmp_dir + "/seed.tar.gz", "/shared/cell-os/"),
+            ("{}/cell-os-base.yaml".format(dir),
+             "/shared/cell-os/cell-os-base-{}.yaml".format(self.base.version)),
+            (dir + "/deploy/aws/resources/status.html", "/shared/status/",
+             {"ContentType": "text/html"}),
+            (dir + "/deploy/machine/user-data", "/shared/cell-os/"),
+        ])
 
     def delete_bucket(self):
         if not self.existing_bucket:
-            delete_response = self.s3.Bucket(self.bucket).objects.delete()
             print "DELETE s3://{}".format(self.bucket)
+            self.delete_objects()
             self.s3.Bucket(self.bucket).delete()
         else:
-            print "DELETE s3://{}/{}".format(self.bucket, self.base.full_cell)  # only delete bucket sub-folder
-            delete_response = self.s3.Bucket(self.bucket).objects.filter(Prefix=self.base.full_cell).delete()
-        if len(delete_response) > 0:
-            for f in delete_response[0]['Deleted']:
-                print "DELETE s3://{}".format(f['Key'])
+            # only delete bucket sub-folder
+            print "DELETE s3://{}/{}".format(self.bucket, self.base.full_cell)
+            self.delete_objects(prefix=self.base.full_cell + "/")
+
+    def delete_objects(self, prefix=None, workers=10):
+        """
+        Deletes the objects of the cell bucket, including old versions and
+        delete markers, and aborts the incomplete multipart uploads.
+        Keys are listed page by page and deleted in DeleteObjects batches
+        on a pool of workers, while the next pages are being listed.
+        :param prefix: only delete the keys starting with it
+        :param workers: number of concurrent DeleteObjects calls
+        :return: number of deleted object versions
+        """
+        client = self.s3.meta.client
+        args = {"Bucket": self.bucket}
+        if prefix:
+            args["Prefix"] = prefix
+
+        for page in client.get_paginator("list_multipart_uploads").paginate(**args):
+            for upload in page.get("Uploads", []):
+                print "ABORT multipart upload s3://{}/{}".format(
+                    self.bucket, upload["Key"])
+                client.abort_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=upload["Key"],
+                    UploadId=upload["UploadId"]
+                )
+
+        lock = threading.Lock()
+        # bounds the listed but not yet deleted keys
+        slots = threading.BoundedSemaphore(workers * 2)
+        progress = {"deleted": 0, "failed": 0, "errors": []}
+        start = time.time()
+
+        def delete(batch):
+            try:
+                response = client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": batch, "Quiet": True}
+                )
+                errors = response.get("Errors", [])
+                failed = len(errors)
+            except Exception as e:
+                # the whole batch failed
+                errors = [{"Key": "*", "Message": str(e)}]
+                failed = len(batch)
+            finally:
+                slots.release()
+            with lock:
+                progress["deleted"] += len(batch) - failed
+                progress["failed"] += failed
+                progress["errors"].extend(errors)
+                elapsed = max(time.time() - start, 0.001)
+                print "DELETED {} objects from s3://{} ({:.0f} objects/s)".format(
+                    progress["deleted"], self.bucket,
+                    progress["deleted"] / elapsed)
+
+        pool = ThreadPool(workers)
+        try:
+            pending = []
+            paginator = client.get_paginator("list_object_versions")
+            for page in paginator.paginate(**args):
+                keys = [
+                    {"Key": version["Key"], "VersionId": version["VersionId"]}
+                    for version in
+                    page.get("Versions", []) + page.get("DeleteMarkers", [])
+                ]
+                for i in range(0, len(keys), S3_DELETE_BATCH):
+                    slots.acquire()
+                    pending.append(pool.apply_async(
+                        delete, (keys[i:i + S3_DELETE_BATCH],)))
+            for result in pending:
+                # get(timeout) keeps the wait interruptible (Ctrl-C)
+                result.get(sys.maxint)
+        finally:
+            pool.close()
+
+        print "DELETED {} objects from s3://{} in {:.1f}s".format(
+            progress["deleted"], self.bucket, time.time() - start)
+        if len(progress["errors"]) > 0:
+            for error in progress["errors"][:10]:
+                print "ERROR deleting s3://{}/{}: {}".format(
+                    self.bucket, error.get("Key"), error.get("Message"))
+            raise DeleteException("{} objects could not be deleted from s3://{}".format(
+                progress["failed"], self.bucket))
+        return progress["deleted"]
 
     def create_key(self):
         # check key
@@ -215,26 +988,75 @@ class AwsBackend(object):
         print "DELETE keypair {}".format(self.base.full_cell)
         self.ec2.delete_key_pair(KeyName=self.base.full_cell)
 
-    def upload(self, path, key, extra_args={}):
+    def upload(self, path, key, extra_args=None):
         """
         Uploads a file to S3
             - either to a subdirectory - appends the file name
               afile -> /subdir/afile
             - or directly to another file (a -> /subdir/b)
               afile -> /subdir/bfile
+        The upload is skipped when the object already has the same content
+        (MD5) and was uploaded with the same extra args
         Arguments:
             path - full local file path
             key - key to upload to s3,
             extra_args - extra args passed through to the boto3 s3.upload_file method
         """
+        from botocore.exceptions import ClientError
         if key.endswith("/"):
             key += os.path.basename(path)
         if key.startswith("/"):
             key = key[1:]
         remote_path = self.base.full_cell + "/" + key
-        self.s3.meta.client.upload_file(path, self.bucket, remote_path, ExtraArgs=extra_args)
+        client = self.s3.meta.client
+        md5 = file_md5(path)
+        extra_args = dict(extra_args or {})
+        args_md5 = hashlib.md5(json.dumps(extra_args, sort_keys=True)).hexdigest()
+        try:
+            head = client.head_object(Bucket=self.bucket, Key=remote_path)
+            metadata = head.get("Metadata", {})
+            # multipart uploads don't have the MD5 as ETag, hence the metadata
+            if md5 in [metadata.get("md5"), head.get("ETag", "").strip('"')] \
+                    and metadata.get("upload-args") == args_md5:
+                print "SKIP {} (unchanged in s3://{}/{})".format(
+                    path, self.bucket, remote_path)
+                return
+        except ClientError as e:
+            # missing object (or no permission to HEAD it), upload
+            if e.response.get("Error", {}).get("Code") not in \
+                    ["404", "403", "NoSuchKey"]:
+                raise
+        extra_args["Metadata"] = dict(extra_args.get("Metadata", {}), md5=md5)
+        extra_args["Metadata"]["upload-args"] = args_md5
+        client.upload_file(path, self.bucket, remote_path,
+                           ExtraArgs=extra_args, Config=self.transfer_config)
         print "UPLOADED {} to s3://{}/{}".format(path, self.bucket, remote_path)
 
+    def upload_all(self, uploads):
+        """
+        Uploads files to S3 concurrently
+        Arguments:
+            uploads - list of (path, key[, extra_args]) tuples, see upload()
+        """
+        errors = [
+            error for (_, _, error) in parallel(
+                dict(((upload[0], upload[1]),
+                      functools.partial(self.upload, *upload))
+                     for upload in uploads))
+            if error is not None
+        ]
+        if len(errors) > 0:
+            raise errors[0]
+
+    @property
+    def transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(
+            multipart_threshold=16 * MB,
+            multipart_chunksize=8 * MB,
+            max_concurrency=10
+        )
+
     def bastion(self):
         role = 'bastion' if self.version() > "1.2.0" else 'stateless-body'
         result = self.instances(role=role, format="PublicIpAddress,Tags")
@@ -252,7 +1074,88 @@ class AwsBackend(object):
         result = self.instances(role='stateless-body', format="PrivateIpAddress")
         return result[0][0] if result else None
 
-    def instances(self, role=None, format="PublicIpAddress, PrivateIpAddress, InstanceId, ImageId, State.Name"):
+    def proxies(self):
+        """
+        The running nodes that can act as SOCKS proxies (see proxy())
+        :return: list of IPs
+        """
+        return [ip for (ip, state) in self.iter_instances(
+            role='stateless-body', format="PrivateIpAddress, State.Name")
+            if state == "running"]
+
+    def refresh(self):
+        """
+        Reloads the cell stack metadata and the inventory into the cache
+        ahead of their expiry, so they are never served cold (`cell agent`)
+        """
+        snapshot = self.__describe_stack()
+        self.cache.put("stack", snapshot)
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+        if snapshot:
+            records = {}
+            for role, record in self.__describe_inventory():
+                records.setdefault(role, []).append(record)
+            self.cache.put("inventory", records)
+
+    def invalidate_cache(self):
+        self.cache.invalidate()
+        self.catalog_cache.invalidate()
+        with self._snapshot_lock:
+            self._snapshot = None
+
+    def instances(self, role=None, format=DEFAULT_INSTANCE_FORMAT):
+        return list(self.iter_instances(role, format=format))
+
+    def iter_instances(self, role=None, format=DEFAULT_INSTANCE_FORMAT):
+        """
+        Streams the [format] rows of the cell instances, optionally only
+        those of a role (see iter_inventory)
+        """
+        for instance_role, row in self.iter_inventory(format=format):
+            if not role or instance_role == role:
+                yield row
+
+    def inventory(self, format=DEFAULT_INSTANCE_FORMAT):
+        """
+        All cell instances, fetched with a single (paginated) call and
+        partitioned by their role tag
+        :param format: JMESPath multiselect of the instance attributes to return
+        :return: dict of role -> list of [format] rows
+        """
+        inventory = {}
+        for role, row in self.iter_inventory(format=format):
+            inventory.setdefault(role, []).append(row)
+        return inventory
+
+    def iter_inventory(self, format=DEFAULT_INSTANCE_FORMAT):
+        """
+        Streams the cell instances as (role, [format] row) pairs, as the
+        describe_instances pages arrive, or from the inventory cache.
+        The records are cached once the last page has been consumed, unless
+        there are more than INVENTORY_CACHE_MAX_INSTANCES of them.
+        :param format: JMESPath multiselect of the instance attributes to return
+        """
+        expression = jmespath.compile("[{}]".format(format))
+        records = self.cache.lookup("inventory")
+        if records is not None:
+            for role, rows in records.items():
+                for record in rows:
+                    yield role, expression.search(record)
+            return
+        records = {}
+        count = 0
+        for role, record in self.__describe_inventory():
+            count += 1
+            if count > INVENTORY_CACHE_MAX_INSTANCES:
+                records = None
+            elif records is not None:
+                records.setdefault(role, []).append(record)
+            yield role, expression.search(record)
+        if records is not None:
+            self.cache.put("inventory", records)
+
+    def __describe_inventory(self):
         filters = [
             {
                 'Name': 'tag:cell',
@@ -263,25 +1166,18 @@ class AwsBackend(object):
                 'Values': ['*ing'],
             },
         ]
-        if role:
-            filters.append(
-                {
-                    'Name': 'tag:role',
-                    'Values': [role],
-                }
-            )
-        tmp = jmespath.search(
-            "Reservations[*].Instances[*][].[{}]".format(format),
-            self.ec2.describe_instances(
-                Filters=filters
-            )
-        )
-        return tmp
+        paginator = self.ec2.get_paginator("describe_instances")
+        role_tag = jmespath.compile("Tags[?Key=='role'].Value | [0]")
+        for record in paginator.paginate(Filters=filters).search(
+                "Reservations[*].Instances[*][].{}".format(INSTANCE_RECORD)):
+            yield role_tag.search(record), record
 
     def stack_action(self, action="create"):
         self.build_stack_files()
-        self.upload(self.base.tmp_dir + "/elastic-cell.json", "/")
-        self.upload(self.base.tmp_dir + "/elastic-cell-scaling-group.json", "/")
+        self.upload_all([
+            (self.base.tmp_dir + "/elastic-cell.json", "/"),
+            (self.base.tmp_dir + "/elastic-cell-scaling-group.json", "/"),
+        ])
         parameters = [
                 {
                     'ParameterKey': 'CellName',
@@ -398,14 +1294,70 @@ class AwsBackend(object):
         self.delete_bucket()
 
     def get_role_capacity(self, role):
-        (group, current_capacity) = jmespath.search(
-            "AutoScalingGroups[? (Tags[? Key=='role' && Value=='{}'] && Tags[?Key=='cell' && Value=='{}'])].[AutoScalingGroupName, DesiredCapacity]".format(
-                role,
-                self.base.cell
-            ),
-            self.asg.describe_auto_scaling_groups()
-        )[0]
-        return group, current_capacity
+        return self.get_role_capacities([role])[role]
+
+    def get_role_capacities(self, roles):
+        """
+        :return: dict of role -> (auto scaling group, desired capacity), all
+            the groups being described with a single call
+        """
+        capacities = {}
+        for refresh in [False, True]:
+            groups = self.scaling_groups(refresh=refresh)
+            names = [groups[role] for role in roles if role in groups]
+            found = {}
+            if len(names) > 0:
+                found = dict(
+                    (group["AutoScalingGroupName"], group["DesiredCapacity"])
+                    for group in self.asg.describe_auto_scaling_groups(
+                        AutoScalingGroupNames=names
+                    )["AutoScalingGroups"]
+                )
+            capacities = dict(
+                (role, (groups[role], found[groups[role]]))
+                for role in roles if groups.get(role) in found
+            )
+            if len(capacities) == len(roles):
+                return capacities
+        raise Exception("Can't find the {} auto scaling group of {}".format(
+            ", ".join(role for role in roles if role not in capacities),
+            self.base.cell))
+
+    def scaling_groups(self, refresh=False):
+        """
+        The cell auto scaling groups, resolved through their cell / role tags.
+        They are kept in the inventory cache under the cell StackId, so a
+        recreated cell resolves them again.
+        :param refresh: resolve the groups again, ignoring the cached ones
+        :return: dict of role -> auto scaling group name
+        """
+        snapshot = self.stack_snapshot()
+        if snapshot is None:
+            raise Exception("Can't find the {} cell stack".format(self.base.cell))
+        key = "scaling_groups:{}".format(snapshot["StackId"])
+        groups = None if refresh else self.cache.lookup(key)
+        if groups is None:
+            groups = self.__describe_scaling_groups()
+            self.cache.put(key, groups)
+        return groups
+
+    def __describe_scaling_groups(self):
+        # describe_tags filters on the tags themselves, so only the cell
+        # groups are listed, not every group in the account
+        paginator = self.asg.get_paginator("describe_tags")
+        names = sorted(set(paginator.paginate(Filters=[
+            {'Name': 'key', 'Values': ['cell']},
+            {'Name': 'value', 'Values': [self.base.cell]},
+        ]).search("Tags[].ResourceId")))
+        if len(names) == 0:
+            return {}
+        return dict(
+            (tag["Value"], tag["ResourceId"])
+            for tag in paginator.paginate(Filters=[
+                {'Name': 'auto-scaling-group', 'Values': names},
+                {'Name': 'key', 'Values': ['role']},
+            ]).search("Tags[]")
+        )
 
     def scale(self, role, group_id, capacity):
         self.asg.update_auto_scaling_group(
@@ -413,20 +1365,97 @@ class AwsBackend(object):
             DesiredCapacity=capacity
         )
 
-    def get_infra_log(self, max_items=30):
+    def scale_all(self, targets):
         """
-        Return stack events as recorded in cloudformation
-        Return:  list of (timestamp, logical-resource-idm resource-status) tuples
+        Applies several capacity changes concurrently
+        :param targets: list of (role, group, capacity)
+        :return: dict of role -> error, for the changes that failed
         """
-        events = []
-        paginator = self.cfn.meta.client.get_paginator("describe_stack_events")
-        status = paginator.paginate(StackName=self.stack,
-                                    PaginationConfig={
-                                        'MaxItems': max_items
-                                    })
-        for event in status.search("StackEvents[*].[Timestamp, LogicalResourceId, ResourceStatus]"):
-            events.append([str(e) for e in event])
-        return events
+        return dict(
+            (role, error) for role, _, error in parallel(
+                dict((role, functools.partial(self.scale, role, group, capacity))
+                     for role, group, capacity in targets),
+                timeout=self.lookup_timeout
+            ) if error is not None
+        )
+
+    def scale_waiter(self, role, group, capacity):
+        """
+        To be created before the scaling, see ScaleWaiter
+        """
+        return ScaleWaiter(self, role, group, capacity)
+
+    def provisioning_status(self, instance_id):
+        """
+        The provisioning status an instance reports to
+        <bucket>/<full cell>/shared/status/<instance id>
+        (see deploy/machine/bin/report_status)
+        :return: list of [subject, action, timestamp] lines, None until the
+            instance reports
+        """
+        from botocore.exceptions import ClientError
+        try:
+            body = self.s3.meta.client.get_object(
+                Bucket=self.bucket,
+                Key="{}/shared/status/{}".format(self.base.full_cell, instance_id)
+            )["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ["NoSuchKey", "404"]:
+                return None
+            raise
+        return [line.split() for line in body.splitlines() if line.strip()]
+
+    def infra_log_tailer(self):
+        """
+        :return: a StackEventTailer following the cell stack and its
+            nested (Bastion, Nucleus, Membrane, ...) stacks
+        """
+        return StackEventTailer(self.cfn.meta.client, self.stack,
+                                timeout=self.lookup_timeout)
+
+    def stack_waiter(self, skip_existing=True):
+        """
+        :param skip_existing: ignore the events of previous stack operations
+        :return: a StackEventTailer following the cell stack by its id, so
+            it keeps working after the stack got deleted
+        """
+        client = self.cfn.meta.client
+        stack_id = client.describe_stacks(
+            StackName=self.stack)["Stacks"][0]["StackId"]
+        tailer = StackEventTailer(client, stack_id,
+                                  timeout=self.lookup_timeout)
+        if skip_existing:
+            tailer.skip_existing()
+        return tailer
+
+    @staticmethod
+    def transient_error(error):
+        """
+        :return: True when an API call that failed with `error` is worth
+            retrying: throttling, server side or connection errors and
+            lookup timeouts
+        """
+        from botocore.exceptions import ClientError, ConnectionError, \
+            EndpointConnectionError, ConnectionClosedError
+        if isinstance(error, ClientError):
+            return error.response.get("Error", {}).get("Code") in \
+                TRANSIENT_ERROR_CODES
+        return isinstance(error, (ConnectionError, EndpointConnectionError,
+                                  ConnectionClosedError, LookupTimeout))
+
+    @staticmethod
+    def format_infra_event(event):
+        """
+        :return: (timestamp, stack, logical-resource-id, resource-status,
+            reason) list for a stack event
+        """
+        return [
+            str(event["Timestamp"]),
+            event["StackName"],
+            event["LogicalResourceId"],
+            event["ResourceStatus"],
+            event.get("ResourceStatusReason", ""),
+        ]
 
     def nat_egress_ip(self):
         """
@@ -434,18 +1463,25 @@ class AwsBackend(object):
         Useful for whitelisting
         :return: the IP as string
         """
-        vpc_id = self.__get_vpc_id()
-        filters = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
-        gateways = self.ec2.describe_nat_gateways(Filters=filters)
-        ip = jmespath.search("NatGateways[0].NatGatewayAddresses[0].PublicIp",
-                             gateways)
-        return ip
+        def load():
+            vpc_id = self.__get_vpc_id()
+            filters = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
+            gateways = self.ec2.describe_nat_gateways(Filters=filters)
+            return jmespath.search(
+                "NatGateways[0].NatGatewayAddresses[0].PublicIp", gateways)
+        return self.cache.get("nat_egress_ip", load)
 
     def __get_vpc_id(self):
-        # TODO cache
-        filters = [{ 'Name': 'tag:name', 'Values': [self.base.cell]}]
-        vpcs = self.ec2.describe_vpcs(Filters=filters)
-        return jmespath.search("Vpcs[0].VpcId", vpcs)
+        snapshot = self.stack_snapshot()
+        if snapshot is not None and snapshot["VpcId"]:
+            return snapshot["VpcId"]
+
+        # stacks created before the VpcIdOutput output
+        def load():
+            filters = [{'Name': 'tag:name', 'Values': [self.base.cell]}]
+            vpcs = self.ec2.describe_vpcs(Filters=filters)
+            return jmespath.search("Vpcs[0].VpcId", vpcs)
+        return self.cache.get("vpc_id", load)
 
 
     def version(self):
@@ -453,44 +1489,108 @@ class AwsBackend(object):
         Method may make calls over network
         :return: CellOS version string
         """
-        # TODO (clehene) this can be cached
-        all_stacks = self.list_all()
-        this_stack = filter(lambda x: x[0] == self.base.cell, all_stacks)
-        if len(this_stack) == 1:
-            return this_stack[0][3]
-        else:
-            raise RuntimeError("Expecting 1 stack. Got: {} ".format(this_stack))
+        snapshot = self.stack_snapshot()
+        if snapshot is None:
+            raise RuntimeError("Stack {} does not exist".format(self.stack))
+        return snapshot["version"]
 
     def list_all(self):
-        stacks = [stack for stack in jmespath.search(
-            "Stacks["
-            "? (Tags[? Key=='name'] && Tags[? Key=='version'] )"
-            "][ StackId, StackName, StackStatus, Tags[? Key=='version'].Value | [0], CreationTime]",
-            self.cfn.meta.client.describe_stacks()
-        ) if not re.match(r".*(MembraneStack|NucleusStack|StatefulBodyStack|"
-                          r"StatelessBodyStack|BastionStack).*", stack[0])]
+        return self.catalog_cache.get(self.region, self.__describe_stacks)
+
+    def for_region(self, region):
+        """
+        :return: a backend for another region, with its own session and no
+            inventory cache
+        """
+        backend = self.__class__(self.config, self.base, region=region)
+        backend.cache = InventoryCache(None, 0, enabled=False)
+        backend.catalog_cache = self.catalog_cache
+        backend.tracer = self.tracer
+        return backend
+
+    def list_all_regions(self):
+        """
+        Lists the cells of several regions concurrently
+        :return: generator of (region, stacks, error) tuples, in completion
+            order. Slow regions are reported with a LookupTimeout error
+        """
+        regions = self.regions
+        if regions is None:
+            regions = sorted(jmespath.search(
+                "Regions[*].RegionName", self.ec2.describe_regions()))
+        return parallel(
+            dict((region, self.for_region(region).list_all)
+                 for region in regions),
+            timeout=self.lookup_timeout,
+            max_workers=16
+        )
+
+    def __describe_stacks(self):
+        """
+        Lists the stack summaries (deleted stacks are filtered out server
+        side), keeps the top level stacks of cell templates and describes
+        only those, concurrently, for their tags
+        """
+        client = self.cfn.meta.client
+        stack_ids = [
+            summary["StackId"]
+            for summary in client.get_paginator("list_stacks").paginate(
+                StackStatusFilter=LISTED_STACK_STATUSES
+            ).search("StackSummaries[]")
+            if CELL_TEMPLATE_DESCRIPTION in summary.get("TemplateDescription", "")
+            and not NESTED_STACK.match(summary["StackName"])
+        ]
+        described = {}
+        for stack_id, result, error in parallel(
+                dict((stack_id, functools.partial(client.describe_stacks,
+                                                  StackName=stack_id))
+                     for stack_id in stack_ids),
+                timeout=self.lookup_timeout,
+                max_workers=16):
+            if error is not None:
+                # deleted since it was listed
+                if "does not exist" in str(error):
+                    continue
+                raise error
+            described[stack_id] = result["Stacks"][0]
+        stacks = jmespath.search(
+            "[? (Tags[? Key=='name'] && Tags[? Key=='version'] )]"
+            "[ StackId, StackName, StackStatus, Tags[? Key=='version'].Value | [0], CreationTime]",
+            [described[stack_id] for stack_id in stack_ids
+             if stack_id in described]
+        )
         # extract region from stack id arn:aws:cloudformation:us-west-1:482993447592:stack/c1/1af7..
         stacks = [[stack[1], stack[0].split(":")[3]] + stack[2:] for stack in stacks]
         return stacks
 
+    def load_balancers(self):
+        def load():
+            elbs = jmespath.search(
+                "LoadBalancerDescriptions[*].[LoadBalancerName, DNSName]"
+                "|[? contains([0], `{}-`) == `true`]".format(self.base.cell),
+                self.elb.describe_load_balancers()
+            )
+            # filter ELBs for only this cell (e.g.  c1-mesos and not c1-1-mesos )
+            expression = self.base.cell + "[-lb]*-(marathon|gateway|mesos|zookeeper)"
+            regexp = re.compile(expression)
+            return filter(lambda name: regexp.match(name[0]), elbs)
+        return self.cache.get("load_balancers", load)
+
     def list_one(self, cell):
+        """
+        The cell details. The instances, egress IP and load balancers
+        lookups are independent and run concurrently; `lookups` yields
+        (name, result, error) tuples as each of them completes. The
+        instances result is the list of (role, row) pairs of iter_inventory,
+        all its pages are read by the lookup, within the lookup timeout
+        """
         out = type("", (), {})()
-        out.instances = type("", (), {})()
-        out.instances.nucleus = self.instances("nucleus")
-        out.instances.stateless = self.instances("stateless-body")
-        out.instances.stateful = self.instances("stateful-body")
-        out.instances.membrane = self.instances("membrane")
         out.statuspage = self.statuspage
-
-        elbs = jmespath.search(
-            "LoadBalancerDescriptions[*].[LoadBalancerName, DNSName]"
-            "|[? contains([0], `{}-`) == `true`]".format(self.base.cell),
-            self.elb.describe_load_balancers()
-        )
-        # filter ELBs for only this cell (e.g.  c1-mesos and not c1-1-mesos )
-        expression = self.base.cell + "[-lb]*-(marathon|gateway|mesos|zookeeper)"
-        regexp = re.compile(expression)
-        out.load_balancers = filter(lambda name: regexp.match(name[0]), elbs)
+        out.lookups = parallel({
+            "instances": lambda: list(self.iter_inventory()),
+            "egress_ip": self.nat_egress_ip,
+            "load_balancers": self.load_balancers,
+        }, timeout=self.lookup_timeout)
         out.gateway = type("", (), {})()
         out.gateway.zookeeper = self.gateway("zookeeper")
         out.gateway.mesos = self.gateway("mesos")
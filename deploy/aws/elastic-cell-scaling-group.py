@@ -58,202 +58,207 @@ def make_multi_part_user_data(cloud_config, user_data):
     tmp = str(combined_message)
     return make_user_data(tmp)
 
-t = Template()
+def build_template():
+    """
+    Builds the template of the cell body sub-stacks (one per role)
+    :return: the troposphere Template
+    """
+    t = Template()
 
-t.add_version("2010-09-09")
+    t.add_version("2010-09-09")
 
-t.add_description("""\
+    t.add_description("""\
 cell-os-base - https://git.corp.adobe.com/metal-cell/cell-os""")
-instance_type = t.add_parameter(Parameter(
-    "InstanceType",
-    ConstraintDescription="must be a valid, HVM-compatible EC2 instance type.",
-    Type="String",
-    Description="EC2 instance type",
-))
-
-cell_name = t.add_parameter(Parameter(
-    "CellName",
-    Type="String",
-    Description="The name of this cell (e.g. cell-1). This will get prefixed with account id and region to get the full cell id.",
-))
-
-bucket_name = t.add_parameter(Parameter(
-    "BucketName",
-    Type="String",
-    Description="Cell's S3 bucket name. Used for metadata and backups. Can be one per account as we prefix data with cell name inside",
-))
-
-Repository = t.add_parameter(Parameter(
-    "Repository",
-    Type="String",
-    Description="Location of Cell-OS related artifacts",
-))
-
-cell_os_version_bundle = t.add_parameter(Parameter(
-    "CellOsVersionBundle",
-    Type="String",
-    Description="cell-os bundle version",
-))
-
-key_name = t.add_parameter(Parameter(
-    "KeyName",
-    Type="AWS::EC2::KeyPair::KeyName",
-    Description="Existing EC2 KeyPair to be associated with all cluster instances for SSH access. The default user is 'centos'",
-))
-
-group_size = t.add_parameter(Parameter(
-    "GroupSize",
-    Type="Number",
-    Description="Number of nodes in the scaling group",
-))
-
-
-load_balancer_names = t.add_parameter(Parameter(
-    "LoadBalancerNames",
-    Type="CommaDelimitedList",
-    Description="List of ELBs that ",
-))
-
-zookeeper_load_balancer = t.add_parameter(Parameter(
-    "ZookeeperElb",
-    Type="String",
-    Description="ZK ELB Endpoint",
-))
-
-marathon_load_balancer = t.add_parameter(Parameter(
-    "MarathonElb",
-    Type="String",
-    Description="Marathon ELB Endpoint",
-))
-
-mesos_load_balancer = t.add_parameter(Parameter(
-    "MesosElb",
-    Type="String",
-    Description="Mesos ELB Endpoint",
-))
-
-gateway_load_balancer = t.add_parameter(Parameter(
-    "GatewayElb",
-    Type="String",
-    Description="Gateway ELB Endpoint",
-))
-
-internal_gateway_load_balancer = t.add_parameter(Parameter(
-    "InternalGatewayElb",
-    Type="String",
-    Description="Internal Gateway ELB Endpoint",
-))
-
-subnet = t.add_parameter(Parameter(
-    "Subnet",
-    Type="AWS::EC2::Subnet::Id",
-    Description="Subnet",
-))
-
-tags = t.add_parameter(Parameter(
-    "Tags",
-    Type="CommaDelimitedList",
-    Description="Comma separated list of tags",
-))
-
-image_id = t.add_parameter(Parameter(
-    "ImageId",
-    Type="AWS::EC2::Image::Id",
-    Description="AMI ID",
-))
-
-security_groups = t.add_parameter(Parameter(
-    "SecurityGroups",
-    Type="List<AWS::EC2::SecurityGroup::Id>",
-    Description="AMI ID",
-))
-
-iam_instance_profile = t.add_parameter(Parameter(
-    "IamInstanceProfile",
-    Default="",
-    Type="String",
-    Description="IAM Profile if any",
-))
-
-role = t.add_parameter(Parameter(
-    "Role",
-    Type="String",
-    Description="The role of the autoscaling group (stateless-body, membrane, etc.)",
-))
-
-parent_stack_name = t.add_parameter(Parameter(
-    "ParentStackName",
-    Type="String",
-    Description="",
-))
-
-wait_handle = t.add_parameter(Parameter(
-    "WaitHandle",
-    Type="String",
-    Description="",
-))
-
-associate_public_ip_address = t.add_parameter(Parameter(
-    "AssociatePublicIpAddress",
-    Default="false",
-    Type="String",
-    Description="AMI ID",
-    AllowedValues=["true", "false"],
-))
-
-cell_modules = t.add_parameter(Parameter(
-    "CellModules",
-    Type="String",
-    Description="Comma separated list of modules",
-))
-
-saasbase_access_key_id = t.add_parameter(Parameter(
-    "SaasBaseAccessKeyId",
-    Type="String",
-    Description="SaasBase S3 repo read-only AWS account Access Key ID (http://saasbase.corp.adobe.com/ops/operations/deployment.html)",
-))
-
-saasbase_secret_access_key = t.add_parameter(Parameter(
-    "SaasBaseSecretAccessKey",
-    Type="String",
-    Description="SaasBase S3 repo read-only AWS account Secret Access Key (http://saasbase.corp.adobe.com/ops/operations/deployment.html)",
-))
-
-t.add_condition(
-    "HasIamInstanceProfile", Not(Equals(Ref(iam_instance_profile), ""))
-)
-t.add_condition(
-    "HasLbs", Not(Equals(Join("", Ref(load_balancer_names)), ""))
-)
-
-body = t.add_resource(asn.AutoScalingGroup(
-    "Body",
-    DesiredCapacity=Ref(group_size),
-    Tags=asn.Tags(
-        role=Ref(role),
-        cell=Ref(cell_name),
-    ),
-    LaunchConfigurationName=Ref("BodyLaunchConfig"),
-    MinSize="0",
-    MaxSize="1000",
-    VPCZoneIdentifier=[Ref(subnet)],
-    LoadBalancerNames=If("HasLbs", Ref(load_balancer_names), []),
-    TerminationPolicies=["NewestInstance", "ClosestToNextInstanceHour"]
-))
-
-ROOT_DEVICE_SIZE = 200
-root_block_device_mapping = [
-    ec2.BlockDeviceMapping(
-        DeviceName='/dev/sda1',
-        Ebs=ec2.EBSBlockDevice(
-            DeleteOnTermination=True,
-            VolumeType='gp2',
-            VolumeSize=ROOT_DEVICE_SIZE
-        )
+    instance_type = t.add_parameter(Parameter(
+        "InstanceType",
+        ConstraintDescription="must be a valid, HVM-compatible EC2 instance type.",
+        Type="String",
+        Description="EC2 instance type",
+    ))
+
+    cell_name = t.add_parameter(Parameter(
+        "CellName",
+        Type="String",
+        Description="The name of this cell (e.g. cell-1). This will get prefixed with account id and region to get the full cell id.",
+    ))
+
+    bucket_name = t.add_parameter(Parameter(
+        "BucketName",
+        Type="String",
+        Description="Cell's S3 bucket name. Used for metadata and backups. Can be one per account as we prefix data with cell name inside",
+    ))
+
+    Repository = t.add_parameter(Parameter(
+        "Repository",
+        Type="String",
+        Description="Location of Cell-OS related artifacts",
+    ))
+
+    cell_os_version_bundle = t.add_parameter(Parameter(
+        "CellOsVersionBundle",
+        Type="String",
+        Description="cell-os bundle version",
+    ))
+
+    key_name = t.add_parameter(Parameter(
+        "KeyName",
+        Type="AWS::EC2::KeyPair::KeyName",
+        Description="Existing EC2 KeyPair to be associated with all cluster instances for SSH access. The default user is 'centos'",
+    ))
+
+    group_size = t.add_parameter(Parameter(
+        "GroupSize",
+        Type="Number",
+        Description="Number of nodes in the scaling group",
+    ))
+
+
+    load_balancer_names = t.add_parameter(Parameter(
+        "LoadBalancerNames",
+        Type="CommaDelimitedList",
+        Description="List of ELBs that ",
+    ))
+
+    zookeeper_load_balancer = t.add_parameter(Parameter(
+        "ZookeeperElb",
+        Type="String",
+        Description="ZK ELB Endpoint",
+    ))
+
+    marathon_load_balancer = t.add_parameter(Parameter(
+        "MarathonElb",
+        Type="String",
+        Description="Marathon ELB Endpoint",
+    ))
+
+    mesos_load_balancer = t.add_parameter(Parameter(
+        "MesosElb",
+        Type="String",
+        Description="Mesos ELB Endpoint",
+    ))
+
+    gateway_load_balancer = t.add_parameter(Parameter(
+        "GatewayElb",
+        Type="String",
+        Description="Gateway ELB Endpoint",
+    ))
+
+    internal_gateway_load_balancer = t.add_parameter(Parameter(
+        "InternalGatewayElb",
+        Type="String",
+        Description="Internal Gateway ELB Endpoint",
+    ))
+
+    subnet = t.add_parameter(Parameter(
+        "Subnet",
+        Type="AWS::EC2::Subnet::Id",
+        Description="Subnet",
+    ))
+
+    tags = t.add_parameter(Parameter(
+        "Tags",
+        Type="CommaDelimitedList",
+        Description="Comma separated list of tags",
+    ))
+
+    image_id = t.add_parameter(Parameter(
+        "ImageId",
+        Type="AWS::EC2::Image::Id",
+        Description="AMI ID",
+    ))
+
+    security_groups = t.add_parameter(Parameter(
+        "SecurityGroups",
+        Type="List<AWS::EC2::SecurityGroup::Id>",
+        Description="AMI ID",
+    ))
+
+    iam_instance_profile = t.add_parameter(Parameter(
+        "IamInstanceProfile",
+        Default="",
+        Type="String",
+        Description="IAM Profile if any",
+    ))
+
+    role = t.add_parameter(Parameter(
+        "Role",
+        Type="String",
+        Description="The role of the autoscaling group (stateless-body, membrane, etc.)",
+    ))
+
+    parent_stack_name = t.add_parameter(Parameter(
+        "ParentStackName",
+        Type="String",
+        Description="",
+    ))
+
+    wait_handle = t.add_parameter(Parameter(
+        "WaitHandle",
+        Type="String",
+        Description="",
+    ))
+
+    associate_public_ip_address = t.add_parameter(Parameter(
+        "AssociatePublicIpAddress",
+        Default="false",
+        Type="String",
+        Description="AMI ID",
+        AllowedValues=["true", "false"],
+    ))
+
+    cell_modules = t.add_parameter(Parameter(
+        "CellModules",
+        Type="String",
+        Description="Comma separated list of modules",
+    ))
+
+    saasbase_access_key_id = t.add_parameter(Parameter(
+        "SaasBaseAccessKeyId",
+        Type="String",
+        Description="SaasBase S3 repo read-only AWS account Access Key ID (http://saasbase.corp.adobe.com/ops/operations/deployment.html)",
+    ))
+
+    saasbase_secret_access_key = t.add_parameter(Parameter(
+        "SaasBaseSecretAccessKey",
+        Type="String",
+        Description="SaasBase S3 repo read-only AWS account Secret Access Key (http://saasbase.corp.adobe.com/ops/operations/deployment.html)",
+    ))
+
+    t.add_condition(
+        "HasIamInstanceProfile", Not(Equals(Ref(iam_instance_profile), ""))
     )
-]
+    t.add_condition(
+        "HasLbs", Not(Equals(Join("", Ref(load_balancer_names)), ""))
+    )
+
+    body = t.add_resource(asn.AutoScalingGroup(
+        "Body",
+        DesiredCapacity=Ref(group_size),
+        Tags=asn.Tags(
+            role=Ref(role),
+            cell=Ref(cell_name),
+        ),
+        LaunchConfigurationName=Ref("BodyLaunchConfig"),
+        MinSize="0",
+        MaxSize="1000",
+        VPCZoneIdentifier=[Ref(subnet)],
+        LoadBalancerNames=If("HasLbs", Ref(load_balancer_names), []),
+        TerminationPolicies=["NewestInstance", "ClosestToNextInstanceHour"]
+    ))
+
+    ROOT_DEVICE_SIZE = 200
+    root_block_device_mapping = [
+        ec2.BlockDeviceMapping(
+            DeviceName='/dev/sda1',
+            Ebs=ec2.EBSBlockDevice(
+                DeleteOnTermination=True,
+                VolumeType='gp2',
+                VolumeSize=ROOT_DEVICE_SIZE
+            )
+        )
+    ]
 
-user_data = """#!/bin/bash
+    user_data = """#!/bin/bash
 curl https://bootstrap.pypa.io/get-pip.py -o get-pip.py
 python get-pip.py
 pip install "pip==8.1.0"
@@ -284,13 +289,13 @@ chmod +x /opt/cell/user-data
 /opt/cell/user-data
 """
 
-BodyLaunchConfig = t.add_resource(asn.LaunchConfiguration(
-    "BodyLaunchConfig",
-    Metadata=cfn.Init({
-        "config": cfn.InitConfig(
-            files=cfn.InitFiles({
-                "/etc/profile.d/cellos.sh": cfn.InitFile(
-                    content=make_content("""\
+    BodyLaunchConfig = t.add_resource(asn.LaunchConfiguration(
+        "BodyLaunchConfig",
+        Metadata=cfn.Init({
+            "config": cfn.InitConfig(
+                files=cfn.InitFiles({
+                    "/etc/profile.d/cellos.sh": cfn.InitFile(
+                        content=make_content("""\
 #!/bin/bash
 export cell_backend="aws"
 export cell_name="{{cell_name}}"
@@ -319,47 +324,56 @@ export aws_access_key_id="{{aws_access_key_id}}"
 export aws_secret_access_key="{{aws_secret_access_key}}"
 export aws_wait_handle="{{aws_wait_handle}}"
 """),
-                    owner="root",
-                    group="root",
-                    mode="000755",
-                    context=cfn.InitFileContext({
-                        "zk_base_url": Join("", ["http://", Ref("ZookeeperElb"), "/exhibitor/v1"]),
-                        "zk_elb": Ref("ZookeeperElb"),
-                        "marathon_elb": Ref("MarathonElb"),
-                        "mesos_elb": Ref("MesosElb"),
-                        "gateway_elb": Ref("GatewayElb"),
-                        "internal_gateway_elb": Ref("InternalGatewayElb"),
-                        "aws_stack_name": Ref("AWS::StackName"),
-                        "aws_parent_stack_name": Ref("ParentStackName"),
-                        "aws_region": Ref("AWS::Region"),
-                        "saasbase_access_key_id": Ref("SaasBaseAccessKeyId"),
-                        "saasbase_secret_access_key": Ref("SaasBaseSecretAccessKey"),
-                        "repository": Ref("Repository"),
-                        "cellos_version": Ref("CellOsVersionBundle"),
-                        "cell_bucket_name": Ref("BucketName"),
-                        "cell_name": Ref("CellName"),
-                        "cell_role": Ref("Role"),
-                        "cell_modules": Ref("CellModules"),
-                        "machine_tags": Ref("Tags"),
-                        "aws_wait_handle": Ref("WaitHandle"),
-                    })
-                ),
-            })
-        )
-    }),
-    ImageId=Ref(image_id),
-    KeyName=Ref(key_name),
-    SecurityGroups=Ref(security_groups),
-    BlockDeviceMappings=root_block_device_mapping + [
-        ec2.BlockDeviceMapping(
-            VirtualName='ephemeral%d' % i,
-            DeviceName='/dev/sd%s' % chr(98 + i)
-        ) for i in range(23)
-    ],
-    IamInstanceProfile=If("HasIamInstanceProfile", Ref(iam_instance_profile), Ref("AWS::NoValue")),
-    AssociatePublicIpAddress=Ref(associate_public_ip_address),
-    InstanceType=Ref(instance_type),
-    UserData=make_multi_part_user_data(None, user_data)
-))
-
-print(t.to_json(indent=2))
+                        owner="root",
+                        group="root",
+                        mode="000755",
+                        context=cfn.InitFileContext({
+                            "zk_base_url": Join("", ["http://", Ref("ZookeeperElb"), "/exhibitor/v1"]),
+                            "zk_elb": Ref("ZookeeperElb"),
+                            "marathon_elb": Ref("MarathonElb"),
+                            "mesos_elb": Ref("MesosElb"),
+                            "gateway_elb": Ref("GatewayElb"),
+                            "internal_gateway_elb": Ref("InternalGatewayElb"),
+                            "aws_stack_name": Ref("AWS::StackName"),
+                            "aws_parent_stack_name": Ref("ParentStackName"),
+                            "aws_region": Ref("AWS::Region"),
+                            "saasbase_access_key_id": Ref("SaasBaseAccessKeyId"),
+                            "saasbase_secret_access_key": Ref("SaasBaseSecretAccessKey"),
+                            "repository": Ref("Repository"),
+                            "cellos_version": Ref("CellOsVersionBundle"),
+                            "cell_bucket_name": Ref("BucketName"),
+                            "cell_name": Ref("CellName"),
+                            "cell_role": Ref("Role"),
+                            "cell_modules": Ref("CellModules"),
+                            "machine_tags": Ref("Tags"),
+                            "aws_wait_handle": Ref("WaitHandle"),
+                        })
+                    ),
+                })
+            )
+        }),
+        ImageId=Ref(image_id),
+        KeyName=Ref(key_name),
+        SecurityGroups=Ref(security_groups),
+        BlockDeviceMappings=root_block_device_mapping + [
+            ec2.BlockDeviceMapping(
+                VirtualName='ephemeral%d' % i,
+                DeviceName='/dev/sd%s' % chr(98 + i)
+            ) for i in range(23)
+        ],
+        IamInstanceProfile=If("HasIamInstanceProfile", Ref(iam_instance_profile), Ref("AWS::NoValue")),
+        AssociatePublicIpAddress=Ref(associate_public_ip_address),
+        InstanceType=Ref(instance_type),
+        UserData=make_multi_part_user_data(None, user_data)
+    ))
+
+    return t
+
+
+def main():
+    print(build_template().to_json(indent=2))
+
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,85 @@
+"""
+Runs the CLI in-process against the local backend (deploy/local/backend.py),
+with an isolated home directory and no-op ssh, tmux, mux, i2cssh, dcos and
+pkill (see benchmarks/commands.py)
+"""
+import StringIO
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, DIR)
+
+import cell
+
+# not imported by name, python 2 has a `commands` module
+commands = imp.load_source("benchmark_commands",
+                           os.path.join(DIR, "benchmarks", "commands.py"))
+
+
+def load_backend(name):
+    """
+    :return: the backend module of deploy/<name>/backend.py
+    """
+    return imp.load_source("{}_backend".format(name),
+                           os.path.join(DIR, "deploy", name, "backend.py"))
+
+
+class LocalCellTestCase(unittest.TestCase):
+    # LOCAL_CELLS of the local backend
+    cells = "test:20"
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix="cell-test-")
+        whitelist = os.path.join(self.home, "net-whitelist.json")
+        bin_dir = commands.setup_home(self.home, whitelist)
+        self.environ = dict(os.environ)
+        for name in ["CELL_BUCKET", "CELL_AGENT_SOCKET", "CACHE_EXPIRY_SECONDS"]:
+            os.environ.pop(name, None)
+        os.environ.update(
+            HOME=self.home,
+            PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+            NET_WHITELIST_URL=whitelist,
+            LOCAL_CELLS=self.cells,
+            AWS_DEFAULT_REGION="us-west-1")
+        cell.setup_dirs()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.home)
+
+    def cell(self, *args):
+        """
+        :return: the Cell of a command line, on the local backend
+        """
+        arguments, _ = cell.docopt_sub_args_hack(
+            ["cell"] + list(args) + ["--backend", "local"], cell.get_version())
+        return cell.Cell(arguments, cell.get_version())
+
+    def run_cell(self, *args, **kwargs):
+        """
+        Runs a command line through cell.main()
+        :param stdin: the input of the command
+        :return: (exit code, stdout, stderr)
+        """
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        saved = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin = StringIO.StringIO(kwargs.get("stdin", ""))
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            cell.main(["cell"] + list(args) + ["--backend", "local"])
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def cache_path(self, cell_name):
+        return os.path.join(self.home, ".cellos", "generated", cell_name,
+                            "inventory.json")
@@ -0,0 +1,95 @@
+"""
+`cell agent` requests: the fingerprint a connection says hello with before
+its lookups are answered, and the datetimes of the answers
+"""
+import datetime
+import os
+import unittest
+
+from dateutil.tz import tzutc
+
+import support
+
+cell = support.cell
+
+
+class FingerprintTest(support.LocalCellTestCase):
+    def test_environment_changes_the_fingerprint(self):
+        fingerprint = cell.agent_fingerprint("1.0")
+        self.assertEqual(fingerprint, cell.agent_fingerprint("1.0"))
+        self.assertNotEqual(fingerprint, cell.agent_fingerprint("1.1"))
+        os.environ["AWS_PROFILE"] = "other"
+        self.assertNotEqual(fingerprint, cell.agent_fingerprint("1.0"))
+        del os.environ["AWS_PROFILE"]
+        os.environ["LOCAL_CELLS"] = "test:5"
+        self.assertNotEqual(fingerprint, cell.agent_fingerprint("1.0"))
+
+    def test_config_changes_the_fingerprint(self):
+        fingerprint = cell.agent_fingerprint("1.0")
+        with open(os.path.join(self.home, ".cellos", "config"), "a") as f:
+            f.write("\n[other]\nregion = eu-west-1\n")
+        self.assertNotEqual(fingerprint, cell.agent_fingerprint("1.0"))
+
+
+class AgentRequestTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def setUp(self):
+        super(AgentRequestTest, self).setUp()
+        self.agent = cell.Agent(os.path.join(self.home, "agent.sock"),
+                                cell.get_version(), 60, 60)
+        self.session = {}
+
+    def request(self, **request):
+        """
+        :return: the response of the agent, through the JSON lines
+        """
+        response = self.agent.handle(
+            cell.agent_loads(cell.agent_dumps(request)), self.session)
+        return cell.agent_loads(cell.agent_dumps(response))
+
+    def hello(self, fingerprint=None):
+        return self.request(op="hello",
+                            fingerprint=fingerprint or self.agent.fingerprint)
+
+    def list_all(self):
+        return self.request(op="call", key=["local", None, None],
+                            method="list_all", args=[], kwargs={})
+
+    def test_call_needs_a_hello(self):
+        self.assertIn("error", self.list_all())
+        self.assertEqual({}, self.agent.backends)
+        self.assertEqual(os.getpid(), self.request(op="ping")["result"])
+
+    def test_call_after_a_wrong_hello(self):
+        self.assertIn("different environment", self.hello("0" * 64)["error"])
+        self.assertIn("error", self.list_all())
+        self.hello()
+        self.assertNotIn("error", self.list_all())
+        # a later mismatch closes the session again
+        self.hello("0" * 64)
+        self.assertIn("error", self.list_all())
+
+    def test_datetimes_are_kept(self):
+        self.assertEqual({"result": os.getpid()}, self.hello())
+        stacks = self.list_all()["result"]
+        self.assertTrue(stacks)
+        # name, region, status, version, creation time
+        for stack in stacks:
+            self.assertIsInstance(stack[-1], datetime.datetime)
+
+    def test_datetime_lines(self):
+        aware = datetime.datetime(2016, 5, 3, 10, 20, 30, 123000, tzinfo=tzutc())
+        naive = datetime.datetime(2016, 5, 3, 10, 20, 30)
+        message = {"result": [{"CreationTime": aware, "LaunchTime": naive,
+                               "StackName": "cell-os--test"}]}
+        line = cell.agent_dumps(message)
+        self.assertTrue(line.endswith("\n"))
+        self.assertEqual(message, cell.agent_loads(line))
+        self.assertIsInstance(cell.agent_loads(line)["result"][0]["StackName"],
+                              str)
+        self.assertRaises(TypeError, cell.agent_dumps, {"result": object()})
+
+
+if __name__ == "__main__":
+    unittest.main()
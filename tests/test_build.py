@@ -0,0 +1,46 @@
+"""
+The stack templates are only regenerated when their inputs change
+"""
+import StringIO
+import os
+import sys
+import unittest
+
+import support
+
+
+class BuildStackFilesTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def build(self):
+        """
+        :return: the output of `cell build test`
+        """
+        c = self.cell("build", "test")
+        stdout = StringIO.StringIO()
+        saved, sys.stdout = sys.stdout, stdout
+        try:
+            c.run_build()
+        finally:
+            sys.stdout = saved
+        self.tmp_dir = c.tmp("")
+        return stdout.getvalue()
+
+    def test_unchanged_templates_are_reused(self):
+        self.assertIn("Building stack", self.build())
+        out = self.build()
+        self.assertIn("Using cached stack", out)
+        self.assertIn("Using cached sub-stack", out)
+
+    def test_changed_digest_rebuilds_the_template(self):
+        self.build()
+        with open(os.path.join(self.tmp_dir, "elastic-cell.json.sha256"), "w") as f:
+            f.write("0" * 64)
+        os.remove(os.path.join(self.tmp_dir, "elastic-cell-scaling-group.json.sha256"))
+        out = self.build()
+        self.assertIn("Building stack", out)
+        self.assertIn("Building sub-stack", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+"""
+Runs the core commands against the local backend (see benchmarks/commands.py)
+and fails when one of them exits with an error, doesn't print what it should,
+or makes more AWS API calls than it used to, with an empty (cold) or
+populated (warm) inventory cache.
+
+    python -m unittest discover -s tests
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import support
+
+commands = support.commands
+
+CELL = "test"
+SIZE = 20
+
+# command, max API calls with a cold cache, with a warm cache, and a line
+# the output must contain (None when the command prints nothing).
+# Lower the ceilings when a change saves calls
+CEILINGS = [
+    (["list"], 2, 0, "CREATE_COMPLETE"),
+    (["list", "--all-regions"], 4, 4, "us-west-1"),
+    (["list", "{cell}"], 4, 0, "Core Services"),
+    (["list", "{cell}", "--output", "ndjson"], 4, 0, '"section": "core_services"'),
+    (["list", "{cell}", "--trace"], 4, 4, "Core Services"),
+    (["build", "{cell}"], 0, 0, "sub-stack"),
+    (["seed", "{cell}"], 9, 9, "seed.tar.gz to s3://"),
+    (["update", "{cell}", "--wait"], 28, 28, "cell-os--{cell} UPDATE_COMPLETE"),
+    (["scale", "{cell}", "stateless-body", "{size}"], 5, 5,
+     "Scaling {cell}.stateless-body"),
+    (["scale", "{cell}", "stateless-body={size}", "membrane=3", "--wait"], 27, 27,
+     "Time to ready"),
+    (["ssh", "{cell}", "nucleus", "1"], 2, 0, None),
+    (["cmd", "{cell}", "nucleus", "1", "uptime"], 2, 0, None),
+    (["cmd", "{cell}", "all", "*", "uptime"], 2, 0, "0 of 19 nodes failed"),
+    (["log", "{cell}", "nucleus", "1"], 2, 0, None),
+    (["i2cssh", "{cell}"], 2, 0, None),
+    (["mux", "{cell}"], 2, 0, "ROLE: nucleus"),
+    (["proxy", "{cell}"], 2, 0, "Proxy running on localhost:1234"),
+    (["dcos", "{cell}", "package", "list"], 2, 0, None),
+    (["disconnect", "{cell}"], 0, 0, None),
+    (["create", "{cell}new", "--wait"], 25, 25, "cell-os--{cell}new CREATE_COMPLETE"),
+    (["delete", "{cell}", "--wait"], 20, 20, "cell-os--{cell} DELETE_COMPLETE"),
+]
+
+
+class CommandsTest(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix="cell-test-")
+        whitelist = os.path.join(self.home, "net-whitelist.json")
+        bin_dir = commands.setup_home(self.home, whitelist)
+        self.env = dict(os.environ,
+                        HOME=self.home,
+                        PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+                        NET_WHITELIST_URL=whitelist,
+                        LOCAL_CELLS="{}:{}".format(CELL, SIZE),
+                        AWS_DEFAULT_REGION="us-west-1")
+        self.env.pop("CELL_BUCKET", None)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def test_exit_codes_and_api_calls(self):
+        failures = []
+        for template, cold_ceiling, warm_ceiling, expected in CEILINGS:
+            args = [arg.format(cell=CELL, size=SIZE) for arg in template]
+            name = " ".join(args)
+            stdin = CELL + "\n" if args[0] == "delete" else ""
+            cache = os.path.join(self.home, ".cellos", "generated",
+                                 CELL, "inventory.json")
+            if os.path.exists(cache):
+                os.remove(cache)
+            for run, ceiling in [("cold", cold_ceiling), ("warm", warm_ceiling)]:
+                result = commands.run_probe(args, self.env, stdin)
+                calls = sum(result["calls"].values())
+                if result["exit"] != 0:
+                    failures.append("{} ({}): exit {}\n{}{}".format(
+                        name, run, result["exit"], result["output"],
+                        result.get("error", "")))
+                elif calls > ceiling:
+                    failures.append("{} ({}): {} API calls, expected <= {}: {}"
+                                    .format(name, run, calls, ceiling,
+                                            result["calls"]))
+                elif expected is not None and \
+                        expected.format(cell=CELL) not in result["output"]:
+                    failures.append("{} ({}): expected {!r} in\n{}".format(
+                        name, run, expected.format(cell=CELL),
+                        result["output"]))
+        self.assertEqual([], failures, "\n".join(failures))
+
+
+class FakeScreen(object):
+    """
+    The curses screen of `cell log <cell-name>`, interrupted (Ctrl-C) on
+    its first refresh
+    """
+    def __init__(self):
+        self.lines = []
+
+    def getmaxyx(self):
+        return 24, 120
+
+    def clear(self):
+        del self.lines[:]
+
+    def addstr(self, line):
+        self.lines.append(line)
+
+    def refresh(self):
+        raise KeyboardInterrupt()
+
+
+class CommandOutputTest(support.LocalCellTestCase):
+    cells = "test:20"
+
+    def record_calls(self, tool):
+        """
+        Replaces the no-op `tool` with one appending its arguments (and
+        DCOS_CONFIG) to <home>/<tool>.calls
+        :return: the path of the calls file
+        """
+        calls = os.path.join(self.home, tool + ".calls")
+        path = os.path.join(self.home, "bin", tool)
+        with open(path, "w") as f:
+            f.write('#!/bin/sh\necho "$DCOS_CONFIG $@" >> {}\n'.format(calls))
+        os.chmod(path, 0o755)
+        return calls
+
+    def test_dcos(self):
+        calls = self.record_calls("dcos")
+        code, _, _ = self.run_cell("dcos", "test", "package", "list", "--json")
+        self.assertEqual(0, code)
+        config = os.path.join(self.home, ".cellos", "generated", "test",
+                              "dcos.toml")
+        with open(calls) as f:
+            self.assertEqual(["{} package list --json".format(config)],
+                             f.read().splitlines())
+        with open(config) as f:
+            self.assertIn('url = "http://marathon.gw.test.metal-cell.adobe.io"',
+                          f.read())
+
+    def test_dcos_exit_code(self):
+        path = os.path.join(self.home, "bin", "dcos")
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\nexit 3\n")
+        self.assertEqual(3, self.run_cell("dcos", "test", "package", "list")[0])
+
+    def test_log_of_the_stack(self):
+        import curses
+        screen = FakeScreen()
+        wrapper = curses.wrapper
+        # a failing lookup would be retried forever, bounded by the join
+        curses.wrapper = lambda draw: draw(screen)
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(self.run_cell("log", "test")))
+        thread.daemon = True
+        try:
+            thread.start()
+            thread.join(30)
+        finally:
+            curses.wrapper = wrapper
+        self.assertEqual([0], [code for (code, _, _) in result])
+        self.assertTrue(screen.lines[0].startswith("Polling every"))
+        self.assertIn("  test  test  CREATE_COMPLETE", "".join(screen.lines))
+
+    def test_trace(self):
+        code, out, err = self.run_cell("list", "test", "--trace")
+        self.assertEqual(0, code)
+        self.assertIn("Core Services", out)
+        trace = os.path.join(self.home, ".cellos", "generated", "test",
+                             "trace.jsonl")
+        self.assertIn("trace written to {}".format(trace), err)
+        self.assertIn("cloudformation.DescribeStacks", err)
+        with open(trace) as f:
+            records = [json.loads(line) for line in f]
+        self.assertIn("DescribeStacks", [record["operation"] for record in records])
+
+    def test_agent(self):
+        agent = subprocess.Popen(
+            [sys.executable, os.path.join(support.DIR, "cell"), "agent",
+             "--backend", "local"], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        socket = os.path.join(self.home, ".cellos", "agent.sock")
+        try:
+            deadline = time.time() + 30
+            while not os.path.exists(socket) and agent.poll() is None \
+                    and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertTrue(os.path.exists(socket))
+
+            code, out, _ = self.run_cell("list", "test")
+            self.assertEqual(0, code)
+            self.assertIn("Core Services", out)
+            # answered by the agent, with no API call of its own
+            backend = sys.modules["backend"]
+            self.assertEqual(0, sum(sum(account.calls.values())
+                                    for account in backend.ACCOUNTS.values()))
+
+            code, out, _ = self.run_cell("agent")
+            self.assertEqual(1, code)
+            self.assertIn("already running on {}".format(socket), out)
+            code, out, _ = self.run_cell("agent", "--stop")
+            self.assertEqual(0, code, out)
+            self.assertIn("Stopped cell agent {}".format(agent.pid), out)
+            agent.wait()
+        finally:
+            if agent.poll() is None:
+                agent.kill()
+        code, out, _ = self.run_cell("agent", "--stop")
+        self.assertEqual(1, code)
+        self.assertIn("No cell agent running on {}".format(socket), out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+`cell dcos package install` options: from the cell-os universe index when the
+universe is the first dcos.toml source, from the dcos-cli otherwise
+"""
+import StringIO
+import json
+import os
+import sys
+import types
+import unittest
+import zipfile
+
+import support
+
+cell = support.cell
+
+KAFKA_CONFIG = {"properties": {"kafka": {"type": "object", "properties": {
+    "zk": {"type": "string", "default": "master.mesos:2181/kafka"},
+}}}}
+
+
+def universe_zip(packages):
+    """
+    :param packages: {package: {revision: config.json}}
+    :return: the content of a universe zip
+    """
+    out = StringIO.StringIO()
+    with zipfile.ZipFile(out, "w") as universe:
+        for package, revisions in packages.items():
+            for revision, config in revisions.items():
+                prefix = "universe/repo/packages/{}/{}/{}/".format(
+                    package[0].upper(), package, revision)
+                universe.writestr(prefix + "package.json",
+                                  json.dumps({"name": package}))
+                universe.writestr(prefix + "config.json", json.dumps(config))
+    return out.getvalue()
+
+
+class FakePackage(object):
+    def latest_package_revision(self):
+        return "7"
+
+    def config_json(self, revision):
+        return {"properties": {"port": {"type": "string", "default": "8080"}}}
+
+
+class PackageInstallTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def setUp(self):
+        super(PackageInstallTest, self).setUp()
+        self.archive = universe_zip({
+            "kafka": {"0": {}, "1": KAFKA_CONFIG},
+        })
+        self.downloads = []
+        self.fetch_url = cell.fetch_url
+        cell.fetch_url = self.fake_fetch_url
+        # dcos-cli isn't installed with the CLI
+        self.resolved = []
+        dcos = types.ModuleType("dcos")
+        dcos.package = types.ModuleType("dcos.package")
+        dcos.package.resolve_package = self.resolve_package
+        sys.modules.update({"dcos": dcos, "dcos.package": dcos.package})
+        self.c = self.cell("dcos", "test")
+        self.call(self.c.ensure_config)
+
+    def tearDown(self):
+        cell.fetch_url = self.fetch_url
+        for name in ["dcos", "dcos.package"]:
+            sys.modules.pop(name)
+        super(PackageInstallTest, self).tearDown()
+
+    def fake_fetch_url(self, url, max_age=0, binary=False):
+        self.downloads.append(url)
+        return self.archive
+
+    def resolve_package(self, package):
+        self.resolved.append(package)
+        return FakePackage()
+
+    def call(self, method, *args):
+        """
+        :return: the result of a Cell method, its output left out
+        """
+        saved, sys.stdout = sys.stdout, StringIO.StringIO()
+        try:
+            return method(*args)
+        finally:
+            sys.stdout = saved
+
+    def install(self, package):
+        """
+        :return: (dcos arguments, options) of a package install
+        """
+        args, options, _ = self.call(self.c.prepare_dcos_package_install,
+                                     ["package", "install", package])
+        return args, options
+
+    def set_sources(self, sources):
+        path = self.c.tmp("dcos.toml")
+        with open(path) as f:
+            content = f.read()
+        with open(path, "w") as f:
+            f.write(content.replace(
+                '"{}"'.format(self.c.cell_universe_url),
+                ",".join('"{}"'.format(source) for source in sources)))
+
+    def test_universe_packages_come_from_the_index(self):
+        args, options = self.install("kafka")
+        self.assertEqual({"kafka": {"zk": "{}/kafka".format(
+            ",".join(ip + ":2181" for ip in cell.iter_flatten(
+                self.c.backend.iter_instances(
+                    "nucleus", format="PrivateIpAddress"))))}}, options)
+        self.assertEqual(["package", "install", "--options={}".format(
+            self.c.tmp("kafka.json")), "kafka"], args)
+        self.assertEqual([self.c.cell_universe_url], self.downloads)
+        self.assertEqual([], self.resolved)
+        # indexed once
+        self.install("kafka")
+        self.assertEqual(1, len(self.downloads))
+
+    def test_other_packages_skip_the_universe_download(self):
+        self.install("kafka")
+        # a SNAPSHOT index due for revalidation
+        index = os.path.join(self.home, ".cellos", "universe")
+        for name in os.listdir(index):
+            os.utime(os.path.join(index, name), (0, 0))
+        _, options = self.install("chronos")
+        self.assertEqual({"port": "8080"}, options)
+        self.assertEqual(["chronos"], self.resolved)
+        self.assertEqual(1, len(self.downloads))
+
+    def test_index_only_stands_for_the_first_source(self):
+        other = "https://universe.example.com/repo.zip"
+        self.set_sources([other, self.c.cell_universe_url])
+        # the order is kept when dcos.toml is regenerated
+        self.call(self.c.ensure_dcos_config)
+        self.assertEqual([other, self.c.cell_universe_url],
+                         self.c.dcos_sources())
+        _, options = self.install("kafka")
+        self.assertEqual({"port": "8080"}, options)
+        self.assertEqual(["kafka"], self.resolved)
+        self.assertEqual([], self.downloads)
+
+    def test_universe_not_configured(self):
+        self.set_sources(["https://universe.example.com/repo.zip"])
+        self.install("kafka")
+        self.assertEqual(["kafka"], self.resolved)
+        self.assertEqual([], self.downloads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+fetch_url: conditional GETs through ~/.cellos/http-cache, and the fallback
+to the cached copy
+"""
+import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import requests
+
+import support
+
+cell = support.cell
+
+URL = "https://s3.amazonaws.com/bucket/net-whitelist.json"
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = headers or {}
+
+
+class FetchUrlTest(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix="cell-test-")
+        self.environ = dict(os.environ)
+        os.environ["HOME"] = self.home
+        # the responses, in order, an exception is raised
+        self.responses = []
+        self.requests = []
+        self.get = requests.get
+        requests.get = self.fake_get
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        requests.get = self.get
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.home)
+
+    def fake_get(self, url, headers=None, timeout=None):
+        self.requests.append((url, headers, timeout))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def test_revalidates_with_the_etag(self):
+        self.responses = [
+            FakeResponse(200, '{"networks": []}', {"ETag": '"v1"'}),
+            FakeResponse(304),
+        ]
+        self.assertEqual('{"networks": []}', cell.fetch_url(URL))
+        self.assertEqual({}, self.requests[0][1])
+        self.assertEqual('{"networks": []}', cell.fetch_url(URL))
+        self.assertEqual({"If-None-Match": '"v1"'}, self.requests[1][1])
+
+    def test_changed_body_replaces_the_cached_one(self):
+        self.responses = [
+            FakeResponse(200, "v1", {"Last-Modified": "Fri, 01 Jan 2016 00:00:00 GMT"}),
+            FakeResponse(200, "v2", {"ETag": '"v2"'}),
+            FakeResponse(304),
+        ]
+        cell.fetch_url(URL)
+        self.assertEqual("v2", cell.fetch_url(URL))
+        self.assertEqual({"If-Modified-Since": "Fri, 01 Jan 2016 00:00:00 GMT"},
+                         self.requests[1][1])
+        self.assertEqual("v2", cell.fetch_url(URL))
+        self.assertEqual({"If-None-Match": '"v2"'}, self.requests[2][1])
+
+    def test_fresh_copy_is_used_without_a_request(self):
+        self.responses = [FakeResponse(200, "v1")]
+        cell.fetch_url(URL, max_age=60)
+        self.assertEqual("v1", cell.fetch_url(URL, max_age=60))
+        self.assertEqual(1, len(self.requests))
+
+    def test_timeout(self):
+        os.environ["HTTP_TIMEOUT"] = "0.5"
+        self.responses = [FakeResponse(200, "v1")]
+        cell.fetch_url(URL)
+        self.assertEqual(0.5, self.requests[0][2])
+
+    def test_failed_request_falls_back_to_the_cache(self):
+        self.responses = [
+            FakeResponse(200, "v1"),
+            requests.exceptions.ConnectTimeout("timed out"),
+            FakeResponse(503, "Slow Down"),
+        ]
+        cell.fetch_url(URL)
+        self.assertEqual("v1", cell.fetch_url(URL))
+        self.assertIn("WARNING: using the cached copy of {}".format(URL),
+                      sys.stderr.getvalue())
+        self.assertEqual("v1", cell.fetch_url(URL))
+
+    def test_failed_request_without_cache(self):
+        self.responses = [requests.exceptions.ConnectionError("refused")]
+        self.assertIsNone(cell.fetch_url(URL))
+
+    def test_binary(self):
+        self.responses = [FakeResponse(200, "PK\x03\x04"), FakeResponse(304)]
+        self.assertEqual(b"PK\x03\x04", cell.fetch_url(URL, binary=True))
+        self.assertEqual(b"PK\x03\x04", cell.fetch_url(URL, binary=True))
+
+    def test_readify_fetches_urls(self):
+        self.responses = [FakeResponse(200, "v1")]
+        self.assertEqual("v1", cell.readify(URL, max_age=60))
+        self.assertEqual("v1", cell.readify(URL, max_age=60))
+        self.assertEqual(1, len(self.requests))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+The instance inventory: read page by page, cached unless the cell is too
+large, and printed in table sections
+"""
+import StringIO
+import sys
+import unittest
+
+import support
+
+cell = support.cell
+
+
+class IterInventoryTest(support.LocalCellTestCase):
+    cells = "test:20"
+
+    def setUp(self):
+        super(IterInventoryTest, self).setUp()
+        self.backend = self.cell("list", "test", "--no-cache").backend
+        self.local = sys.modules[type(self.backend).__module__]
+        self.page_sizes = dict(self.local.PAGE_SIZES)
+        self.local.PAGE_SIZES["DescribeInstances"] = 7
+        self.max_instances = self.local.aws.INVENTORY_CACHE_MAX_INSTANCES
+
+    def tearDown(self):
+        self.local.PAGE_SIZES.update(self.page_sizes)
+        self.local.aws.INVENTORY_CACHE_MAX_INSTANCES = self.max_instances
+        super(IterInventoryTest, self).tearDown()
+
+    def describe_instances_calls(self):
+        return self.backend.account.calls["ec2.DescribeInstances"]
+
+    def cached(self):
+        return self.local.aws.InventoryCache(
+            self.cache_path("test"), ttl=60).lookup("inventory")
+
+    def test_all_pages_are_read(self):
+        rows = list(self.backend.iter_inventory())
+        self.assertEqual(20, len(rows))
+        self.assertEqual(20, len(set(row[2] for _, row in rows)))
+        self.assertEqual(3, self.describe_instances_calls())
+        self.assertEqual(20, sum(len(records)
+                                 for records in self.cached().values()))
+
+    def test_rows_are_streamed(self):
+        rows = self.backend.iter_inventory()
+        next(rows)
+        self.assertEqual(1, self.describe_instances_calls())
+        # not cached until the last page is read
+        self.assertIsNone(self.cached())
+
+    def test_large_inventories_are_not_cached(self):
+        self.local.aws.INVENTORY_CACHE_MAX_INSTANCES = 19
+        self.assertEqual(20, len(list(self.backend.iter_inventory())))
+        self.assertIsNone(self.cached())
+        self.local.aws.INVENTORY_CACHE_MAX_INSTANCES = 20
+        self.assertEqual(20, len(list(self.backend.iter_inventory())))
+        self.assertIsNotNone(self.cached())
+
+
+class PrintTablesTest(unittest.TestCase):
+    def setUp(self):
+        self.tabulate = cell.tabulate
+        cell.tabulate = lambda title, rows: "{}: {}\n".format(
+            title, " ".join(str(row) for row in rows))
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        cell.tabulate = self.tabulate
+
+    def test_print_table_sections(self):
+        cell.print_table("nucleus", iter(range(5)), chunk=2)
+        self.assertEqual("nucleus: 0 1\nnucleus: 2 3\nnucleus: 4\n\n",
+                         sys.stdout.getvalue())
+
+    def test_print_tables_sections(self):
+        def rows():
+            for i in range(3):
+                yield "membrane", i
+                yield "bastion", i
+            # the full membrane section is written before the end
+            assert sys.stdout.getvalue() == "membrane: 0 1\n"
+            yield "nucleus", 3
+        cell.print_tables(rows(), ["nucleus", "membrane"], chunk=2)
+        self.assertEqual("membrane: 0 1\nnucleus: 3\n\nmembrane: 2\n\n",
+                         sys.stdout.getvalue())
+
+    def test_iter_flatten(self):
+        def rows():
+            yield ["10.0.0.1"]
+            yield ["10.0.0.2", ["10.0.0.3"]]
+        self.assertEqual(["10.0.0.1", "10.0.0.2", "10.0.0.3"],
+                         list(cell.iter_flatten(rows())))
+        self.assertEqual(["a", "b", "c", "d", "e"],
+                         cell.flatten([["a", "b", "c"], "d", [["e"]]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
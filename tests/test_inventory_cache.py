@@ -0,0 +1,110 @@
+"""
+InventoryCache expiry and invalidation, and the cell existence check of the
+commands that change a cell
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import support
+
+aws = support.load_backend("aws")
+
+
+class InventoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="cell-test-")
+        self.path = os.path.join(self.dir, "inventory.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get_loads_once_until_expired(self):
+        cache = aws.InventoryCache(self.path, ttl=60)
+        loads = []
+
+        def loader():
+            loads.append(True)
+            return {"nucleus": [["10.0.0.1"]]}
+        self.assertEqual({"nucleus": [["10.0.0.1"]]}, cache.get("inventory", loader))
+        self.assertEqual({"nucleus": [["10.0.0.1"]]}, cache.get("inventory", loader))
+        self.assertEqual(1, len(loads))
+        # another process reads the same file
+        self.assertEqual({"nucleus": [["10.0.0.1"]]},
+                         aws.InventoryCache(self.path, ttl=60).lookup("inventory"))
+
+    def test_expired_entries_are_reloaded(self):
+        cache = aws.InventoryCache(self.path, ttl=60)
+        cache.put("stack", {"StackId": "old"})
+        with open(self.path) as f:
+            entries = json.load(f)
+        entries["stack"]["time"] = time.time() - 61
+        with open(self.path, "w") as f:
+            json.dump(entries, f)
+        self.assertIsNone(cache.lookup("stack"))
+        self.assertEqual({"StackId": "new"},
+                         cache.get("stack", lambda: {"StackId": "new"}))
+
+    def test_empty_values_are_not_cached(self):
+        cache = aws.InventoryCache(self.path, ttl=60)
+        cache.put("inventory", {})
+        self.assertIsNone(cache.lookup("inventory"))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_disabled_cache_still_writes(self):
+        # --no-cache ignores the cached values but refreshes them
+        aws.InventoryCache(self.path, ttl=60, enabled=False).put("stack", {"a": 1})
+        self.assertIsNone(
+            aws.InventoryCache(self.path, ttl=60, enabled=False).lookup("stack"))
+        self.assertEqual({"a": 1},
+                         aws.InventoryCache(self.path, ttl=60).lookup("stack"))
+
+    def test_invalidate_and_discard(self):
+        cache = aws.InventoryCache(self.path, ttl=60)
+        cache.put("stack", {"a": 1})
+        cache.put("load_balancers", [["c1-mesos", "dns"]])
+        cache.discard("stack")
+        self.assertIsNone(cache.lookup("stack"))
+        self.assertEqual([["c1-mesos", "dns"]], cache.lookup("load_balancers"))
+        cache.invalidate()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(cache.lookup("load_balancers"))
+
+
+class CellExistsTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def cache_ghost_stack(self):
+        """
+        Caches the stack of a cell that no longer exists
+        """
+        path = self.cache_path("ghost")
+        os.makedirs(os.path.dirname(path))
+        aws.InventoryCache(path, ttl=60).put(
+            "stack", {"StackId": "ghost", "StackName": "ghost",
+                      "StackStatus": "CREATE_COMPLETE"})
+        return path
+
+    def test_read_only_commands_trust_the_cache(self):
+        self.cache_ghost_stack()
+        self.assertTrue(self.cell("list", "ghost").backend.cell_exists())
+
+    def test_mutating_commands_check_the_stack(self):
+        path = self.cache_ghost_stack()
+        code, out, _ = self.run_cell("update", "ghost")
+        self.assertEqual(1, code)
+        self.assertIn("Cell ghost does not exist", out)
+        # and the stale snapshot is dropped
+        self.assertIsNone(aws.InventoryCache(path, ttl=60).lookup("stack"))
+
+    def test_mutating_commands_refresh_the_snapshot(self):
+        self.assertEqual(0, self.run_cell("seed", "test")[0])
+        stack = aws.InventoryCache(self.cache_path("test"), ttl=60).lookup("stack")
+        self.assertEqual("test", stack["StackName"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+`cell list <cell-name>` renders each lookup (instances, egress IP, load
+balancers) on its own: a failed or slow lookup is reported in red, the
+other sections are still printed. `--refresh` drops the cached lookups
+"""
+import StringIO
+import json
+import os
+import sys
+import time
+import unittest
+
+import support
+
+
+class ListLookupsTest(support.LocalCellTestCase):
+    cells = "test:20"
+
+    def run_list(self, describe_inventory, *args):
+        """
+        Runs `list test` with the describe_instances pages replaced
+        :return: (exit code, stdout)
+        """
+        c = self.cell("list", "test", "--no-cache", *args)
+        # the sessions and clients are created up front, not within the
+        # lookup timeout
+        c.backend.nat_egress_ip()
+        c.backend.load_balancers()
+        c.backend._AwsBackend__describe_inventory = describe_inventory
+        stdout = StringIO.StringIO()
+        saved, sys.stdout = sys.stdout, stdout
+        try:
+            code = c.run()
+        finally:
+            sys.stdout = saved
+        return code, stdout.getvalue()
+
+    def test_failed_instances_lookup(self):
+        def describe_inventory():
+            yield "nucleus", {"PublicIpAddress": "1.2.3.4"}
+            raise Exception("Rate exceeded")
+        code, out = self.run_list(describe_inventory)
+        self.assertIn(code, [None, 0])
+        self.assertIn("instances: Rate exceeded", out)
+        self.assertNotIn("1.2.3.4", out)
+        self.assertIn("Egress IP", out)
+        self.assertIn("Load Balancers", out)
+        self.assertIn("Core Services", out)
+
+    def test_slow_instances_lookup(self):
+        os.environ["AWS_LOOKUP_TIMEOUT"] = "0.5"
+
+        def describe_inventory():
+            time.sleep(3)
+            yield "nucleus", {"PublicIpAddress": "1.2.3.4"}
+        start = time.time()
+        _, out = self.run_list(describe_inventory)
+        self.assertLess(time.time() - start, 2.5)
+        self.assertIn("instances timed out after 0.5s", out)
+        self.assertIn("Egress IP", out)
+        self.assertIn("Load Balancers", out)
+
+
+class ListRefreshTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def cache_stale_load_balancers(self):
+        aws = sys.modules[type(self.cell("list", "test").backend).__module__].aws
+        path = self.cache_path("test")
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        aws.InventoryCache(path, ttl=60).put(
+            "load_balancers", [["test-gone-mesos", "gone.elb.amazonaws.com"]])
+
+    def test_list_shows_the_cache(self):
+        self.cache_stale_load_balancers()
+        code, out, _ = self.run_cell("list", "test")
+        self.assertEqual(0, code)
+        self.assertIn("test-gone-mesos", out)
+
+    def test_refresh_drops_the_cache(self):
+        self.cache_stale_load_balancers()
+        code, out, _ = self.run_cell("list", "test", "--refresh")
+        self.assertEqual(0, code)
+        self.assertNotIn("test-gone-mesos", out)
+        self.assertIn("Load Balancers", out)
+        # and caches the fresh lookups
+        code, out, _ = self.run_cell("list", "test")
+        self.assertNotIn("test-gone-mesos", out)
+
+    def test_refresh_the_cell_listing(self):
+        self.assertEqual(0, self.run_cell("list")[0])
+        # a cell deleted by someone else
+        catalog = os.path.join(self.home, ".cellos", "generated", "stacks.json")
+        with open(catalog) as f:
+            stacks = json.load(f)
+        stacks["us-west-1"]["value"].append(
+            ["gone", "us-west-1", "CREATE_COMPLETE", "1.3.0", "2016-01-01"])
+        with open(catalog, "w") as f:
+            json.dump(stacks, f)
+        self.assertIn("gone", self.run_cell("list")[1])
+        code, out, _ = self.run_cell("list", "--refresh")
+        self.assertEqual(0, code)
+        self.assertNotIn("gone", out)
+        self.assertIn("test", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
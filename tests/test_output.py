@@ -0,0 +1,138 @@
+"""
+`--output table|json|ndjson|tsv`: RowWriter sections, and stdout kept
+parseable by the machine readable formats
+"""
+import StringIO
+import collections
+import json
+import os
+import sys
+import unittest
+
+import support
+
+cell = support.cell
+
+
+class RowWriterTest(unittest.TestCase):
+    def write(self, format, sections):
+        """
+        :param sections: list of (section, columns, rows)
+        :return: what the RowWriter wrote
+        """
+        stream = StringIO.StringIO()
+        output = cell.RowWriter(format, stream)
+        for section, columns, rows in sections:
+            output.rows(section, columns, iter(rows))
+        output.close()
+        return stream.getvalue()
+
+    sections = [
+        ("stacks", ["name", "region"], [["a", "us-west-1"], ["b", None]]),
+        ("summary", ["ip", "exit_code"], [["10.0.0.1", 0]]),
+    ]
+
+    def test_json(self):
+        document = json.loads(self.write("json", self.sections),
+                              object_pairs_hook=collections.OrderedDict)
+        self.assertEqual(["stacks", "summary"], list(document))
+        self.assertEqual([{"name": "a", "region": "us-west-1"},
+                          {"name": "b", "region": None}], document["stacks"])
+        self.assertEqual(["ip", "exit_code"], list(document["summary"][0]))
+        self.assertEqual({}, json.loads(self.write("json", [])))
+
+    def test_json_section_without_rows(self):
+        document = json.loads(self.write("json", [
+            ("stacks", ["name"], []),
+            ("summary", ["ip"], [["10.0.0.1"]]),
+        ]))
+        # a section is opened by its first row
+        self.assertEqual({"summary": [{"ip": "10.0.0.1"}]}, document)
+
+    def test_ndjson(self):
+        lines = self.write("ndjson", self.sections).splitlines()
+        self.assertEqual(3, len(lines))
+        records = [json.loads(line, object_pairs_hook=collections.OrderedDict)
+                   for line in lines]
+        self.assertEqual(["section", "name", "region"], list(records[0]))
+        self.assertEqual({"section": "stacks", "name": "b", "region": None},
+                         records[1])
+        self.assertEqual({"section": "summary", "ip": "10.0.0.1",
+                          "exit_code": 0}, records[2])
+
+    def test_tsv(self):
+        self.assertEqual("stacks\ta\tus-west-1\n"
+                         "stacks\tb\t\n"
+                         "summary\t10.0.0.1\t0\n",
+                         self.write("tsv", self.sections))
+
+    def test_tsv_keeps_one_line_per_row(self):
+        self.assertEqual("output\t10.0.0.1\ta b\tc d\n", self.write("tsv", [
+            ("output", ["ip", "line", "more"], [["10.0.0.1", "a\tb", "c\nd"]]),
+        ]))
+
+    def test_unknown_format(self):
+        self.assertRaises(Exception, cell.RowWriter, "yaml")
+
+
+class StructuredOutputTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def test_list(self):
+        code, out, _ = self.run_cell("list", "test", "--output", "json")
+        self.assertEqual(0, code)
+        document = json.loads(out, object_pairs_hook=collections.OrderedDict)
+        # in the order the lookups complete
+        self.assertEqual(set(["instances", "egress_ip", "load_balancers",
+                              "status_page", "local_files", "core_services"]),
+                         set(document))
+        self.assertEqual(5, len(document["instances"]))
+        self.assertEqual(["role"] + cell.INSTANCE_COLUMNS,
+                         list(document["instances"][0]))
+
+    def test_cmd(self):
+        code, out, err = self.run_cell("cmd", "test", "all", "*", "uptime",
+                                       "--output", "ndjson")
+        self.assertEqual(0, code)
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(set(["summary"]),
+                         set(record["section"] for record in records))
+        self.assertIn("0 of 4 nodes failed", err)
+
+    def test_scale(self):
+        code, out, err = self.run_cell("scale", "test", "stateless-body", "3",
+                                       "--output", "tsv")
+        self.assertEqual(0, code)
+        self.assertEqual("", out)
+        self.assertIn("Scaling test.stateless-body", err)
+
+    def test_closed_ssh_masters(self):
+        c = self.cell("cmd", "test", "all", "*", "uptime", "--output", "json")
+        master = os.path.join(c.ssh_control_dir(), "centos@10.0.0.1:22")
+        open(master, "w").close()
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        saved = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            c.close_ssh_masters()
+        finally:
+            sys.stdout, sys.stderr = saved
+        self.assertEqual("", stdout.getvalue())
+        self.assertEqual("CLOSED {}\n".format(master), stderr.getvalue())
+
+    def test_errors_go_to_stderr(self):
+        for format in ["json", "ndjson", "tsv"]:
+            code, out, err = self.run_cell("list", "missing", "--output", format)
+            self.assertEqual(1, code)
+            self.assertEqual("{}\n" if format == "json" else "", out)
+            self.assertIn("Traceback", err)
+            self.assertIn("list: Cell missing does not exist", err)
+
+    def test_errors_of_tables_stay_on_stdout(self):
+        code, out, _ = self.run_cell("list", "missing")
+        self.assertEqual(1, code)
+        self.assertIn("list: Cell missing does not exist", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,293 @@
+"""
+`cell proxy --supervise`: ProxyPool keeping its tunnels healthy and spread
+over the inventory, and relaying each connection to the least busy one
+"""
+import StringIO
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+import support
+
+cell = support.cell
+
+
+class FakeTunnel(object):
+    def __init__(self, node, port):
+        self.node = node
+        self.port = port
+        self.failures = 0
+        self.healthy = True
+        self.connections = 0
+        self.running = True
+        self.stopped = False
+
+    def stop(self):
+        self.healthy = False
+        self.stopped = True
+
+
+class Listener(object):
+    """
+    A local TCP server answering each connection with `reply` (echoing
+    what it reads when None), until the client is done
+    """
+    def __init__(self, reply=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.reply = reply
+        self.accepted = 0
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.accepted += 1
+            try:
+                if self.reply is not None:
+                    conn.sendall(self.reply)
+                for data in iter(lambda: conn.recv(4096), ""):
+                    if self.reply is None:
+                        conn.sendall(data)
+            finally:
+                conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class ProxyPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.inventory = ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+        self.lookups = []
+        # node -> probe results, True when not listed
+        self.probes = {}
+        self.socks_probe = cell.socks_probe
+        cell.socks_probe = self.fake_probe
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.pool = cell.ProxyPool(1234, 2, self.nodes, None, "proxy.log",
+                                   timeout=1)
+        self.pool.start_tunnel = self.start_tunnel
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        cell.socks_probe = self.socks_probe
+
+    def nodes(self, refresh):
+        self.lookups.append(refresh)
+        if isinstance(self.inventory, Exception):
+            raise self.inventory
+        return self.inventory
+
+    def fake_probe(self, port, node, timeout=5):
+        results = self.probes.get(node)
+        return results.pop(0) if results else True
+
+    def start_tunnel(self, node):
+        if self.probes.get(node) == [False]:
+            self.probes[node] = []
+            self.pool.failed[node] = 1
+            return None
+        return FakeTunnel(node, 20000 + len(self.pool.failed) +
+                          len(self.pool.tunnels))
+
+    def tunnel_nodes(self):
+        return [tunnel.node for tunnel in self.pool.tunnels]
+
+    def test_tunnels_to_different_nodes(self):
+        self.pool.check()
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], self.tunnel_nodes())
+        self.assertEqual([False], self.lookups)
+        # nothing to do while they are healthy
+        self.pool.check()
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], self.tunnel_nodes())
+
+    def test_failed_checks_replace_the_tunnel(self):
+        self.pool.check()
+        first = self.pool.tunnels[0]
+        self.probes["10.0.0.1"] = [False, False]
+        self.pool.check()
+        # a single failure only takes it out of rotation
+        self.assertIs(first, self.pool.tunnels[0])
+        self.assertFalse(first.healthy)
+        self.assertFalse(first.stopped)
+        self.pool.check()
+        self.assertTrue(first.stopped)
+        self.assertEqual(["10.0.0.2", "10.0.0.3"], self.tunnel_nodes())
+        # the inventory is looked up again, the node may have been replaced
+        self.assertEqual([False, False, True], self.lookups)
+        self.assertIn("tunnel to 10.0.0.1 down, reconnecting",
+                      sys.stdout.getvalue())
+
+    def test_recovered_tunnel_is_healthy_again(self):
+        self.pool.check()
+        self.probes["10.0.0.1"] = [False, True]
+        self.pool.check()
+        self.pool.check()
+        self.assertTrue(self.pool.tunnels[0].healthy)
+        self.assertEqual(0, self.pool.tunnels[0].failures)
+
+    def test_exited_tunnel_is_replaced_at_once(self):
+        self.pool.check()
+        self.pool.tunnels[1].running = False
+        self.pool.check()
+        self.assertEqual(["10.0.0.1", "10.0.0.3"], self.tunnel_nodes())
+        self.assertEqual([False, True], self.lookups)
+
+    def test_nodes_that_failed_recently_come_last(self):
+        self.probes["10.0.0.1"] = [False]
+        self.pool.check()
+        self.assertEqual(["10.0.0.2", "10.0.0.3"], self.tunnel_nodes())
+        self.inventory = ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+        self.pool.tunnels[0].running = False
+        self.pool.check()
+        self.assertEqual(["10.0.0.3", "10.0.0.4"], self.tunnel_nodes())
+
+    def test_node_left_the_inventory(self):
+        self.pool.check()
+        self.inventory = ["10.0.0.2", "10.0.0.3"]
+        self.pool.check()
+        self.assertEqual(["10.0.0.2", "10.0.0.3"], self.tunnel_nodes())
+        self.assertIn("tunnel to 10.0.0.1 closed, the node left the inventory",
+                      sys.stdout.getvalue())
+
+    def test_failed_lookup_keeps_the_tunnels(self):
+        self.pool.check()
+        self.inventory = IOError("throttled")
+        self.pool.check()
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], self.tunnel_nodes())
+        self.assertIn("inventory lookup failed: throttled", sys.stdout.getvalue())
+
+    def relay(self):
+        """
+        Sends a line through the pool
+        :return: the line read back
+        """
+        client, pool_side = socket.socketpair()
+        thread = threading.Thread(target=self.pool.connect, args=(pool_side,))
+        thread.start()
+        try:
+            client.sendall("ping\n")
+            client.shutdown(socket.SHUT_WR)
+            return "".join(iter(lambda: client.recv(4096), ""))
+        finally:
+            thread.join(10)
+            client.close()
+
+    def test_connections_go_to_the_least_busy_tunnel(self):
+        busy, idle, down = Listener(), Listener(), Listener()
+        try:
+            self.pool.tunnels = [FakeTunnel("10.0.0.1", busy.port),
+                                 FakeTunnel("10.0.0.2", idle.port),
+                                 FakeTunnel("10.0.0.3", down.port)]
+            self.pool.tunnels[0].connections = 3
+            self.pool.tunnels[2].healthy = False
+            self.assertEqual("ping\n", self.relay())
+            self.assertEqual([0, 1, 0], [busy.accepted, idle.accepted,
+                                         down.accepted])
+            self.assertEqual([3, 0, 0], [tunnel.connections
+                                         for tunnel in self.pool.tunnels])
+        finally:
+            for listener in [busy, idle, down]:
+                listener.close()
+
+    def test_unreachable_tunnel_is_skipped(self):
+        listener = Listener()
+        try:
+            self.pool.tunnels = [FakeTunnel("10.0.0.1", cell.free_port()),
+                                 FakeTunnel("10.0.0.2", listener.port)]
+            self.pool.tunnels[1].connections = 1
+            self.assertEqual("ping\n", self.relay())
+            self.assertFalse(self.pool.tunnels[0].healthy)
+            self.assertEqual(1, listener.accepted)
+        finally:
+            listener.close()
+
+    def test_no_healthy_tunnel_closes_the_connection(self):
+        client, pool_side = socket.socketpair()
+        try:
+            self.pool.connect(pool_side)
+            self.assertEqual("", client.recv(4096))
+        finally:
+            client.close()
+
+
+class StartTunnelTest(unittest.TestCase):
+    def setUp(self):
+        self.socks_probe = cell.socks_probe
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.log = tempfile.NamedTemporaryFile()
+        self.pool = cell.ProxyPool(1234, 1, None,
+                                   lambda node, port: ["sleep", "30"],
+                                   self.log.name, timeout=0.2)
+        self.pool.log_file = self.log
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        cell.socks_probe = self.socks_probe
+        self.log.close()
+
+    def test_started_once_probed(self):
+        cell.socks_probe = lambda port, node, timeout=5: True
+        tunnel = self.pool.start_tunnel("10.0.0.1")
+        try:
+            self.assertTrue(tunnel.healthy)
+            self.assertTrue(tunnel.running)
+            self.assertIn("tunnel to 10.0.0.1 up on localhost:{}".format(
+                tunnel.port), sys.stdout.getvalue())
+        finally:
+            tunnel.stop()
+        self.assertFalse(tunnel.running)
+
+    def test_failed_start(self):
+        cell.socks_probe = lambda port, node, timeout=5: False
+        self.assertIsNone(self.pool.start_tunnel("10.0.0.1"))
+        self.assertIn("10.0.0.1", self.pool.failed)
+        self.assertIn("tunnel to 10.0.0.1 failed, see {}".format(self.log.name),
+                      sys.stdout.getvalue())
+
+
+class SocksProbeTest(unittest.TestCase):
+    def probe(self, reply):
+        listener = Listener(reply)
+        try:
+            return cell.socks_probe(listener.port, "10.0.0.1", timeout=2)
+        finally:
+            listener.close()
+
+    def test_ssh_banner(self):
+        self.assertTrue(self.probe("\x05\x00" + "\x05\x00\x00\x01" +
+                                   socket.inet_aton("10.0.0.1") +
+                                   struct.pack(">H", 22) + "SSH-2.0-OpenSSH\r\n"))
+
+    def test_connect_refused(self):
+        # general SOCKS server failure
+        self.assertFalse(self.probe("\x05\x00" + "\x05\x01\x00\x01" +
+                                    "\x00" * 6))
+
+    def test_no_ssh_server(self):
+        self.assertFalse(self.probe("\x05\x00" + "\x05\x00\x00\x01" +
+                                    "\x00" * 6 + "HTTP"))
+
+    def test_not_a_socks_server(self):
+        self.assertFalse(self.probe("SSH-2.0-OpenSSH\r\n"))
+
+    def test_nothing_listening(self):
+        self.assertFalse(cell.socks_probe(cell.free_port(), "10.0.0.1",
+                                          timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""
+Uploads to the cell bucket: unchanged files are skipped. Bucket deletes:
+partial DeleteObjects errors are reported
+"""
+import StringIO
+import os
+import sys
+import unittest
+
+import support
+
+
+class S3TestCase(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def setUp(self):
+        super(S3TestCase, self).setUp()
+        self.backend = self.cell("list", "test").backend
+        # the module of the cell's backend, where LocalError is defined
+        self.local = sys.modules[type(self.backend).__module__]
+        self.client = self.backend.s3.meta.client
+        if self.backend.bucket not in self.backend.account.buckets:
+            self.client.create_bucket(Bucket=self.backend.bucket)
+        self.objects = self.backend.account.buckets[self.backend.bucket]["objects"]
+
+    def key(self, key):
+        return self.backend.base.full_cell + "/" + key
+
+    def write(self, name, content):
+        path = os.path.join(self.home, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def call(self, method, *args, **kwargs):
+        """
+        :return: the output of a backend method
+        """
+        stdout = StringIO.StringIO()
+        saved, sys.stdout = sys.stdout, stdout
+        try:
+            method(*args, **kwargs)
+        finally:
+            sys.stdout = saved
+        return stdout.getvalue()
+
+
+class UploadTest(S3TestCase):
+    def test_unchanged_files_are_skipped(self):
+        path = self.write("afile", "a")
+        self.assertIn("UPLOADED", self.call(self.backend.upload, path, "/config/"))
+        self.assertIn("SKIP", self.call(self.backend.upload, path, "/config/"))
+        self.write("afile", "b")
+        self.assertIn("UPLOADED", self.call(self.backend.upload, path, "/config/"))
+        self.assertEqual("b", self.objects[self.key("config/afile")]["Body"])
+
+    def test_changed_extra_args_upload_again(self):
+        path = self.write("afile", "a")
+        self.call(self.backend.upload, path, "/config/")
+        out = self.call(self.backend.upload, path, "/config/",
+                        {"ContentType": "text/plain"})
+        self.assertIn("UPLOADED", out)
+        self.assertIn("SKIP", self.call(self.backend.upload, path, "/config/",
+                                        {"ContentType": "text/plain"}))
+
+    def test_missing_and_forbidden_objects_are_uploaded(self):
+        path = self.write("afile", "a")
+
+        def head_object(params):
+            raise self.local.LocalError("403", "Forbidden", 403)
+        self.backend.account.s3_HeadObject = head_object
+        self.assertIn("UPLOADED", self.call(self.backend.upload, path, "afile"))
+
+    def test_other_head_errors_are_raised(self):
+        path = self.write("afile", "a")
+
+        def head_object(params):
+            raise self.local.LocalError("InternalError", "We encountered an "
+                                   "internal error", 500)
+        self.backend.account.s3_HeadObject = head_object
+        self.assertRaises(Exception, self.call, self.backend.upload, path, "afile")
+        self.assertNotIn(self.key("afile"), self.objects)
+
+    def test_upload_all_keys(self):
+        a, b = self.write("afile", "a"), self.write("bfile", "b")
+        self.call(self.backend.upload_all, [
+            (a, "/config/"),
+            (b, "/shared/cfile", {"ContentType": "text/plain"}),
+        ])
+        self.assertEqual("a", self.objects[self.key("config/afile")]["Body"])
+        self.assertEqual("b", self.objects[self.key("shared/cfile")]["Body"])
+
+
+class DeleteObjectsTest(S3TestCase):
+    def setUp(self):
+        super(DeleteObjectsTest, self).setUp()
+        for i in range(5):
+            self.client.put_object(Bucket=self.backend.bucket,
+                                   Key="other/{}".format(i), Body="x")
+
+    def delete_objects(self, **kwargs):
+        """
+        :return: (deleted count, output)
+        """
+        result = []
+        out = self.call(lambda: result.append(
+            self.backend.delete_objects(**kwargs)))
+        return result[0], out
+
+    def test_deletes_the_prefix(self):
+        bucket = self.backend.account.buckets[self.backend.bucket]
+        bucket["uploads"].append({"Key": "other/big", "UploadId": "u1"})
+        deleted, out = self.delete_objects(prefix="other/")
+        self.assertEqual(5, deleted)
+        self.assertIn("ABORT multipart upload", out)
+        self.assertEqual([], bucket["uploads"])
+        self.assertEqual([], [key for key in self.objects
+                              if key.startswith("other/")])
+        self.assertNotEqual([], list(self.objects))
+
+    def test_partial_errors_are_raised(self):
+        delete = self.backend.account.s3_DeleteObjects
+
+        def delete_objects(params):
+            failed = [item for item in params["Delete"]["Objects"]
+                      if item["Key"].endswith("3")]
+            params["Delete"]["Objects"] = [
+                item for item in params["Delete"]["Objects"]
+                if item not in failed]
+            delete(params)
+            return {"Errors": [{"Key": item["Key"], "Code": "AccessDenied",
+                                "Message": "Access Denied"}
+                               for item in failed]}
+        self.backend.account.s3_DeleteObjects = delete_objects
+        stdout = sys.stdout
+        sys.stdout = out = StringIO.StringIO()
+        try:
+            self.assertRaises(self.local.aws.DeleteException,
+                              self.backend.delete_objects, prefix="other/")
+        finally:
+            sys.stdout = stdout
+        self.assertIn("DELETED 4 objects", out.getvalue())
+        self.assertIn("ERROR deleting s3://{}/other/3: Access Denied".format(
+            self.backend.bucket), out.getvalue())
+        self.assertEqual(["other/3"], [key for key in self.objects
+                                       if key.startswith("other/")])
+
+    def test_failed_batches_are_raised(self):
+        def delete_objects(params):
+            raise self.local.LocalError("SlowDown", "Please reduce your "
+                                        "request rate.", 503)
+        self.backend.account.s3_DeleteObjects = delete_objects
+        stdout = sys.stdout
+        sys.stdout = out = StringIO.StringIO()
+        try:
+            with self.assertRaises(self.local.aws.DeleteException) as raised:
+                self.backend.delete_objects(prefix="other/")
+        finally:
+            sys.stdout = stdout
+        self.assertIn("DELETED 0 objects", out.getvalue())
+        self.assertIn("5 objects could not be deleted", str(raised.exception))
+        self.assertEqual(5, len([key for key in self.objects
+                                 if key.startswith("other/")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+"""
+`cell scale`: the scaling arguments, the scale down confirmation, and
+ScaleWaiter following a scaling group until its new instances are ready
+"""
+import StringIO
+import sys
+import unittest
+
+import support
+
+aws = support.load_backend("aws")
+
+
+class ScalingTargetsTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def targets(self, *scaling):
+        return self.cell("scale", "test", *scaling).scaling_targets()
+
+    def test_role_and_capacity(self):
+        self.assertEqual([("stateless-body", 20)],
+                         self.targets("stateless-body", "20").items())
+
+    def test_pairs_keep_their_order(self):
+        self.assertEqual([("stateless-body", 10), ("membrane", 3)],
+                         self.targets("stateless-body=10", "membrane=3").items())
+        self.assertEqual([("membrane", 3)], self.targets("membrane=3").items())
+
+    def test_invalid_scaling(self):
+        for scaling in [["membrane=x"], ["=3"], ["membrane=3", "5"],
+                        ["membrane", "three"], ["membrane"]]:
+            self.assertRaises(Exception, self.targets, *scaling)
+
+
+class TtyInput(StringIO.StringIO):
+    def isatty(self):
+        return True
+
+
+class ScaleDownTest(support.LocalCellTestCase):
+    cells = "test:20"
+
+    def test_confirmed(self):
+        code, out, _ = self.run_cell("scale", "test", "nucleus", "0", stdin="y\n")
+        self.assertEqual(0, code)
+        self.assertIn("WARNING: THIS WILL SCALE DOWN THE nucleus GROUP FROM 1 TO 0", out)
+        self.assertIn("Scaling test.nucleus", out)
+
+    def test_refused(self):
+        code, out, _ = self.run_cell("scale", "test", "nucleus", "0", stdin="n\n")
+        self.assertEqual(1, code)
+        self.assertIn("Aborting scale down operation", out)
+        self.assertNotIn("Scaling test.nucleus", out)
+        self.assertNotIn("Traceback", out)
+        # no input
+        self.assertEqual(1, self.run_cell("scale", "test", "nucleus", "0")[0])
+
+    def test_yes(self):
+        code, out, _ = self.run_cell("scale", "test", "nucleus", "0", "--yes")
+        self.assertEqual(0, code)
+        self.assertNotIn("WARNING", out)
+        self.assertIn("Scaling test.nucleus", out)
+
+    def test_machine_output_needs_yes(self):
+        code, out, err = self.run_cell("scale", "test", "nucleus", "0",
+                                       "--output", "json", stdin="y\n")
+        self.assertEqual(1, code)
+        self.assertIn("pass --yes to confirm", err)
+        self.assertIn("Aborting scale down operation", err)
+        self.assertNotIn("WARNING", out)
+        self.assertNotIn(">", out)
+
+    def test_machine_output_asks_on_a_terminal(self):
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        saved = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin, sys.stdout, sys.stderr = TtyInput("yes\n"), stdout, stderr
+        try:
+            code = self.cell("scale", "test", "nucleus", "0",
+                             "--output", "json").run()
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved
+        self.assertEqual(0, code)
+        self.assertIn("Are you sure ? (y/N)\n>", stderr.getvalue())
+        self.assertNotIn(">", stdout.getvalue())
+
+
+class FakeAutoScaling(object):
+    def __init__(self):
+        self.instances = []
+        self.activities = []
+        self.load_balancers = []
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames):
+        return {"AutoScalingGroups": [{
+            "AutoScalingGroupName": AutoScalingGroupNames[0],
+            "Instances": [dict(instance) for instance in self.instances],
+            "LoadBalancerNames": self.load_balancers,
+        }]}
+
+    def describe_scaling_activities(self, AutoScalingGroupName):
+        # newest first
+        return {"Activities": list(reversed(self.activities))}
+
+
+class FakeLoadBalancing(object):
+    def __init__(self):
+        self.healthy = set()
+
+    def describe_instance_health(self, LoadBalancerName):
+        return {"InstanceStates": [
+            {"InstanceId": instance_id, "State": "InService"}
+            for instance_id in self.healthy]}
+
+
+class FakeBackend(object):
+    def __init__(self):
+        self.asg = FakeAutoScaling()
+        self.elb = FakeLoadBalancing()
+        # instance id -> status lines
+        self.status = {}
+
+    def provisioning_status(self, instance_id):
+        return self.status.get(instance_id)
+
+
+class ScaleWaiterTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.launch("i-old", "InService")
+        self.backend.asg.activities.append({
+            "ActivityId": "a0", "StatusCode": "Successful",
+            "Description": "Launching a new EC2 instance: i-old"})
+        self.waiter = aws.ScaleWaiter(self.backend, "membrane", "group", 2)
+
+    def launch(self, instance_id, state):
+        self.backend.asg.instances = [
+            instance for instance in self.backend.asg.instances
+            if instance["InstanceId"] != instance_id
+        ] + [{"InstanceId": instance_id, "LifecycleState": state}]
+
+    def test_new_instance_ready(self):
+        self.backend.asg.load_balancers = ["test-lb-gateway"]
+        self.launch("i-new", "Pending")
+        self.assertEqual([], self.waiter.poll())
+        self.assertFalse(self.waiter.done)
+
+        self.launch("i-new", "InService")
+        self.backend.asg.activities.append({
+            "ActivityId": "a1", "StatusCode": "Successful",
+            "Description": "Launching a new EC2 instance: i-new"})
+        self.backend.status["i-new"] = [["membrane", "start", "0"],
+                                        ["membrane", "end", "1"]]
+        # provisioned, not yet healthy behind the load balancer
+        self.assertEqual(
+            [["membrane", "Successful", "Launching a new EC2 instance: i-new"]],
+            self.waiter.poll())
+        self.assertFalse(self.waiter.done)
+
+        self.backend.elb.healthy.add("i-new")
+        events = self.waiter.poll()
+        self.assertEqual(1, len(events))
+        self.assertEqual(["membrane", "i-new"], events[0][:2])
+        self.assertTrue(events[0][2].startswith("ready in "))
+        self.assertEqual(["i-new"], list(self.waiter.ready))
+        self.assertTrue(self.waiter.done)
+        self.assertEqual([], self.waiter.poll())
+
+    def test_failed_provisioning(self):
+        self.launch("i-new", "InService")
+        self.backend.status["i-new"] = [["membrane", "start", "0"],
+                                        ["docker", "failed", "1"]]
+        self.assertEqual([["membrane", "i-new", "docker failed"]],
+                         self.waiter.poll())
+        self.assertEqual({"i-new": "docker failed"}, dict(self.waiter.failed))
+        self.assertTrue(self.waiter.done)
+
+    def test_not_reported_yet(self):
+        self.launch("i-new", "InService")
+        self.assertEqual([], self.waiter.poll())
+        self.assertFalse(self.waiter.done)
+
+    def test_scale_down(self):
+        self.waiter = aws.ScaleWaiter(self.backend, "membrane", "group", 0)
+        self.assertFalse(self.waiter.poll() or self.waiter.done)
+        self.backend.asg.instances = []
+        self.waiter.poll()
+        self.assertTrue(self.waiter.done)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+seed.tar.gz is reproducible and only rebuilt when its contents change
+"""
+import StringIO
+import json
+import os
+import sys
+import tarfile
+import unittest
+
+import support
+
+
+class SeedArchiveTest(support.LocalCellTestCase):
+    cells = "test:5"
+
+    def build_seed(self):
+        """
+        :return: the output of build_seed
+        """
+        c = self.cell("seed", "test")
+        stdout = StringIO.StringIO()
+        saved, sys.stdout = sys.stdout, stdout
+        try:
+            c.build_seed()
+        finally:
+            sys.stdout = saved
+        self.archive = c.tmp("seed.tar.gz")
+        return stdout.getvalue()
+
+    def read_archive(self):
+        with open(self.archive, "rb") as f:
+            return f.read()
+
+    def test_unchanged_seed_is_not_rebuilt(self):
+        self.assertIn("BUILT", self.build_seed())
+        built = self.read_archive()
+        self.assertIn("Seed unchanged", self.build_seed())
+        # a rebuild gives the same bytes
+        os.remove(self.archive)
+        self.assertIn("BUILT", self.build_seed())
+        self.assertEqual(built, self.read_archive())
+
+    def test_whitelist_change_rebuilds_the_seed(self):
+        self.build_seed()
+        with open(os.environ["NET_WHITELIST_URL"], "w") as f:
+            json.dump({"networks": [
+                {"net_address": "192.168.0.0", "net_mask": 16},
+            ]}, f)
+        self.assertIn("BUILT", self.build_seed())
+        with tarfile.open(self.archive) as tar:
+            whitelist = json.load(
+                tar.extractfile("seed/config/net-whitelist.json"))
+        self.assertEqual([{"addr": "192.168.0.0", "mask": 16}], whitelist)
+
+    def test_entries_are_normalized(self):
+        self.build_seed()
+        with tarfile.open(self.archive) as tar:
+            members = tar.getmembers()
+        names = [member.name for member in members]
+        self.assertEqual(sorted(names), names)
+        self.assertIn("seed/config/net-whitelist.json", names)
+        for member in members:
+            self.assertEqual(support.cell.SEED_MTIME, member.mtime)
+            self.assertEqual((0, 0), (member.uid, member.gid))
+            self.assertIn(member.mode, [0755, 0644])
+            if member.isdir():
+                self.assertEqual(0755, member.mode)
+
+
+if __name__ == "__main__":
+    unittest.main()
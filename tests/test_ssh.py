@@ -0,0 +1,61 @@
+"""
+The ssh configuration and the connection sharing of the ssh commands
+"""
+import os
+import unittest
+
+import support
+
+
+class SshTest(support.LocalCellTestCase):
+    cells = "test:20"
+
+    def setUp(self):
+        super(SshTest, self).setUp()
+        # records the arguments of each ssh call
+        self.calls = os.path.join(self.home, "ssh.calls")
+        path = os.path.join(self.home, "bin", "ssh")
+        with open(path, "w") as f:
+            f.write('#!/bin/sh\necho "$@" >> {}\n'.format(self.calls))
+        os.chmod(path, 0o755)
+
+    def ssh_calls(self):
+        with open(self.calls) as f:
+            return f.read().splitlines()
+
+    def test_ssh_config_shares_connections(self):
+        c = self.cell("ssh", "test", "nucleus", "1")
+        c.ensure_ssh_config()
+        with open(c.tmp("ssh_config")) as f:
+            config = f.read()
+        self.assertIn("ControlMaster auto", config)
+        self.assertIn("ControlPath {}/%C".format(c.ssh_control_dir()), config)
+        self.assertIn("ControlPersist 10m", config)
+
+    def test_no_connection_sharing(self):
+        os.environ["SSH_CONTROL_PERSIST"] = "no"
+        c = self.cell("ssh", "test", "nucleus", "1")
+        c.ensure_ssh_config()
+        with open(c.tmp("ssh_config")) as f:
+            self.assertNotIn("ControlMaster", f.read())
+
+    def test_fan_out_leaves_no_master_per_node(self):
+        code, _, _ = self.run_cell("cmd", "test", "all", "*", "uptime")
+        self.assertEqual(0, code)
+        calls = self.ssh_calls()
+        self.assertEqual(len(calls), 19)
+        for call in calls:
+            self.assertIn("-o ControlMaster=no", call)
+
+    def test_disconnect_closes_the_control_sockets(self):
+        c = self.cell("disconnect", "test")
+        socket = os.path.join(c.ssh_control_dir(), "0123abcd")
+        open(socket, "w").close()
+        self.assertEqual([socket], c.ssh_master_sockets())
+        self.assertEqual(0, self.run_cell("disconnect", "test")[0])
+        self.assertFalse(os.path.exists(socket))
+        self.assertIn("-S {} -O exit cell".format(socket), self.ssh_calls())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+StackEventTailer: incremental polling by EventId, nested stacks, final status
+"""
+import datetime
+import unittest
+
+import support
+
+aws = support.load_backend("aws")
+
+
+class FakePaginator(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, StackName):
+        return self.pages(StackName)
+
+
+class FakeCloudFormation(object):
+    """
+    The stack events, newest first, in pages of `page_size`
+    """
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.events = {}
+        self.resources = {}
+        self.failing = set()
+        self.clock = 0
+
+    def event(self, stack, resource, status, physical_id=None,
+              resource_type="AWS::EC2::Instance"):
+        self.clock += 1
+        self.events.setdefault(stack, []).insert(0, {
+            "EventId": "{}-{}".format(stack, self.clock),
+            "StackId": stack,
+            "StackName": stack,
+            "LogicalResourceId": resource,
+            "PhysicalResourceId": physical_id,
+            "ResourceType": resource_type,
+            "ResourceStatus": status,
+            "Timestamp": datetime.datetime(2016, 1, 1) +
+            datetime.timedelta(seconds=self.clock),
+        })
+
+    def get_paginator(self, operation):
+        if operation == "list_stack_resources":
+            return FakePaginator(lambda stack: [{
+                "StackResourceSummaries": self.resources.get(stack, [])}])
+
+        def pages(stack):
+            if stack in self.failing:
+                raise Exception("Rate exceeded")
+            events = self.events.get(stack, [])
+            return [{"StackEvents": events[i:i + self.page_size]}
+                    for i in range(0, max(len(events), 1), self.page_size)]
+        return FakePaginator(pages)
+
+
+class StackEventTailerTest(unittest.TestCase):
+    def setUp(self):
+        self.cfn = FakeCloudFormation()
+        self.tailer = aws.StackEventTailer(self.cfn, "c1", timeout=5)
+
+    def ids(self, events):
+        return [event["EventId"] for event in events]
+
+    def test_first_poll_returns_the_latest_page(self):
+        for i in range(5):
+            self.cfn.event("c1", "r{}".format(i), "CREATE_IN_PROGRESS")
+        self.assertEqual(["c1-4", "c1-5"], self.ids(self.tailer.poll()))
+
+    def test_polls_return_each_event_once(self):
+        self.cfn.event("c1", "r1", "CREATE_IN_PROGRESS")
+        self.assertEqual(["c1-1"], self.ids(self.tailer.poll()))
+        self.assertEqual([], self.tailer.poll())
+        # more than a page of new events
+        for i in range(3):
+            self.cfn.event("c1", "r{}".format(i), "CREATE_COMPLETE")
+        self.assertEqual(["c1-2", "c1-3", "c1-4"], self.ids(self.tailer.poll()))
+        self.assertEqual([], self.tailer.poll())
+
+    def test_interval_backs_off_while_nothing_changes(self):
+        self.tailer.poll()
+        self.assertEqual(4, self.tailer.interval)
+        self.tailer.poll()
+        self.assertEqual(8, self.tailer.interval)
+        self.cfn.event("c1", "r1", "CREATE_IN_PROGRESS")
+        self.tailer.poll()
+        self.assertEqual(2, self.tailer.interval)
+
+    def test_nested_stacks(self):
+        self.cfn.resources["c1"] = [{
+            "PhysicalResourceId": "c1-Nucleus",
+            "ResourceType": "AWS::CloudFormation::Stack"}]
+        self.cfn.event("c1-Nucleus", "NucleusGroup", "CREATE_IN_PROGRESS")
+        self.assertEqual(["c1-Nucleus-1"], self.ids(self.tailer.poll()))
+        # a nested stack created since the previous poll
+        self.cfn.event("c1", "Membrane", "CREATE_IN_PROGRESS",
+                       physical_id="c1-Membrane",
+                       resource_type="AWS::CloudFormation::Stack")
+        self.assertEqual(["c1-2"], self.ids(self.tailer.poll()))
+        self.cfn.event("c1-Membrane", "MembraneGroup", "CREATE_IN_PROGRESS")
+        self.assertEqual(["c1-Membrane-3"], self.ids(self.tailer.poll()))
+
+    def test_status_of_the_root_stack(self):
+        self.cfn.event("c1", "c1", "CREATE_IN_PROGRESS", physical_id="c1")
+        self.tailer.poll()
+        self.assertFalse(self.tailer.done)
+        self.cfn.event("c1", "c1", "ROLLBACK_COMPLETE", physical_id="c1")
+        self.tailer.poll()
+        self.assertTrue(self.tailer.done)
+        self.assertFalse(self.tailer.succeeded)
+
+    def test_skip_existing(self):
+        self.cfn.event("c1", "c1", "CREATE_COMPLETE", physical_id="c1")
+        self.tailer.skip_existing()
+        self.assertIsNone(self.tailer.status)
+        self.cfn.event("c1", "c1", "UPDATE_COMPLETE", physical_id="c1")
+        self.assertEqual(["c1-2"], self.ids(self.tailer.poll()))
+        self.assertTrue(self.tailer.succeeded)
+
+    def test_failed_poll_raises_and_loses_no_event(self):
+        self.cfn.resources["c1"] = [{
+            "PhysicalResourceId": "c1-Nucleus",
+            "ResourceType": "AWS::CloudFormation::Stack"}]
+        self.tailer.poll()
+        self.cfn.event("c1", "r1", "CREATE_IN_PROGRESS")
+        self.cfn.failing.add("c1-Nucleus")
+        self.assertRaises(Exception, self.tailer.poll)
+        self.cfn.failing.clear()
+        self.assertEqual(["c1-1"], self.ids(self.tailer.poll()))
+
+
+if __name__ == "__main__":
+    unittest.main()
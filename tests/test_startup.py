@@ -0,0 +1,38 @@
+"""
+Runs the CLI startup probe of benchmarks/startup.py for every subcommand and
+fails when a heavy module gets imported before the command is dispatched.
+
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(DIR, "benchmarks"))
+
+import startup
+
+
+class StartupTest(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix="cell-test-")
+        os.makedirs(os.path.join(self.home, ".cellos"))
+        with open(os.path.join(self.home, ".cellos", "config"), "w") as f:
+            f.write("[default]\nregion=us-west-1\n")
+        self.env = dict(os.environ, HOME=self.home)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def test_no_heavy_imports_before_dispatch(self):
+        for args in startup.SUBCOMMANDS:
+            _, loaded, _ = startup.run_probe(args, self.env)
+            self.assertEqual([], loaded, "{} loaded {}".format(
+                " ".join(args), ", ".join(loaded)))
+
+
+if __name__ == "__main__":
+    unittest.main()